@@ -7,10 +7,15 @@ import json
 import base64
 import uuid
 import logging
+import threading
 from market_maker.settings import settings
 from market_maker.auth.bitmex import APIKeyAuthWithExpires
 from market_maker.utils.bitmex import constants, errors
-from market_maker.ws.bitmex.ws_thread import BitMEXWebsocket
+from market_maker.utils.bitmex.rate_limiter import RateLimiter, PRIORITY_CANCEL
+from market_maker.utils.dead_mans_switch import DeadMansSwitch
+from market_maker.utils.rest_stats import RestStats
+from market_maker.utils.retry import RetryableError, RetryPolicy, RetryPolicies, call_with_retry
+from market_maker.ws.bitmex.ws_thread import BitMEXWebsocket, instrumentToTicker
 from market_maker.exchange import BaseExchange
 from market_maker.exchange import ExchangeInfo
 
@@ -22,7 +27,7 @@ class BitMEX(BaseExchange):
 
     def __init__(self, symbol=None,
                  orderIDPrefix='mm_bitmex_', shouldWSAuth=True, postOnly=False, timeout=7,
-                 retries=24, retry_delay=5):
+                 retries=24, retry_delay=5, orderBookTable=None, captureFile=None, cancelAllAfter=None):
         """Init connector."""
         self.logger = logging.getLogger('root')
         self.base_url = ExchangeInfo.get_baseurl()
@@ -33,7 +38,10 @@ class BitMEX(BaseExchange):
         if len(orderIDPrefix) > 13:
             raise ValueError("settings.ORDERID_PREFIX must be at most 13 characters long!")
         self.orderIDPrefix = orderIDPrefix
-        self.retries = 0  # initialize counter
+        # Paces requests under the REST rate limit; cancels go ahead of creates and amends
+        self.rate_limiter = RateLimiter()
+        # Per-endpoint latency, errors, retries and bytes; see get_rest_stats()
+        self.rest_stats = RestStats()
 
         # Prepare HTTPS session
         self.session = requests.Session()
@@ -44,16 +52,45 @@ class BitMEX(BaseExchange):
 
         # Create websocket for streaming data
         self.ws = BitMEXWebsocket()
-        self.ws.connect(self.base_url, symbol, shouldAuth=shouldWSAuth)
+        self.ws.connect(self.base_url, symbol, shouldAuth=shouldWSAuth, orderBookTable=orderBookTable,
+                        captureFile=captureFile)
+
+        # Websocket snapshot pinned by refresh_snapshot(). None reads the latest one.
+        self.snapshot = None
+        self.snapshot_ticker = None
+        # Thread reading the pinned snapshot, the only one that re-pins it
+        self.snapshot_thread = None
 
         self.timeout = timeout
-        self.max_retries = retries
-        self.retry_delay = retry_delay * 60
+        # Queries and cancels are retried up to `retries` times within `retry_delay` minutes.
+        # Creates and amends only briefly: once they run out, OrderActionDispatcher leaves them to
+        # the next tick, which recomputes them from fresh data anyway.
+        self.retry_policies = RetryPolicies(RetryPolicy(max_attempts=retries + 1, base_delay=0.5, max_delay=10,
+                                                        deadline=retry_delay * 60))
+        order_policy = RetryPolicy(max_attempts=3, base_delay=0.25, max_delay=2, deadline=10)
+        self.retry_policies.set(order_policy, verb='POST', path='order/bulk')
+        self.retry_policies.set(order_policy, verb='PUT', path='order/bulk')
+        cancel_policy = RetryPolicy(max_attempts=10, base_delay=0.25, max_delay=5, deadline=60)
+        self.retry_policies.set(cancel_policy, verb='DELETE', path='order')
+        self.retry_policies.set(cancel_policy, verb='DELETE', path='order/all')
+
+        # Have BitMEX cancel our orders if we stop sending heartbeats for cancelAllAfter seconds
+        self.dead_mans_switch = None
+        if cancelAllAfter and shouldWSAuth:
+            self.dead_mans_switch = DeadMansSwitch(self.cancel_all_after, cancelAllAfter, self.logger)
+            self.dead_mans_switch.start()
 
     def __del__(self):
-        self.exit()
+        # No REST calls from here, it may run at interpreter shutdown. Left armed, the
+        # switch cancels our orders once its timeout runs out.
+        if self.dead_mans_switch is not None:
+            self.dead_mans_switch.stop(disarm=False)
+        self.ws.exit()
 
     def exit(self):
+        """Disarm the dead man's switch and close the websocket."""
+        if self.dead_mans_switch is not None:
+            self.dead_mans_switch.stop()
         self.ws.exit()
 
     #
@@ -72,20 +109,52 @@ class BitMEX(BaseExchange):
             raise errors.MarketClosedError("The instrument %s is not open. State: %s" %
                                            (self.symbol, instrument["state"]))
 
+    def refresh_snapshot(self):
+        """Pin the latest websocket snapshot. Orders, position, funds and the ticker of our symbol
+        are read from it until the next refresh, so they are consistent with each other."""
+        self.snapshot = self.ws.get_snapshot()
+        self.snapshot_ticker = None
+        self.snapshot_thread = threading.get_ident()
+        return self.snapshot
+
     def ticker_data(self, symbol=None):
         """Get ticker data."""
         if symbol is None:
             symbol = self.symbol
+        if self.snapshot is not None and symbol == self.symbol:
+            if self.snapshot_ticker is None:
+                self.snapshot_ticker = instrumentToTicker(self.snapshot.instrument)
+            return self.snapshot_ticker
         return self.ws.get_ticker(symbol)
 
     def is_open(self):
-        """Check that websockets are still open."""
-        return not self.ws.exited
+        """Check that websockets are open and their data is in sync."""
+        return self.ws.is_connected()
+
+    def wait_for_reconnect(self, timeout):
+        """Wait for the websocket to reconnect and resync by itself. False if it didn't in time."""
+        return self.ws.wait_for_reconnect(timeout)
 
     def instrument(self, symbol):
         """Get an instrument's details."""
+        if self.snapshot is not None and symbol == self.symbol:
+            return self.snapshot.instrument
         return self.ws.get_instrument(symbol)
 
+    def order_book(self, symbol=None):
+        """Get the local L2 order book, if one was subscribed."""
+        if symbol is None:
+            symbol = self.symbol
+        return self.ws.get_order_book(symbol)
+
+    def recent_trades(self, n=None):
+        """Get read-only column views over the last n public trades."""
+        return self.ws.recent_trades(n)
+
+    def recent_quotes(self, n=None):
+        """Get read-only column views over the last n quotes."""
+        return self.ws.recent_quotes(n)
+
     #
     # Authentication required methods
     #
@@ -102,12 +171,12 @@ class BitMEX(BaseExchange):
     @authentication_required
     def funds(self):
         """Get your current balance."""
-        return self.ws.funds()
+        return self.ws.funds(self.snapshot)
 
     @authentication_required
     def position(self, symbol):
         """Get your open position."""
-        return self.ws.position(symbol)
+        return self.ws.position(symbol, self.snapshot)
 
     @authentication_required
     def create_bulk_orders(self, orders):
@@ -117,18 +186,19 @@ class BitMEX(BaseExchange):
             order['symbol'] = self.symbol
             if self.postOnly:
                 order['execInst'] = 'ParticipateDoNotInitiate'
-        return self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='POST', max_retries=self.max_retries)
+        return self._apply_order_responses(self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='POST'))
 
     @authentication_required
     def amend_bulk_orders(self, orders):
         """Amend multiple orders."""
         # Note rethrow; if this fails, we want to catch it and re-tick
-        return self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='PUT', rethrow_errors=True, max_retries=self.max_retries)
+        return self._apply_order_responses(
+            self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='PUT', rethrow_errors=True))
 
     @authentication_required
     def open_orders(self):
         """Get open orders."""
-        return self.ws.open_orders(self.orderIDPrefix)
+        return self.ws.open_orders(self.orderIDPrefix, self.snapshot)
 
     @authentication_required
     def http_open_orders(self):
@@ -152,27 +222,90 @@ class BitMEX(BaseExchange):
         postdict = {
             'orderID': [o.get('orderID') for o in orders],
         }
-        return self._curl_bitmex(path=path, postdict=postdict, verb="DELETE")
+        return self._apply_order_responses(self._curl_bitmex(path=path, postdict=postdict, verb="DELETE"))
 
-    def _curl_bitmex(self, path, query=None, postdict=None, timeout=None, verb=None, rethrow_errors=False,
-                     max_retries=None):
-        """Send a request to BitMEX Servers."""
-        # Handle URL
-        url = self.base_url + path
+    @authentication_required
+    def cancel_all_orders(self):
+        """Cancel all our orders of the symbol. They are listed over HTTP, so orders the websocket
+        hasn't reported yet are caught too, and only those with our clOrdID prefix are cancelled:
+        order/all would cancel those of every robot on the account."""
+        orders = self.http_open_orders()
+        if not orders:
+            return []
+        return self.cancel_orders(orders)
 
-        if timeout is None:
-            timeout = self.timeout
+    @authentication_required
+    def reconcile_orders(self):
+        """Fetch our open orders over HTTP and make the local order table match them, e.g. after
+        an amend failed because the websocket hadn't reported a fill or cancel yet."""
+        orders = self.http_open_orders()
+        self.ws.reconcile_orders(orders, self.orderIDPrefix)
+        self._repin_snapshot()
+        return orders
+
+    def get_rest_stats(self):
+        """REST telemetry: per-endpoint statistics and the state of the client side rate limiter."""
+        stats = self.rest_stats.get_stats()
+        stats['rateLimiter'] = self.rate_limiter.get_stats()
+        return stats
+
+    def _apply_order_responses(self, orders):
+        """Apply the order rows of a REST response to the local order table, so the next snapshot
+        has them even if the websocket hasn't echoed them yet."""
+        if isinstance(orders, list):
+            self.ws.apply_order_responses(orders)
+            self._repin_snapshot()
+        return orders
+
+    def _repin_snapshot(self):
+        """Re-pin the snapshot after we changed orders mid-tick, so open_orders() doesn't keep
+        returning the ones we just cancelled. Calls made on the dispatcher's threads leave it to
+        dispatch_order_actions, which re-pins once all of them are done."""
+        if self.snapshot is not None and self.snapshot_thread == threading.get_ident():
+            self.refresh_snapshot()
+
+    @authentication_required
+    def cancel_all_after(self, timeout):
+        """Have BitMEX cancel all orders `timeout` seconds from now unless called again before. 0 disarms it."""
+        return self._curl_bitmex(path="order/cancelAllAfter", postdict={'timeout': int(timeout * 1000)},
+                                 verb="POST", priority=PRIORITY_CANCEL)
 
+    def _curl_bitmex(self, path, query=None, postdict=None, timeout=None, verb=None, rethrow_errors=False,
+                     max_retries=None, priority=None):
+        """Send a request to BitMEX Servers, retrying transient failures as the retry policy of the
+        verb and path allows. max_retries overrides the number of retries of the policy.
+        priority is a rate_limiter PRIORITY_* value and defaults to the one of the verb."""
         # Default to POST if data is attached, GET otherwise
         if not verb:
             verb = 'POST' if postdict else 'GET'
 
-        # By default don't retry POST or PUT. Retrying GET/DELETE is okay because they are idempotent.
-        # In the future we could allow retrying PUT, so long as 'leavesQty' is not used (not idempotent),
-        # or you could change the clOrdID (set {"clOrdID": "new", "origClOrdID": "old"}) so that an amend
-        # can't erroneously be applied twice.
-        if max_retries is None:
-            max_retries = 0 if verb in ['POST', 'PUT'] else self.max_retries
+        policy = self.retry_policies.get(verb, path)
+        if max_retries is not None:
+            policy = RetryPolicy(max_retries + 1, policy.base_delay, policy.max_delay, policy.deadline)
+        if not is_safe_to_retry(verb, postdict):
+            policy = policy.single_attempt()
+
+        if priority is None:
+            priority = RateLimiter.priority_for_verb(verb)
+
+        attempts = 0
+
+        def attempt():
+            nonlocal attempts
+            if attempts:
+                self.rest_stats.record_retry(verb, path)
+            attempts += 1
+            return self._send_request(path, query, postdict, timeout, verb, rethrow_errors, priority)
+
+        return call_with_retry(attempt, policy, self.logger, "%s %s (%s)" % (verb, path, json.dumps(postdict or '')))
+
+    def _send_request(self, path, query, postdict, timeout, verb, rethrow_errors, priority):
+        """Make one attempt of a request. Raises RetryableError on failures worth retrying."""
+        # Handle URL
+        url = self.base_url + path
+
+        if timeout is None:
+            timeout = self.timeout
 
         # Auth: API Key/Secret
         auth = APIKeyAuthWithExpires(self.apiKey, self.apiSecret)
@@ -183,22 +316,33 @@ class BitMEX(BaseExchange):
             else:
                 exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
 
-        def retry():
-            self.retries += 1
-            if self.retries > max_retries:
-                raise Exception("Max retry amount of {} on {} ({}) hit, raising.".format(max_retries, path, json.dumps(postdict or '')))
-            time.sleep(self.retry_delay)
-            return self._curl_bitmex(path, query, postdict, timeout, verb, rethrow_errors, max_retries)
-
         # Make the request
         response = None
         try:
-            self.logger.info("Sending CURL request to %s: %s" % (url, json.dumps(postdict or query or '')))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Sending request to %s %s: %s" % (verb, url, json.dumps(postdict or query or '')))
             req = requests.Request(verb, url, json=postdict, auth=auth, params=query)
             prepped = self.session.prepare_request(req)
-            response = self.session.send(prepped, timeout=timeout)
-            #ratelimit_remaining = response.headers['X-RateLimit-Remaining']
-            #log_info(self.logger, "CURL request: {}, X-RateLimit-Remaining={}".format(url, ratelimit_remaining), True)
+            waited = self.rate_limiter.acquire(priority)
+            if waited > 0.1:
+                self.logger.info("Rate limiter held %s %s for %.2f seconds" % (verb, path, waited))
+            status = 'error'
+            sentAt = time.time()
+            try:
+                response = self.session.send(prepped, timeout=timeout)
+                status = response.status_code
+            except requests.exceptions.Timeout:
+                status = 'timeout'
+                raise
+            except requests.exceptions.ConnectionError:
+                status = 'connection'
+                raise
+            finally:
+                headers = response.headers if response is not None else None
+                # Resync the bucket with the X-RateLimit-* headers
+                self.rate_limiter.release(headers)
+                self.rest_stats.record(verb, path, status, time.time() - sentAt, len(prepped.body or b''),
+                                       len(response.content) if response is not None else 0, headers)
             # Make non-200s throw
             response.raise_for_status()
 
@@ -224,9 +368,10 @@ class BitMEX(BaseExchange):
                                   "Request: %s \n %s" % (url, json.dumps(postdict)))
                 exit_or_throw(e)
 
-            # 429, ratelimit; cancel orders & wait until X-RateLimit-Reset
+            # 429, ratelimit; hold all requests until X-RateLimit-Reset.
+            # Our resting orders stay in the book; the limiter lets cancels out first once it resets.
             elif response.status_code == 429:
-                self.logger.error("Ratelimited on current request. Sleeping, then trying again. Try fewer " +
+                self.logger.error("Ratelimited on current request. Waiting, then trying again. Try fewer " +
                                   "order pairs or contact support@bitmex.com to raise your limits. " +
                                   "Request: %s \n %s" % (url, json.dumps(postdict)))
 
@@ -234,44 +379,39 @@ class BitMEX(BaseExchange):
                 ratelimit_reset = response.headers['X-RateLimit-Reset']
                 to_sleep = int(ratelimit_reset) - int(time.time())
                 reset_str = datetime.datetime.fromtimestamp(int(ratelimit_reset)).strftime('%X')
+                self.rate_limiter.on_rate_limited(int(ratelimit_reset))
 
-                # We're ratelimited, and we may be waiting for a long time. Cancel orders.
-                self.logger.warning("Cancelling all known orders in the meantime.")
-                self.cancel([o['orderID'] for o in self.open_orders()])
-
-                self.logger.error("Your ratelimit will reset at %s. Sleeping for %d seconds." % (reset_str, to_sleep))
-                time.sleep(to_sleep)
+                self.logger.error("Your ratelimit will reset at %s. Holding requests for %d seconds." % (reset_str, to_sleep))
+                raise RetryableError("Ratelimited on %s %s" % (verb, path), retry_after=max(to_sleep, 0))
 
-                # Retry the request.
-                return retry()
-
-            # 503 - BitMEX temporary downtime, likely due to a deploy. Try again
-            elif response.status_code == 503:
-                self.logger.warning("Unable to contact the BitMEX API (503), retrying. " +
-                                    "Request: %s \n %s" % (url, json.dumps(postdict)))
-                time.sleep(3)
-                return retry()
+            # 502/503/504 - BitMEX temporary downtime, likely due to a deploy or overload. Try again
+            elif response.status_code in (502, 503, 504):
+                raise RetryableError("Unable to contact the BitMEX API (%d)" % response.status_code)
 
             elif response.status_code == 400:
                 error = response.json()['error']
                 message = error['message'].lower() if error else ''
 
-                # Duplicate clOrdID: that's fine, probably a deploy, go get the order(s) and return it
+                # Duplicate clOrdID: a retried create that went through the first time, or a deploy.
+                # Go get the order(s) and return them.
                 if 'duplicate clordid' in message:
-                    orders = postdict['orders'] if 'orders' in postdict else postdict
+                    orders = postdict['orders'] if 'orders' in postdict else [postdict]
+                    sent = {order['clOrdID']: order for order in orders}
 
-                    IDs = json.dumps({'clOrdID': [order['clOrdID'] for order in orders]})
+                    IDs = json.dumps({'clOrdID': list(sent)})
                     orderResults = self._curl_bitmex('order', query={'filter': IDs}, verb='GET')
 
-                    for i, order in enumerate(orderResults):
+                    for order in orderResults:
+                        posted = sent[order['clOrdID']]
+                        side = posted.get('side') or ('Buy' if posted['orderQty'] > 0 else 'Sell')
                         if (
-                                order['orderQty'] != abs(postdict['orderQty']) or
-                                order['side'] != ('Buy' if postdict['orderQty'] > 0 else 'Sell') or
-                                order['price'] != postdict['price'] or
-                                order['symbol'] != postdict['symbol']):
+                                order['orderQty'] != abs(posted['orderQty']) or
+                                order['side'] != side or
+                                order['price'] != posted['price'] or
+                                order['symbol'] != posted['symbol']):
                             raise Exception('Attempted to recover from duplicate clOrdID, but order returned from API ' +
                                             'did not match POST.\nPOST data: %s\nReturned order: %s' % (
-                                                json.dumps(orders[i]), json.dumps(order)))
+                                                json.dumps(posted), json.dumps(order)))
                     # All good
                     return orderResults
 
@@ -286,17 +426,26 @@ class BitMEX(BaseExchange):
             exit_or_throw(e)
 
         except requests.exceptions.Timeout as e:
-            # Timeout, re-run this request
-            self.logger.warning("Timed out on request: %s (%s), retrying..." % (path, json.dumps(postdict or '')))
-            return retry()
+            raise RetryableError("Timed out on request %s %s" % (verb, path))
 
         except requests.exceptions.ConnectionError as e:
-            self.logger.warning("Unable to contact the BitMEX API (%s). Please check the URL. Retrying. " +
-                                "Request: %s %s \n %s" % (e, url, json.dumps(postdict)))
-            time.sleep(1)
-            return retry()
-
-        # Reset retry counter on success
-        self.retries = 0
+            raise RetryableError("Unable to contact the BitMEX API (%s). Please check the URL" % e)
 
         return response.json()
+
+
+def is_safe_to_retry(verb, postdict):
+    """Whether sending a request twice can't apply it twice.
+    GET and DELETE are idempotent. A create is when every order carries a clOrdID, since the replay
+    then fails with 'Duplicate clOrdID' and is recovered. An amend is when it sets absolute
+    quantities: 'leavesQty' is relative to the fills in between."""
+    if verb in ('GET', 'DELETE'):
+        return True
+    if not postdict:
+        return False
+    orders = postdict['orders'] if 'orders' in postdict else [postdict]
+    if verb == 'POST':
+        return all(order.get('clOrdID') for order in orders)
+    if verb == 'PUT':
+        return all('leavesQty' not in order for order in orders)
+    return False
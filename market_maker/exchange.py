@@ -15,6 +15,10 @@ class BaseExchange(object):
     #
     # Public methods
     #
+    @abstractmethod
+    def refresh_snapshot(self):
+        pass
+
     @abstractmethod
     def ticker_data(self, symbol=None):
         pass
@@ -23,10 +27,26 @@ class BaseExchange(object):
     def is_open(self):
         pass
 
+    @abstractmethod
+    def wait_for_reconnect(self, timeout):
+        pass
+
     @abstractmethod
     def instrument(self, symbol):
         pass
 
+    @abstractmethod
+    def order_book(self, symbol=None):
+        pass
+
+    @abstractmethod
+    def recent_trades(self, n=None):
+        pass
+
+    @abstractmethod
+    def recent_quotes(self, n=None):
+        pass
+
     @abstractmethod
     def funds(self):
         pass
@@ -55,6 +75,18 @@ class BaseExchange(object):
     def cancel_orders(self, orders):
         pass
 
+    @abstractmethod
+    def cancel_all_orders(self):
+        pass
+
+    @abstractmethod
+    def reconcile_orders(self):
+        pass
+
+    @abstractmethod
+    def get_rest_stats(self):
+        pass
+
 
 BITMEX = 1
 BITFINEX = 2
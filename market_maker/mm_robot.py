@@ -1,6 +1,6 @@
 from __future__ import absolute_import
-from time import sleep
 import os
+import json
 import signal
 from market_maker.utils.log import log_debug
 from market_maker.utils.log import log_info
@@ -11,7 +11,9 @@ from market_maker import bitfinex
 from market_maker.settings import settings
 from market_maker.utils.bitmex import errors
 from market_maker.utils import log
+from market_maker.utils.wakeup import wakeup
 from market_maker.exchange import ExchangeInfo
+from market_maker.order_dispatcher import OrderActionDispatcher
 from market_maker.db.model import *
 from datetime import datetime
 from market_maker.db.db_manager import DatabaseManager
@@ -19,21 +21,43 @@ from market_maker.strategies.config.strategy_factory import StrategyFactory
 
 logger = log.setup_robot_custom_logger('root')
 
+# Time to keep collecting websocket updates after the first one before ticking
+DEFAULT_LOOP_WAKEUP_DEBOUNCE = 0.1
+
+# Time to wait for the websocket to reconnect by itself before restarting the robot
+DEFAULT_WS_RECONNECT_TIMEOUT = 60
+
+# Threads sending the amend/create/cancel batches of a convergence concurrently
+DEFAULT_ORDER_DISPATCH_WORKERS = 3
+
+# Seconds without a heartbeat after which the exchange cancels all our orders. 0 disables it.
+# BitMEX's switch covers the whole account, so only enable it for a robot trading an account alone.
+DEFAULT_CANCEL_ALL_AFTER = 0
+
+# Seconds between dumps of the REST and order dispatch statistics to the log. 0 disables them.
+DEFAULT_REST_STATS_INTERVAL = 300
+
 
 class ExchangeInterface:
     def __init__(self):
         self.symbol = settings.SYMBOL
         self.xchange = self.create_exchange_interface()
+        workers = settings.ORDER_DISPATCH_WORKERS if settings.ORDER_DISPATCH_WORKERS is not None else DEFAULT_ORDER_DISPATCH_WORKERS
+        self.dispatcher = OrderActionDispatcher(self.xchange, max_workers=workers)
 
     def create_exchange_interface(self):
         result = None
         if ExchangeInfo.is_bitmex():
             prefix = "{}_{}".format(settings.ROBOTID, settings.ORDERID_PREFIX)
+            cancel_all_after = settings.CANCEL_ALL_AFTER if settings.CANCEL_ALL_AFTER is not None else DEFAULT_CANCEL_ALL_AFTER
             result = bitmex.BitMEX(symbol=self.symbol,
                                     orderIDPrefix=prefix, postOnly=settings.POST_ONLY,
                                     timeout=settings.TIMEOUT,
                                     retries=settings.RETRIES,
-                                    retry_delay=settings.RETRY_DELAY)
+                                    retry_delay=settings.RETRY_DELAY,
+                                    orderBookTable=settings.BITMEX_ORDERBOOK_TABLE,
+                                    captureFile=settings.WS_CAPTURE_FILE,
+                                    cancelAllAfter=cancel_all_after)
         elif ExchangeInfo.is_bitfinex():
             result = bitfinex.Bitfinex(symbol=self.symbol)
 
@@ -42,18 +66,16 @@ class ExchangeInterface:
     def cancel_all_orders(self):
         logger.info("Resetting current position. Cancelling all existing orders.")
 
-        # In certain cases, a WS update might not make it through before we call this.
-        # For that reason, we grab via HTTP to ensure we grab them all.
-        orders = self.xchange.http_open_orders()
+        # Our open orders are listed over HTTP, so orders the websocket hasn't reported yet are
+        # caught too. The response updates the local orders; no need to wait for the websocket.
+        result = self.xchange.cancel_all_orders()
 
-        for order in orders:
-            logger.info("Cancelling: {} {} @ {}".format(order['side'], order['orderQty'], order['price']))
+        for order in result or []:
+            logger.info("Cancelled: {} {} @ {}".format(order.get('side'), order.get('orderQty'), order.get('price')))
 
-        if len(orders):
-            logger.info("Cancelling all orders: {}".format(orders))
-            result = self.xchange.cancel_orders(orders)
-            logger.info("Cancelling all orders result={}".format(result))
-            sleep(settings.API_REST_INTERVAL)
+    def refresh_snapshot(self):
+        """Take one consistent view of orders, position, margin and ticker for the coming tick."""
+        return self.xchange.refresh_snapshot()
 
     def get_delta(self, symbol=None):
         if symbol is None:
@@ -127,10 +149,29 @@ class ExchangeInterface:
             symbol = self.symbol
         return self.xchange.ticker_data(symbol)
 
+    def get_recent_trades(self, n=None):
+        """Read-only timestamp/price/size arrays over the last n trades, e.g. for a rolling VWAP."""
+        return self.xchange.recent_trades(n)
+
+    def get_recent_quotes(self, n=None):
+        return self.xchange.recent_quotes(n)
+
+    def get_order_book_depth(self, depth, symbol=None):
+        """Copies of the top `depth` levels of the local L2 book, or None if no book is maintained."""
+        if symbol is None:
+            symbol = self.symbol
+        order_book = self.xchange.order_book(symbol)
+        if order_book is None or not order_book.is_initialized:
+            return None
+        return order_book.depth(depth)
+
     def is_open(self):
         """Check that websockets are still open."""
         return self.xchange.is_open()
 
+    def wait_for_reconnect(self, timeout):
+        return self.xchange.wait_for_reconnect(timeout)
+
     def check_market_open(self):
         instrument = self.get_instrument()
         if instrument["state"] != "Open" and instrument["state"] != "Closed":
@@ -152,6 +193,27 @@ class ExchangeInterface:
     def cancel_bulk_orders(self, orders):
         return self.xchange.cancel_orders(orders)
 
+    def reconcile_orders(self):
+        """Resync our order table with the open orders on the exchange."""
+        return self.xchange.reconcile_orders()
+
+    def dispatch_order_actions(self, to_amend, to_create, to_cancel, existing_orders=None, sequential=False):
+        """Send the amend/create/cancel batches concurrently, cancels and amends first where a create
+        would cross them, or cancels first in any case if sequential. Raises the error of a failed
+        batch once all of them are done, and re-pins the snapshot in any case."""
+        try:
+            return self.dispatcher.dispatch(to_amend, to_create, to_cancel, existing_orders, sequential)
+        finally:
+            # The batches applied their responses on the dispatcher's threads; read them from here on
+            self.refresh_snapshot()
+
+    def get_order_dispatch_stats(self):
+        return self.dispatcher.get_stats()
+
+    def get_rest_stats(self):
+        """Per-endpoint REST latency, errors, retries and bytes, and the rate limit headroom."""
+        return self.xchange.get_rest_stats()
+
 
 class NerdMarketMakerRobot:
     def __init__(self):
@@ -172,6 +234,8 @@ class NerdMarketMakerRobot:
         self.is_trading_suspended = False
         self.price_change_last_check = datetime.now()
         self.price_change_last_price = -1
+        self.rest_stats_last_logged = datetime.now()
+        self.db_last_synced = None
         self.reset()
 
     def whereAmI(self):
@@ -198,7 +262,9 @@ class NerdMarketMakerRobot:
         logger.info("Shutting down. All open orders will be cancelled.")
         try:
             self.exchange.cancel_all_orders()
+            self.log_rest_stats(force=True)
             self.exchange.xchange.exit()
+            self.exchange.refresh_snapshot()
             self.update_db()
         except errors.AuthenticationError as ae:
             logger.info("Was not authenticated; could not cancel orders.")
@@ -216,24 +282,56 @@ class NerdMarketMakerRobot:
         while True:
             logger.debug("*" * 100)
 
-            # This will restart on very short downtime, but if it's longer,
-            # the MM will crash entirely as it is unable to connect to the WS on boot.
+            # The websocket reconnects and resyncs by itself, keeping our resting orders.
+            # Only if it can't within the timeout do we fall back to a full restart.
             if not self.check_connection():
-                RESTART_TIMEOUT = 60
-                log_error(logger, "Realtime data connection unexpectedly closed, restarting in {} seconds.".format(RESTART_TIMEOUT), True)
-                sleep(RESTART_TIMEOUT)
-                self.restart()
-
-            self.strategy.on_market_snapshot_update()
+                reconnect_timeout = settings.WS_RECONNECT_TIMEOUT if settings.WS_RECONNECT_TIMEOUT is not None else DEFAULT_WS_RECONNECT_TIMEOUT
+                log_error(logger, "Realtime data connection lost, waiting up to {} seconds for it to come back.".format(reconnect_timeout), True)
+                if not self.exchange.wait_for_reconnect(reconnect_timeout):
+                    log_error(logger, "Realtime data connection could not be restored, restarting.", True)
+                    self.restart()
+                logger.info("Realtime data connection restored, resuming.")
+                continue
+
+            self.exchange.refresh_snapshot()
+            # Market data may wake us up several times a second: those ticks only converge the
+            # orders, the DB reads and writes keep running once per LOOP_INTERVAL.
+            db_sync = self.is_db_sync_due()
+            if db_sync:
+                self.db_last_synced = datetime.now()
+                self.strategy.on_market_snapshot_update()
             if self.strategy.is_market_snapshot_initialized():
-                self.strategy.update_dynamic_app_settings(False)
+                if db_sync:
+                    self.strategy.update_dynamic_app_settings(False)
                 self.strategy.sanity_check()       # Ensures health of mm - several cut-out points here
                 self.strategy.print_status(False)  # Print skew, delta, etc
                 self.strategy.check_suspend_trading()
                 self.strategy.place_orders()       # Creates desired orders and converges to existing orders
-                self.update_db()
-
-            sleep(settings.LOOP_INTERVAL)
+                if db_sync:
+                    self.update_db()
+
+            self.log_rest_stats()
+            self.wait_for_market_update()
+
+    def is_db_sync_due(self):
+        return self.db_last_synced is None or (datetime.now() - self.db_last_synced).total_seconds() >= settings.LOOP_INTERVAL
+
+    def log_rest_stats(self, force=False):
+        interval = settings.REST_STATS_INTERVAL if settings.REST_STATS_INTERVAL is not None else DEFAULT_REST_STATS_INTERVAL
+        if not force and (not interval or (datetime.now() - self.rest_stats_last_logged).total_seconds() < interval):
+            return
+        self.rest_stats_last_logged = datetime.now()
+        stats = {
+            'rest': self.exchange.get_rest_stats(),
+            'orderDispatch': self.exchange.get_order_dispatch_stats()
+        }
+        logger.info("REST stats: {}".format(json.dumps(stats, default=str)))
+
+    def wait_for_market_update(self):
+        """Sleep until a quote/order/execution/position update arrives, at most LOOP_INTERVAL seconds."""
+        debounce = settings.LOOP_WAKEUP_DEBOUNCE if settings.LOOP_WAKEUP_DEBOUNCE is not None else DEFAULT_LOOP_WAKEUP_DEBOUNCE
+        reasons = wakeup.wait(settings.LOOP_INTERVAL, debounce)
+        logger.debug("Woken up by: {}".format(", ".join(sorted(reasons)) if reasons else "timeout"))
 
     def restart(self):
         logger.info("Restarting the NerdMarketMakerRobot ...")
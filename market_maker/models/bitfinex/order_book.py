@@ -2,19 +2,91 @@
 Module used to describe all of the different data types
 """
 
+import bisect
 import zlib
-import json
+
+# Levels per side covered by the exchange's book checksum
+CHECKSUM_DEPTH = 25
+
+
+class PriceLevels:
+    """
+    One side of the orderbook: its entries best first, and a parallel
+    ascending list of sort keys to find a level by bisection. The key is the price,
+    negated on sides that are sorted highest first.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def best(self):
+        """
+        Top of this side, or None if it is empty
+        """
+        return self.entries[0] if self.entries else None
+
+    def update(self, key, entry):
+        """
+        Insert the level or replace the one with the same key. Returns its index
+        """
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            self.entries[index] = entry
+        else:
+            self.keys.insert(index, key)
+            self.entries.insert(index, entry)
+        return index
+
+    def delete(self, key):
+        """
+        Remove the level with this key, if there is one. Returns the index it had,
+        or None
+        """
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+            del self.entries[index]
+            return index
+        return None
+
+
+def _level_key(price, amount):
+    # Sides of positive amounts are sorted highest price first
+    return price if amount < 0 else -price
+
+
+def _raw_text(value):
+    # Floats decoded with JsonDecoder.loads_raw() keep the text they were sent as;
+    # ints print back exactly
+    raw = getattr(value, 'raw', None)
+    return raw if raw is not None else str(value)
+
 
 class OrderBook:
     """
     Object used to store the state of the orderbook. This can then be used
     in one of two ways. To get the checksum of the book or so get the bids/asks
     of the book
+
+    The checksum is computed from the prices and amounts as the exchange sent
+    them, so entries should be decoded with JsonDecoder.loads_raw()
     """
 
     def __init__(self):
-        self.asks = []
-        self.bids = []
+        self.asks = PriceLevels()
+        self.bids = PriceLevels()
+        # Checksum of the current top of book, None once a level in it changed
+        self._checksum = None
 
     def get_bids(self):
         """
@@ -22,7 +94,7 @@ class OrderBook:
 
         @return bids Array
         """
-        return self.bids
+        return self.bids.entries
 
     def get_asks(self):
         """
@@ -30,39 +102,27 @@ class OrderBook:
 
         @return asks Array
         """
-        return self.asks
+        return self.asks.entries
 
-    def update_from_snapshot(self, data, orig_raw_msg):
+    def update_from_snapshot(self, data):
         """
         Update the orderbook with a raw orderbook snapshot
         """
-        # we need to keep the original string values that are sent to use
-        # this avoids any problems with floats
-        orig_raw = json.loads(orig_raw_msg, parse_float=str, parse_int=str)[1]
-        zip_data = []
-        # zip both the float values and string values together
-        for index, order in enumerate(data):
-            zip_data += [(order, orig_raw[index])]
         ## build our bids and asks
-        for order in zip_data:
-            if len(order[0]) == 4:
-                if order[0][3] < 0:
-                    self.bids += [order]
-                else:
-                    self.asks += [order]
+        for order in data:
+            if len(order) == 4:
+                amount = order[3]
+                side = self.bids if amount < 0 else self.asks
             else:
-                if order[0][2] < 0:
-                    self.asks += [order]
-                else:
-                    self.bids += [order]
+                amount = order[2]
+                side = self.asks if amount < 0 else self.bids
+            side.update(_level_key(order[0], amount), order)
+        self._checksum = None
 
-    def update_with(self, order, orig_raw_msg):
+    def update_with(self, order):
         """
         Update the orderbook with a single update
         """
-        # keep orginal string vlues to avoid checksum float errors
-        orig_raw = json.loads(orig_raw_msg, parse_float=str, parse_int=str)[1]
-        zip_order = (order, orig_raw)
         if len(order) == 4:
             amount = order[3]
             count = order[2]
@@ -71,54 +131,40 @@ class OrderBook:
             amount = order[2]
             side = self.asks if amount < 0 else self.bids
             count = order[1]
-        price = order[0]
-
-        # if first item in ordebook
-        if len(side) == 0:
-            side += [zip_order]
-            return
-
         # match price level but use the float parsed object
-        for index, s_order in enumerate(side):
-            s_price = s_order[0][0]
-            if s_price == price:
-                if count == 0:
-                    del side[index]
-                    return
-                # remove but add as new below
-                del side[index]
-
-        # if ob is initialised w/o all price levels
+        key = _level_key(order[0], amount)
         if count == 0:
-            return
-
-        # add to book and sort lowest to highest
-        side += [zip_order]
-        side.sort(key=lambda x: x[0][0], reverse=not amount < 0)
-        return
+            # also fine if ob is initialised w/o all price levels
+            index = side.delete(key)
+        else:
+            index = side.update(key, order)
+        # levels further down don't change the checksum
+        if index is not None and index < CHECKSUM_DEPTH:
+            self._checksum = None
 
     def checksum(self):
         """
-        Generate a CRC32 checksum of the orderbook
+        Generate a CRC32 checksum of the orderbook. It is only recomputed after
+        one of the top 25 bids/asks changed
         """
+        if self._checksum is not None:
+            return self._checksum
         data = []
         # take set of top 25 bids/asks
-        for index in range(0, 25):
+        for index in range(0, CHECKSUM_DEPTH):
             if index < len(self.bids):
-                # use the string parsed array
-                bid = self.bids[index][1]
-                price = bid[0]
+                # use the values as they were sent
+                bid = self.bids[index]
                 amount = bid[3] if len(bid) == 4 else bid[2]
-                data += [price]
-                data += [amount]
+                data += [_raw_text(bid[0])]
+                data += [_raw_text(amount)]
             if index < len(self.asks):
-                # use the string parsed array
-                ask = self.asks[index][1]
-                price = ask[0]
+                # use the values as they were sent
+                ask = self.asks[index]
                 amount = ask[3] if len(ask) == 4 else ask[2]
-                data += [price]
-                data += [amount]
+                data += [_raw_text(ask[0])]
+                data += [_raw_text(amount)]
         checksum_str = ':'.join(data)
         # calculate checksum and force signed integer
-        checksum = zlib.crc32(checksum_str.encode('utf8')) & 0xffffffff
-        return checksum
+        self._checksum = zlib.crc32(checksum_str.encode('utf8')) & 0xffffffff
+        return self._checksum
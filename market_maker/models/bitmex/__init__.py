@@ -0,0 +1,8 @@
+"""
+This module contains the data models used by the BitMEX connector
+"""
+
+from .order_book import OrderBookL2, ORDER_BOOK_TABLES
+
+
+NAME = 'models'
@@ -0,0 +1,211 @@
+"""
+Module used to describe the BitMEX L2 order book
+"""
+
+import threading
+
+import numpy as np
+
+# Websocket tables carrying incremental L2 book data
+ORDER_BOOK_TABLES = ['orderBookL2', 'orderBookL2_25']
+
+
+class BookSide:
+    """
+    One side of the book stored as parallel price/size arrays sorted by ascending
+    price. Levels are located with a binary search, so the price index is never
+    rebuilt on updates.
+    """
+
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, is_bid):
+        self.is_bid = is_bid
+        self._prices = np.empty(BookSide.INITIAL_CAPACITY, dtype=np.float64)
+        self._sizes = np.empty(BookSide.INITIAL_CAPACITY, dtype=np.float64)
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def clear(self):
+        self._len = 0
+
+    def load(self, prices, sizes):
+        """
+        Replace the whole side with the given (unsorted) levels
+        """
+        order = np.argsort(prices, kind='stable')
+        self._ensure_capacity(len(order))
+        self._prices[:len(order)] = np.asarray(prices, dtype=np.float64)[order]
+        self._sizes[:len(order)] = np.asarray(sizes, dtype=np.float64)[order]
+        self._len = len(order)
+
+    def insert(self, price, size):
+        index = self._find(price)
+        if index < self._len and self._prices[index] == price:
+            self._sizes[index] = size
+            return
+        self._ensure_capacity(self._len + 1)
+        # Shift the tail right by one level; numpy handles the overlapping copy
+        self._prices[index + 1:self._len + 1] = self._prices[index:self._len]
+        self._sizes[index + 1:self._len + 1] = self._sizes[index:self._len]
+        self._prices[index] = price
+        self._sizes[index] = size
+        self._len += 1
+
+    def update(self, price, size):
+        index = self._find(price)
+        if index < self._len and self._prices[index] == price:
+            self._sizes[index] = size
+        else:
+            self.insert(price, size)
+
+    def delete(self, price):
+        index = self._find(price)
+        if index >= self._len or self._prices[index] != price:
+            return
+        self._prices[index:self._len - 1] = self._prices[index + 1:self._len]
+        self._sizes[index:self._len - 1] = self._sizes[index + 1:self._len]
+        self._len -= 1
+
+    def best(self):
+        """
+        Return the (price, size) of the best level or None for an empty side
+        """
+        if self._len == 0:
+            return None
+        index = self._len - 1 if self.is_bid else 0
+        return float(self._prices[index]), float(self._sizes[index])
+
+    def top(self, depth):
+        """
+        Return (prices, sizes) copies of the best `depth` levels, best first
+        """
+        prices = self._prices[:self._len]
+        sizes = self._sizes[:self._len]
+        if self.is_bid:
+            prices = prices[::-1]
+            sizes = sizes[::-1]
+        return prices[:depth].copy(), sizes[:depth].copy()
+
+    def _find(self, price):
+        return int(np.searchsorted(self._prices[:self._len], price))
+
+    def _ensure_capacity(self, capacity):
+        if capacity <= len(self._prices):
+            return
+        new_capacity = max(capacity, 2 * len(self._prices))
+        for name in ('_prices', '_sizes'):
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=np.float64)
+            new[:self._len] = old[:self._len]
+            setattr(self, name, new)
+
+
+class OrderBookL2:
+    """
+    Price-sorted L2 book for a single symbol, maintained incrementally from the
+    orderBookL2 / orderBookL2_25 websocket tables. BitMEX only sends the price on
+    partial and insert rows, so the level id is mapped to its side and price.
+
+    The websocket thread shifts the arrays in place, so the readers below take the
+    lock and return copies rather than views of half-applied updates.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+        self.levels = {}
+        self.is_initialized = False
+        self.lock = threading.Lock()
+
+    def apply(self, action, rows):
+        """
+        Apply a websocket action ('partial', 'insert', 'update' or 'delete')
+        """
+        with self.lock:
+            self._apply(action, rows)
+
+    def _apply(self, action, rows):
+        if action == 'partial':
+            self.load(rows)
+        elif not self.is_initialized:
+            # Incremental data before the image is useless; wait for the partial
+            return
+        elif action == 'insert':
+            for row in rows:
+                # An id inserted again may come with another price; drop its old level first
+                old_level = self.levels.get(row['id'])
+                if old_level is not None:
+                    old_level[0].delete(old_level[1])
+                side = self._get_side(row['side'])
+                self.levels[row['id']] = (side, row['price'])
+                side.insert(row['price'], row['size'])
+        elif action == 'update':
+            for row in rows:
+                level = self.levels.get(row['id'])
+                if level is None:
+                    continue
+                side, price = level
+                side.update(price, row['size'])
+        elif action == 'delete':
+            for row in rows:
+                level = self.levels.pop(row['id'], None)
+                if level is None:
+                    continue
+                side, price = level
+                side.delete(price)
+        else:
+            raise Exception("Unknown action: %s" % action)
+
+    def load(self, rows):
+        """
+        Rebuild the book from a partial image. Called with the lock held
+        """
+        self.levels = {}
+        bids = ([], [])
+        asks = ([], [])
+        for row in rows:
+            side = self._get_side(row['side'])
+            self.levels[row['id']] = (side, row['price'])
+            prices, sizes = bids if side.is_bid else asks
+            prices.append(row['price'])
+            sizes.append(row['size'])
+        self.bids.load(*bids)
+        self.asks.load(*asks)
+        self.is_initialized = True
+
+    def best_bid(self):
+        with self.lock:
+            return self.bids.best()
+
+    def best_ask(self):
+        with self.lock:
+            return self.asks.best()
+
+    def top_bids(self, depth):
+        with self.lock:
+            return self.bids.top(depth)
+
+    def top_asks(self, depth):
+        with self.lock:
+            return self.asks.top(depth)
+
+    def depth(self, depth):
+        """
+        Return copies of the top `depth` levels of both sides, taken from the same state
+        """
+        with self.lock:
+            bid_prices, bid_sizes = self.bids.top(depth)
+            ask_prices, ask_sizes = self.asks.top(depth)
+        return {
+            'bidPrices': bid_prices,
+            'bidSizes': bid_sizes,
+            'askPrices': ask_prices,
+            'askSizes': ask_sizes
+        }
+
+    def _get_side(self, side):
+        return self.bids if side == 'Buy' else self.asks
@@ -0,0 +1,138 @@
+"""Concurrent dispatch of the amend/create/cancel batches of one order convergence."""
+from __future__ import absolute_import
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from market_maker.utils.latency_stats import Histogram
+from market_maker.utils.retry import RetriesExhaustedError
+
+ACTION_CANCEL = 'cancel'
+ACTION_AMEND = 'amend'
+ACTION_CREATE = 'create'
+
+
+def crosses(orders, resting_orders):
+    """Whether any of the orders would trade against one of the resting orders."""
+    for order in orders:
+        for resting in resting_orders:
+            if order['side'] == resting['side']:
+                continue
+            if order['side'] == 'Buy' and order['price'] >= resting['price']:
+                return True
+            if order['side'] == 'Sell' and order['price'] <= resting['price']:
+                return True
+    return False
+
+
+class OrderBatch(object):
+    def __init__(self, action, orders):
+        self.action = action
+        self.orders = orders
+        self.depends_on = []
+        self.skipped = False
+        self.result = None
+        self.error = None
+        self.latency = None
+
+
+class OrderActionDispatcher(object):
+    """Sends the amend, create and cancel batches of a convergence on a thread pool.
+
+    Batches go out at the same time unless one would cross an order another batch
+    is moving out of the way: an amend or create that would cross an order being
+    cancelled waits for the cancel, and a create that would cross an order at the
+    price it is being amended from waits for the amend. With sequential=True the
+    amends and creates wait for the cancels regardless, e.g. when the cancels free
+    the margin the new orders need.
+
+    A batch which ran out of retries, e.g. rate limited until a reset past its
+    deadline, is logged and left to the next tick, which recomputes the orders from
+    fresh data. Only other errors are raised to the strategy.
+    """
+
+    def __init__(self, xchange, max_workers=3):
+        self.logger = logging.getLogger('root')
+        self.xchange = xchange
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.latencies = {}
+        # The latencies are recorded by the worker threads
+        self.latencies_lock = threading.Lock()
+
+    def dispatch(self, to_amend, to_create, to_cancel, existing_orders=None, sequential=False):
+        """Send the batches and wait for all of them. Returns the OrderBatch list, and re-raises
+           the error of the first failed batch (amend, create, cancel) once all are done, unless
+           it only ran out of retries."""
+        existing_by_id = {o['orderID']: o for o in existing_orders or []}
+        cancel = OrderBatch(ACTION_CANCEL, to_cancel)
+        amend = OrderBatch(ACTION_AMEND, to_amend)
+        create = OrderBatch(ACTION_CREATE, to_create)
+
+        # Where the amended orders rest until the amend goes through
+        amended_from = [existing_by_id[o['orderID']] for o in to_amend if o['orderID'] in existing_by_id]
+        if to_cancel and (sequential or crosses(to_amend, to_cancel)):
+            amend.depends_on.append(cancel)
+        if to_cancel and (sequential or crosses(to_create, to_cancel)):
+            create.depends_on.append(cancel)
+        if amended_from and crosses(to_create, amended_from):
+            create.depends_on.append(amend)
+
+        batches = [batch for batch in (amend, create, cancel) if batch.orders]
+        started = time.time()
+        pending = list(batches)
+        while pending:
+            # Send every batch whose dependencies are done, then wait for that round
+            ready = [b for b in pending if all(d.latency is not None for d in b.depends_on)]
+            futures = []
+            for batch in ready:
+                if any(d.error is not None or d.skipped for d in batch.depends_on):
+                    # The orders in the way may still be there
+                    batch.skipped = True
+                    batch.latency = 0.0
+                else:
+                    futures.append(self.executor.submit(self._send, batch))
+            for future in futures:
+                future.result()
+            pending = [b for b in pending if b not in ready]
+
+        if batches:
+            self.logger.info("Order batches sent in %.3fs: %s" % (time.time() - started, ", ".join(
+                "%s %d orders %.3fs%s" % (b.action, len(b.orders), b.latency,
+                                          " (failed)" if b.error else " (skipped)" if b.skipped else "")
+                for b in batches)))
+        for batch in batches:
+            if isinstance(batch.error, RetriesExhaustedError):
+                self.logger.warning("Leaving the %s of %d orders to the next tick: %s" % (
+                    batch.action, len(batch.orders), batch.error))
+            elif batch.error is not None:
+                raise batch.error
+        return batches
+
+    def get_stats(self):
+        """Latency histogram of each action's batches."""
+        with self.latencies_lock:
+            return {action: histogram.to_dict() for action, histogram in self.latencies.items()}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def _send(self, batch):
+        started = time.time()
+        try:
+            if batch.action == ACTION_CANCEL:
+                batch.result = self.xchange.cancel_orders(batch.orders)
+            elif batch.action == ACTION_AMEND:
+                batch.result = self.xchange.amend_bulk_orders(batch.orders)
+            else:
+                batch.result = self.xchange.create_bulk_orders(batch.orders)
+        except BaseException as e:
+            # Includes SystemExit from a fatal API error; it is re-raised on the calling thread
+            batch.error = e
+        finally:
+            latency = time.time() - started
+            with self.latencies_lock:
+                histogram = self.latencies.get(batch.action)
+                if histogram is None:
+                    histogram = self.latencies[batch.action] = Histogram()
+                histogram.add(latency)
+            batch.latency = latency
@@ -1,2 +1,3 @@
 from .restv1 import Client as ClientV1
 from .restv2 import Client as ClientV2
+from .session import create_session
@@ -7,8 +7,10 @@ from json.decoder import JSONDecodeError
 import base64
 import hmac
 import hashlib
-import requests
+from urllib.parse import urlparse
 from market_maker.utils.bitfinex import utils
+from market_maker.utils.rest_stats import RestStats, send_and_record
+from market_maker.rest.bitfinex.session import create_session, DEFAULT_POOL_SIZE
 
 PROTOCOL = "https"
 HOST = "api.bitfinex.com"
@@ -51,6 +53,16 @@ class Client:
     nonce_multiplier : Optional float
         Multiply nonce by this number
 
+    session : Optional requests.Session
+        Session to send the requests with, e.g. one shared with the other client.
+        By default the client creates its own with session.create_session(pool_size)
+
+    pool_size : Optional int
+        Connections kept alive by the client's own session
+
+    timeout : Optional float
+        HTTP request timeout in seconds
+
     Examples
     --------
      ::
@@ -60,13 +72,19 @@ class Client:
         bfx_client = Client(key,secret,2.0)
     """
 
-    def __init__(self, key=None, secret=None, nonce_multiplier=1000.0):
+    def __init__(self, key=None, secret=None, nonce_multiplier=1000.0, session=None, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=TIMEOUT):
         assert isinstance(nonce_multiplier, float), "nonce_multiplier must be decimal"
         self.url = "%s://%s/%s" % (PROTOCOL, HOST, VERSION)
         self.base_url = "%s://%s/" % (PROTOCOL, HOST)
         self.key = key
         self.secret = secret
         self.nonce_multiplier = nonce_multiplier
+        # Kept-alive connections, reused by every request of this client
+        self.session = session if session is not None else create_session(pool_size)
+        self.timeout = timeout
+        # Per-endpoint latency, errors and bytes of the requests sent by this client
+        self.stats = RestStats()
 
     def server(self):
         return u"{0:s}://{1:s}/{2:s}".format(PROTOCOL, HOST, VERSION)
@@ -107,21 +125,25 @@ class Client:
             "X-BFX-PAYLOAD": data
         }
 
+    def get_rest_stats(self):
+        return self.stats.get_stats()
+
     def _get(self, url):
-        response = requests.get(url, timeout=TIMEOUT)
+        response = send_and_record(self.stats, self.session, 'GET', urlparse(url).path, url, timeout=self.timeout)
         if response.status_code == 200:
             return response.json()
         else:
             try:
                 content = response.json()
             except JSONDecodeError:
-                content = response.text()
+                content = response.text
             raise BitfinexException(response.status_code, response.reason, content)
 
     def _post(self, endoint, payload, verify=True):
         url = self.url_for(path=endoint)
         signed_payload = self._sign_payload(payload)
-        response = requests.post(url, headers=signed_payload, verify=verify)
+        response = send_and_record(self.stats, self.session, 'POST', endoint, url, headers=signed_payload, verify=verify,
+                                   timeout=self.timeout)
         if response.status_code == 200:
             return response.json()
         elif response.status_code == 400:
@@ -130,7 +152,7 @@ class Client:
             try:
                 content = response.json()
             except JSONDecodeError:
-                content = response.text()
+                content = response.text
             raise BitfinexException(response.status_code, response.reason, content)
 
     def _build_parameters(self, parameters):
@@ -7,8 +7,9 @@ import json
 from json.decoder import JSONDecodeError
 import hmac
 import hashlib
-import requests
 from market_maker.utils.bitfinex import utils
+from market_maker.utils.rest_stats import RestStats, send_and_record
+from market_maker.rest.bitfinex.session import create_session, DEFAULT_POOL_SIZE
 
 PROTOCOL = "https"
 HOST = "api.bitfinex.com"
@@ -45,6 +46,16 @@ class Client:
     nonce_multiplier : Optional float
         Multiply nonce by this number
 
+    session : Optional requests.Session
+        Session to send the requests with, e.g. one shared with the other client.
+        By default the client creates its own with session.create_session(pool_size)
+
+    pool_size : Optional int
+        Connections kept alive by the client's own session
+
+    timeout : Optional float
+        HTTP request timeout in seconds
+
     Examples
     --------
      ::
@@ -54,7 +65,8 @@ class Client:
         bfx_client = Client(key,secret,2.0)
     """
 
-    def __init__(self, key=None, secret=None, nonce_multiplier=1.0):
+    def __init__(self, key=None, secret=None, nonce_multiplier=1.0, session=None, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=TIMEOUT):
         """
         Object initialisation takes 2 mandatory arguments key and secret and a optional one
         nonce_multiplier
@@ -65,6 +77,15 @@ class Client:
         self.key = key
         self.secret = secret
         self.nonce_multiplier = nonce_multiplier
+        # Kept-alive connections, reused by every request of this client
+        self.session = session if session is not None else self._create_session(pool_size)
+        self.timeout = timeout
+        # Per-endpoint latency, errors and bytes of the requests sent by this client
+        self.stats = RestStats()
+
+    def _create_session(self, pool_size):
+        """Create the session of a client which isn't given one"""
+        return create_session(pool_size)
 
     def _nonce(self):
         """Returns a nonce used in authentication.
@@ -94,7 +115,8 @@ class Client:
         """
         nonce = self._nonce()
         headers = self._headers(path, nonce, payload)
-        response = requests.post(self.base_url + path, headers=headers, data=payload, verify=verify)
+        response = send_and_record(self.stats, self.session, 'POST', path, self.base_url + path, headers=headers,
+                                   data=payload, verify=verify, timeout=self.timeout)
 
         if response.status_code == 200:
             return response.json()
@@ -102,22 +124,25 @@ class Client:
             try:
                 content = response.json()
             except JSONDecodeError:
-                content = response.text()
+                content = response.text
             raise BitfinexException(response.status_code, response.reason, content)
 
+    def get_rest_stats(self):
+        return self.stats.get_stats()
+
     def _get(self, path, **params):
         """
         Send get request to bitfinex
         """
         url = self.base_url + path
-        response = requests.get(url, timeout=TIMEOUT, params=params)
+        response = send_and_record(self.stats, self.session, 'GET', path, url, timeout=self.timeout, params=params)
         if response.status_code == 200:
             return response.json()
         else:
             try:
                 content = response.json()
             except JSONDecodeError:
-                content = response.text()
+                content = response.text
             raise BitfinexException(response.status_code, response.reason, content)
 
     # REST PUBLIC ENDPOINTS
@@ -0,0 +1,114 @@
+"""Asyncio variant of the Bitfinex Rest API V2 client"""
+
+from __future__ import absolute_import
+import asyncio
+import time
+import aiohttp
+from market_maker.rest.bitfinex.restv2 import Client, BitfinexException, TIMEOUT
+from market_maker.rest.bitfinex.session import DEFAULT_POOL_SIZE
+from market_maker.ws.bitfinex.event_loop import get_shared_event_loop
+
+
+class AsyncClient(Client):
+    """Client for the bitfinex.com API REST V2 on asyncio, with the same methods as
+    :class:`Client`. Every method returns a coroutine, so independent requests can run
+    concurrently on the event loop the websockets already run on.
+
+    The client belongs to one EventLoopThread, by default the one shared by the websockets.
+    Its connection pool is created on that loop, and its coroutines must run there, e.g.
+    awaited by a websocket listener or passed to submit() from another thread:
+
+    Examples
+    --------
+     ::
+
+        bfx_client = AsyncClient(key, secret)
+        wallets, positions, orders = await asyncio.gather(
+            bfx_client.wallets_balance(), bfx_client.active_positions(), bfx_client.active_orders())
+
+        # From another thread
+        orders = bfx_client.submit(bfx_client.active_orders()).result()
+
+    Bitfinex rejects an authenticated request whose nonce isn't above the last one it saw for
+    the key. Authenticated requests are therefore sent one at a time, in nonce order; public
+    ones are not limited.
+    """
+
+    def __init__(self, key=None, secret=None, nonce_multiplier=1.0, pool_size=DEFAULT_POOL_SIZE, timeout=TIMEOUT,
+                 event_loop=None):
+        Client.__init__(self, key, secret, nonce_multiplier, pool_size=pool_size, timeout=timeout)
+        self.pool_size = pool_size
+        self.event_loop = event_loop or get_shared_event_loop()
+        self.aiohttp_session = None
+        self._auth_lock = None
+        self.event_loop.call_soon(self._get_session)
+
+    def _create_session(self, pool_size):
+        # Requests are sent with the aiohttp session instead, no requests pool needed
+        return None
+
+    def submit(self, coro):
+        """
+        Run a coroutine of the client on its loop from any thread. Returns a concurrent.futures.Future
+        """
+        return self.event_loop.submit(coro)
+
+    async def close(self):
+        if self.aiohttp_session is not None:
+            await self.aiohttp_session.close()
+            self.aiohttp_session = None
+
+    def _get_session(self):
+        if asyncio.get_event_loop() is not self.event_loop.loop:
+            raise RuntimeError("AsyncClient requests must run on the client's event loop, see submit().")
+        if self.aiohttp_session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.aiohttp_session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._auth_lock = asyncio.Lock()
+        return self.aiohttp_session
+
+    async def _post(self, path, payload, verify=False):
+        """
+        Send post request to bitfinex
+        """
+        session = self._get_session()
+        kwargs = {} if verify else {'ssl': False}
+        async with self._auth_lock:
+            nonce = self._nonce()
+            headers = self._headers(path, nonce, payload)
+            return await self._send('POST', path, session, headers=headers, data=payload, **kwargs)
+
+    async def _get(self, path, **params):
+        """
+        Send get request to bitfinex
+        """
+        return await self._send('GET', path, self._get_session(), params=params)
+
+    async def _send(self, verb, path, session, **kwargs):
+        status = 'error'
+        started = time.time()
+        sent = len(kwargs.get('data') or '')
+        received = 0
+        try:
+            async with session.request(verb, self.base_url + path, **kwargs) as response:
+                status = response.status
+                body = await response.read()
+                received = len(body)
+                try:
+                    content = await response.json(content_type=None)
+                except ValueError:
+                    content = body.decode('utf8', 'replace')
+                self.stats.record(verb, path, status, time.time() - started, sent, received, response.headers)
+                if status == 200:
+                    return content
+                raise BitfinexException(status, response.reason, content)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise
+        except aiohttp.ClientConnectionError:
+            status = 'connection'
+            raise
+        finally:
+            if not isinstance(status, int):
+                self.stats.record(verb, path, status, time.time() - started, sent, received)
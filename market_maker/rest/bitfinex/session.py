@@ -0,0 +1,19 @@
+"""Pooled keep-alive HTTP sessions for the Bitfinex REST clients."""
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept open to api.bitfinex.com. Requests beyond this block until one is free.
+DEFAULT_POOL_SIZE = 10
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """Create a session keeping up to `pool_size` connections alive, so requests after the first
+    one skip the TCP and TLS handshakes. Can be shared by several clients and threads."""
+    session = requests.Session()
+    # One host, but requests sent with and without TLS verification get separate pools; keeping
+    # a few pools around stops them evicting each other's connections.
+    # The clients decide themselves whether to retry; don't let urllib3 resend orders.
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
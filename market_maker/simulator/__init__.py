@@ -0,0 +1,7 @@
+"""
+This module contains a local stand-in for the BitMEX REST and websocket API,
+used to run the robot offline against a simulated market
+"""
+
+
+NAME = 'simulator'
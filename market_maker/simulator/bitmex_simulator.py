@@ -0,0 +1,726 @@
+"""
+Local stand-in for the subset of BitMEX the robot uses, for offline load tests:
+
+  REST (under /api/v1/): order (GET/POST/PUT/DELETE), order/bulk (POST/PUT),
+                         order/all (DELETE), order/cancelAllAfter (POST),
+                         instrument, position and user/margin (GET)
+  Websocket (/realtime): instrument, quote, trade, orderBookL2_25, orderBookL2,
+                         order, execution, position and margin tables
+
+Both are served on the same port, so the robot runs against it by setting
+BITMEX_BASE_URL to http://<host>:<port>/api/v1/. Any API key is accepted.
+REST responses carry X-RateLimit-* headers from a server side token bucket,
+and requests over the limit get a 429.
+
+A market feed (random walk or a replayed ws journal) places the quotes of the
+rest of the market as limit orders and its trades as market orders, so the
+robot's orders fill by price-time priority. GET /sim/stats returns request
+latencies, rate limiting, tick-to-order latency and the account's fills.
+
+Run with:
+    python -m market_maker.simulator.bitmex_simulator --port 8088 --symbol XBTUSD
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from market_maker.simulator.matching_engine import MatchingEngine, EngineError
+from market_maker.simulator.market_feed import RandomWalkFeed, JournalFeed, round_to_tick
+from market_maker.simulator.websocket_server import WebsocketConnection, is_upgrade_request
+from market_maker.utils.latency_stats import Histogram
+
+logger = logging.getLogger('simulator')
+
+API_PREFIX = '/api/v1/'
+ACCOUNT = 1
+XBt_TO_XBT = 100000000
+ORDER_BOOK_DEPTH = {'orderBookL2_25': 25, 'orderBookL2': 200}
+MAX_TERMINATED_ORDERS = 1000
+
+TABLE_KEYS = {
+    'instrument': ['symbol'],
+    'quote': [],
+    'trade': [],
+    'orderBookL2_25': ['symbol', 'id', 'side'],
+    'orderBookL2': ['symbol', 'id', 'side'],
+    'order': ['orderID'],
+    'execution': ['execID'],
+    'position': ['account', 'symbol', 'currency'],
+    'margin': ['account', 'currency']
+}
+
+VOLATILITY_INDEX = {'symbol': '.BVOL24H', 'state': 'Unlisted', 'tickSize': 0.01, 'markPrice': 3.0,
+                    'lastPrice': 3.0, 'bidPrice': None, 'askPrice': None, 'midPrice': None}
+
+
+def get_timestamp(epoch=None):
+    moment = datetime.datetime.utcfromtimestamp(time.time() if epoch is None else epoch)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class SimulatedAccount(object):
+    """Position and wallet of the robot's account in an inverse (XBT margined) contract."""
+
+    def __init__(self, symbol, balance, leverage):
+        self.symbol = symbol
+        self.leverage = leverage
+        self.wallet_balance = int(balance * XBt_TO_XBT)
+        self.realised_pnl = 0
+        self.current_qty = 0
+        # Sum of contracts / price over the open position, in XBT
+        self.cost = 0.0
+
+    def apply_fill(self, side, qty, price):
+        signed_qty = qty if side == 'Buy' else -qty
+        if self.current_qty == 0 or (self.current_qty > 0) == (signed_qty > 0):
+            self.current_qty += signed_qty
+            self.cost += qty / price
+            return
+        closed = min(qty, abs(self.current_qty))
+        entry_cost = self.cost * closed / abs(self.current_qty)
+        # Long: profit when the exit price is above entry, i.e. 1/entry > 1/exit
+        pnl = (entry_cost - closed / price) if self.current_qty > 0 else (closed / price - entry_cost)
+        pnl = int(round(pnl * XBt_TO_XBT))
+        self.realised_pnl += pnl
+        self.wallet_balance += pnl
+        self.cost -= entry_cost
+        self.current_qty += closed if signed_qty > 0 else -closed
+        remaining = qty - closed
+        if self.current_qty == 0:
+            self.cost = 0.0
+        if remaining:
+            self.current_qty += remaining if signed_qty > 0 else -remaining
+            self.cost = remaining / price
+
+    def avg_entry_price(self):
+        return abs(self.current_qty) / self.cost if self.current_qty else None
+
+    def unrealised_pnl(self, mark_price):
+        if not self.current_qty or not mark_price:
+            return 0
+        value = abs(self.current_qty) / mark_price
+        pnl = (self.cost - value) if self.current_qty > 0 else (value - self.cost)
+        return int(round(pnl * XBt_TO_XBT))
+
+    def position_row(self, mark_price):
+        entry = self.avg_entry_price()
+        liquidation = None
+        if entry:
+            liquidation = entry / (1 + 1.0 / self.leverage) if self.current_qty > 0 else entry / (1 - 1.0 / self.leverage)
+        return {
+            'account': ACCOUNT, 'symbol': self.symbol, 'currency': 'XBt', 'leverage': self.leverage,
+            'currentQty': self.current_qty, 'isOpen': self.current_qty != 0,
+            'avgEntryPrice': entry, 'avgCostPrice': entry, 'markPrice': mark_price,
+            'liquidationPrice': liquidation, 'realisedPnl': self.realised_pnl,
+            'unrealisedPnl': self.unrealised_pnl(mark_price), 'timestamp': get_timestamp()
+        }
+
+    def margin_row(self, mark_price):
+        unrealised = self.unrealised_pnl(mark_price)
+        return {
+            'account': ACCOUNT, 'currency': 'XBt', 'amount': self.wallet_balance,
+            'walletBalance': self.wallet_balance, 'marginBalance': self.wallet_balance + unrealised,
+            'availableMargin': self.wallet_balance + unrealised, 'realisedPnl': self.realised_pnl,
+            'unrealisedPnl': unrealised, 'timestamp': get_timestamp()
+        }
+
+
+class ServerRateLimit(object):
+    """Token bucket per API key, like the BitMEX REST limit."""
+
+    def __init__(self, limit, period=60):
+        self.limit = limit
+        self.period = period
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """Returns (allowed, headers)."""
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (float(self.limit), now))
+            tokens = min(float(self.limit), tokens + (now - updated) * self.limit / self.period)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+        reset = int(now + (self.limit - tokens) * self.period / self.limit) + 1
+        return allowed, {'X-RateLimit-Limit': str(self.limit), 'X-RateLimit-Remaining': str(int(tokens)),
+                         'X-RateLimit-Reset': str(reset)}
+
+
+class WsClient(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.tables = set()
+
+
+class SimulatedBitMEX(object):
+    """Exchange state behind the REST and websocket handlers. All state changes happen under
+       one lock, and the table updates they cause are sent to the websocket clients before
+       it is released, so every client sees them in order."""
+
+    def __init__(self, symbol, tick_size, feed, rate_limit=60, balance=1.0, leverage=10, crowd_depth=5):
+        self.symbol = symbol
+        self.tick_size = tick_size
+        self.feed = feed
+        self.crowd_depth = crowd_depth
+        self.lock = threading.RLock()
+        self.engine = MatchingEngine(symbol)
+        self.account = SimulatedAccount(symbol, balance, leverage)
+        self.rate_limit = ServerRateLimit(rate_limit)
+        self.clients = []
+        self.crowd_orders = []
+        self.quote = None
+        self.last_price = None
+        self.mark_price = None
+        self.trades = deque(maxlen=100)
+        self.executions = deque(maxlen=100)
+        self.published_book = {}
+        self.position_published = False
+        self.instrument = {
+            'symbol': symbol, 'state': 'Open', 'typ': 'FFWCSX', 'tickSize': tick_size, 'lotSize': 1,
+            'bidPrice': None, 'askPrice': None, 'midPrice': None, 'lastPrice': None, 'markPrice': None,
+            'timestamp': get_timestamp()
+        }
+        self.cancel_all_timer = None
+        self.stopped = threading.Event()
+        self.last_feed_event_at = None
+        self.stats = {
+            'requests': {}, 'rateLimited': 0, 'tickToOrder': Histogram(), 'feedEvents': 0,
+            'wsMessages': 0, 'fills': 0, 'filledQty': 0, 'cancelAllAfterTriggered': 0
+        }
+
+    #
+    # Market feed
+    #
+    def run_feed(self):
+        for delay, event in self.feed:
+            if self.stopped.wait(delay) if delay else self.stopped.is_set():
+                break
+            with self.lock:
+                if event[0] == 'quote':
+                    self._on_feed_quote(*event[1:])
+                else:
+                    self._on_feed_trade(*event[1:])
+                self.stats['feedEvents'] += 1
+                self.last_feed_event_at = time.time()
+        logger.info("Market feed finished")
+
+    def _on_feed_quote(self, bid, bid_size, ask, ask_size):
+        self.mark_price = (bid + ask) / 2.0
+        for order in self.crowd_orders:
+            self.engine.cancel(order['orderID'])
+        self.crowd_orders = []
+        fills = []
+        for level in range(self.crowd_depth):
+            for side, price, size in (('Buy', bid - level * self.tick_size, bid_size),
+                                      ('Sell', ask + level * self.tick_size, ask_size)):
+                order = {'side': side, 'price': round_to_tick(price, self.tick_size), 'symbol': self.symbol,
+                         'orderQty': int(size * (1 + level * 0.5)), 'account': 0}
+                fills += self.engine.submit(order)
+                if order['leavesQty'] > 0:
+                    self.crowd_orders.append(order)
+        self._after_change(fills)
+
+    def _on_feed_trade(self, side, size):
+        order = {'side': side, 'price': float('inf') if side == 'Buy' else 0.0, 'symbol': self.symbol,
+                 'orderQty': size, 'account': 0}
+        fills = self.engine.submit(order)
+        # Market order: whatever didn't fill is gone
+        self.engine.cancel(order['orderID'])
+        self._after_change(fills)
+
+    #
+    # REST
+    #
+    def handle_rest(self, verb, path, query, body, api_key):
+        """Returns (status, payload, headers)."""
+        started = time.time()
+        endpoint = path[len(API_PREFIX):] if path.startswith(API_PREFIX) else path
+        allowed, headers = self.rate_limit.take(api_key or '')
+        if not allowed:
+            self.stats['rateLimited'] += 1
+            status, payload = 429, {'error': {'message': 'Rate limit exceeded, retry in 1 seconds.',
+                                              'name': 'RateLimitError'}}
+        else:
+            if verb != 'GET' and endpoint.startswith('order') and self.last_feed_event_at is not None:
+                self.stats['tickToOrder'].add(started - self.last_feed_event_at)
+            try:
+                with self.lock:
+                    status, payload = self._route(verb, endpoint, query, body)
+            except EngineError as e:
+                status, payload = 400, {'error': {'message': str(e), 'name': 'HTTPError'}}
+            except (KeyError, ValueError, TypeError) as e:
+                status, payload = 400, {'error': {'message': 'Invalid request: %s' % e, 'name': 'ValidationError'}}
+        histogram = self.stats['requests'].setdefault('%s %s' % (verb, endpoint), Histogram())
+        histogram.add(time.time() - started)
+        return status, payload, headers
+
+    def _route(self, verb, endpoint, query, body):
+        if endpoint == 'order/bulk' and verb == 'POST':
+            return 200, [self._create_order(order) for order in body['orders']]
+        if endpoint == 'order/bulk' and verb == 'PUT':
+            return 200, self._amend_orders(body['orders'])
+        if endpoint == 'order' and verb == 'POST':
+            return 200, self._create_order(body)
+        if endpoint == 'order' and verb == 'PUT':
+            return 200, self._amend_orders([body])[0]
+        if endpoint == 'order' and verb == 'DELETE':
+            return 200, self._cancel_orders(body or query)
+        if endpoint == 'order/all' and verb == 'DELETE':
+            return 200, self._cancel_all((body or query).get('symbol'))
+        if endpoint == 'order/cancelAllAfter' and verb == 'POST':
+            return 200, self._cancel_all_after(int(body['timeout']))
+        if endpoint == 'order' and verb == 'GET':
+            return 200, self._get_orders(query)
+        if endpoint == 'instrument' and verb == 'GET':
+            return 200, [dict(self.instrument)]
+        if endpoint == 'position' and verb == 'GET':
+            return 200, [self.account.position_row(self.mark_price)]
+        if endpoint == 'user/margin' and verb == 'GET':
+            return 200, self.account.margin_row(self.mark_price)
+        return 404, {'error': {'message': 'Not Found', 'name': 'HTTPError'}}
+
+    def _create_order(self, request):
+        qty = request['orderQty']
+        side = request.get('side') or ('Buy' if qty > 0 else 'Sell')
+        price = request.get('price')
+        if price is None:
+            raise EngineError('Only limit orders are supported')
+        if request.get('symbol', self.symbol) != self.symbol:
+            raise EngineError('Invalid symbol')
+        if abs(round(price / self.tick_size) * self.tick_size - price) > 1e-9:
+            raise EngineError('Invalid price tickSize')
+        clOrdID = request.get('clOrdID') or ''
+        if clOrdID and any(o.get('clOrdID') == clOrdID for o in self.engine.orders.values()):
+            raise EngineError('Duplicate clOrdID')
+        now = get_timestamp()
+        order = {'orderID': str(uuid.uuid4()), 'clOrdID': clOrdID, 'account': ACCOUNT, 'symbol': self.symbol,
+                 'side': side, 'orderQty': abs(qty), 'price': price, 'ordType': 'Limit',
+                 'execInst': request.get('execInst', ''), 'text': 'Submitted via API.', 'timestamp': now,
+                 'transactTime': now, 'workingIndicator': True}
+        fills = self.engine.submit(order)
+        self._publish('order', 'insert', [dict(order)])
+        self._add_execution(order, 'New' if order['ordStatus'] != 'Canceled' else 'Canceled')
+        self._after_change(fills, inserted=order)
+        return dict(order)
+
+    def _amend_orders(self, requests):
+        results = []
+        for request in requests:
+            order = self.engine.orders.get(request.get('orderID'))
+            if order is None and request.get('orderID') in self.engine.forgotten:
+                raise EngineError('Invalid ordStatus')
+            if order is None or order['account'] != ACCOUNT:
+                raise EngineError('Invalid orderID')
+            price = request.get('price')
+            if price is not None and abs(round(price / self.tick_size) * self.tick_size - price) > 1e-9:
+                raise EngineError('Invalid price tickSize')
+            orderQty = request.get('orderQty')
+            if orderQty is None and request.get('leavesQty') is not None:
+                orderQty = order['cumQty'] + request['leavesQty']
+            fills = self.engine.amend(order['orderID'], orderQty, price)
+            order['timestamp'] = get_timestamp()
+            # An amend that crosses fills right away; its fills go out in the same update
+            fields = ('orderQty', 'price', 'leavesQty', 'ordStatus', 'text') + (('cumQty', 'avgPx') if fills else ())
+            self._publish('order', 'update', [self._order_fields(order, fields)])
+            self._add_execution(order, 'Replaced' if order['ordStatus'] != 'Canceled' else 'Canceled')
+            self._after_change(fills, inserted=order)
+            results.append(dict(order))
+        return results
+
+    def _cancel_orders(self, request):
+        orderIDs = request.get('orderID') or []
+        clOrdIDs = request.get('clOrdID') or []
+        orderIDs = [orderIDs] if isinstance(orderIDs, str) else list(orderIDs)
+        clOrdIDs = [clOrdIDs] if isinstance(clOrdIDs, str) else list(clOrdIDs)
+        orderIDs += [o['orderID'] for o in self.engine.orders.values() if clOrdIDs and o.get('clOrdID') in clOrdIDs]
+        results = []
+        for orderID in orderIDs:
+            order = self.engine.orders.get(orderID)
+            if order is None or order['account'] != ACCOUNT:
+                results.append({'orderID': orderID, 'error': 'Not Found'})
+                continue
+            if self.engine.cancel(orderID) is not None:
+                order['timestamp'] = get_timestamp()
+                self._publish('order', 'update', [self._order_fields(order, ('leavesQty', 'ordStatus', 'text'))])
+                self._add_execution(order, 'Canceled')
+            results.append(dict(order))
+        self._after_change([])
+        return results
+
+    def _cancel_all(self, symbol=None, text='Canceled: Canceled via API.'):
+        orderIDs = [o['orderID'] for o in self.engine.open_orders()
+                    if o['account'] == ACCOUNT and symbol in (None, o['symbol'])]
+        results = []
+        for orderID in orderIDs:
+            order = self.engine.cancel(orderID, text)
+            order['timestamp'] = get_timestamp()
+            self._publish('order', 'update', [self._order_fields(order, ('leavesQty', 'ordStatus', 'text'))])
+            self._add_execution(order, 'Canceled')
+            results.append(dict(order))
+        self._after_change([])
+        return results
+
+    def _cancel_all_after(self, timeout_ms):
+        """Dead man's switch: cancel all orders once `timeout_ms` pass without another call. 0 disarms it."""
+        if self.cancel_all_timer is not None:
+            self.cancel_all_timer.cancel()
+            self.cancel_all_timer = None
+        now = time.time()
+        if timeout_ms <= 0:
+            return {'now': get_timestamp(now)}
+        self.cancel_all_timer = threading.Timer(timeout_ms / 1000.0, self._on_cancel_all_after)
+        self.cancel_all_timer.daemon = True
+        self.cancel_all_timer.start()
+        return {'now': get_timestamp(now), 'cancelTime': get_timestamp(now + timeout_ms / 1000.0)}
+
+    def _on_cancel_all_after(self):
+        with self.lock:
+            self.cancel_all_timer = None
+            cancelled = self._cancel_all(text='Canceled: Cancel all after timeout')
+            self.stats['cancelAllAfterTriggered'] += 1
+        logger.info("Dead man's switch triggered, cancelled %d orders" % len(cancelled))
+
+    def _get_orders(self, query):
+        filters = json.loads(query['filter']) if query.get('filter') else {}
+        orders = [o for o in self.engine.orders.values() if o['account'] == ACCOUNT]
+        for field, value in filters.items():
+            if field == 'ordStatus.isTerminated':
+                orders = [o for o in orders if (o['ordStatus'] in ('Filled', 'Canceled')) == value]
+            elif isinstance(value, list):
+                orders = [o for o in orders if o.get(field) in value]
+            else:
+                orders = [o for o in orders if o.get(field) == value]
+        count = int(query.get('count', 100))
+        return [dict(o) for o in orders[-count:]]
+
+    #
+    # Table updates
+    #
+    def _order_fields(self, order, fields):
+        row = {'orderID': order['orderID'], 'symbol': order['symbol'], 'account': ACCOUNT,
+               'timestamp': order['timestamp']}
+        for field in fields:
+            row[field] = order.get(field)
+        return row
+
+    def _add_execution(self, order, exec_type, last_qty=None, last_px=None):
+        row = {'execID': str(uuid.uuid4()), 'orderID': order['orderID'], 'clOrdID': order.get('clOrdID'),
+               'account': ACCOUNT, 'symbol': order['symbol'], 'side': order['side'], 'execType': exec_type,
+               'ordStatus': order['ordStatus'], 'lastQty': last_qty, 'lastPx': last_px, 'price': order['price'],
+               'orderQty': order['orderQty'], 'leavesQty': order['leavesQty'], 'cumQty': order['cumQty'],
+               'avgPx': order['avgPx'], 'text': order.get('text'), 'timestamp': get_timestamp()}
+        self.executions.append(row)
+        self._publish('execution', 'insert', [row])
+
+    def _after_change(self, fills, inserted=None):
+        """Publish what a change to the book caused: fills, account, quote, instrument and book.
+           `inserted` is the robot order the change was made for; its row was already published."""
+        trades = []
+        filled_orders = {}
+        for fill in fills:
+            if not fill.is_maker:
+                trades.append({'timestamp': get_timestamp(), 'symbol': self.symbol, 'side': fill.order['side'],
+                               'size': fill.qty, 'price': fill.price})
+                self.last_price = fill.price
+            if fill.order.get('account') == ACCOUNT:
+                self.account.apply_fill(fill.order['side'], fill.qty, fill.price)
+                self.stats['fills'] += 1
+                self.stats['filledQty'] += fill.qty
+                self._add_execution(fill.order, 'Trade', fill.qty, fill.price)
+                if fill.order is not inserted:
+                    filled_orders[fill.order['orderID']] = fill.order
+
+        if filled_orders:
+            self._publish('order', 'update', [self._order_fields(o, ('ordStatus', 'leavesQty', 'cumQty', 'avgPx'))
+                                              for o in filled_orders.values()])
+        if trades:
+            self.trades.extend(trades)
+            self._publish('trade', 'insert', trades)
+        if fills or filled_orders or inserted is not None:
+            self._publish_account()
+        self._publish_market()
+        self.engine.forget_terminated(MAX_TERMINATED_ORDERS)
+
+    def _publish_account(self):
+        position = self.account.position_row(self.mark_price)
+        self._publish('position', 'update' if self.position_published else 'insert', [position])
+        self.position_published = True
+        self._publish('margin', 'update', [self.account.margin_row(self.mark_price)])
+
+    def _publish_market(self):
+        bid, ask = self.engine.best_bid(), self.engine.best_ask()
+        bid_size = self.engine.bids.depth(1)[0][1] if bid is not None else None
+        ask_size = self.engine.asks.depth(1)[0][1] if ask is not None else None
+        quote = (bid, bid_size, ask, ask_size)
+        if quote != self.quote and bid is not None and ask is not None:
+            self.quote = quote
+            self._publish('quote', 'insert', [{'timestamp': get_timestamp(), 'symbol': self.symbol,
+                                               'bidPrice': bid, 'bidSize': bid_size,
+                                               'askPrice': ask, 'askSize': ask_size}])
+        changes = {}
+        for field, value in (('bidPrice', bid), ('askPrice', ask), ('lastPrice', self.last_price or self.mark_price),
+                             ('markPrice', self.mark_price),
+                             ('midPrice', (bid + ask) / 2.0 if bid is not None and ask is not None else None)):
+            if self.instrument[field] != value:
+                changes[field] = self.instrument[field] = value
+        if changes:
+            self.instrument['timestamp'] = changes['timestamp'] = get_timestamp()
+            changes['symbol'] = self.symbol
+            self._publish('instrument', 'update', [changes])
+            if 'markPrice' in changes and self.account.current_qty:
+                self._publish_account()
+        self._publish_book()
+
+    def _book_rows(self, depth):
+        bids, asks = self.engine.depth(depth)
+        rows = {}
+        for side, levels in (('Buy', bids), ('Sell', asks)):
+            for price, size in levels:
+                level_id = 8800000000 - int(round(price * 100))
+                rows[(level_id, side)] = {'symbol': self.symbol, 'id': level_id, 'side': side, 'size': size, 'price': price}
+        return rows
+
+    def _publish_book(self):
+        for table, depth in ORDER_BOOK_DEPTH.items():
+            if not any(table in client.tables for client in self.clients):
+                continue
+            rows = self._book_rows(depth)
+            published = self.published_book.get(table, {})
+            deleted = [{'symbol': self.symbol, 'id': key[0], 'side': key[1]} for key in published if key not in rows]
+            inserted = [row for key, row in rows.items() if key not in published]
+            updated = [{'symbol': self.symbol, 'id': row['id'], 'side': row['side'], 'size': row['size']}
+                       for key, row in rows.items() if key in published and published[key]['size'] != row['size']]
+            for action, data in (('delete', deleted), ('insert', inserted), ('update', updated)):
+                if data:
+                    self._publish(table, action, data)
+            self.published_book[table] = rows
+
+    def _publish(self, table, action, rows):
+        message = None
+        for client in self.clients:
+            if table in client.tables:
+                if message is None:
+                    message = json.dumps({'table': table, 'action': action, 'data': rows})
+                if client.connection.send(message):
+                    self.stats['wsMessages'] += 1
+
+    #
+    # Websocket
+    #
+    def serve_websocket(self, handler):
+        connection = WebsocketConnection(handler)
+        connection.accept()
+        client = WsClient(connection)
+        topics = parse_qs(urlparse(handler.path).query).get('subscribe', [''])[0].split(',')
+        with self.lock:
+            connection.send(json.dumps({'info': 'Welcome to the BitMEX simulator.', 'version': 'simulator',
+                                        'timestamp': get_timestamp(), 'limit': {'remaining': self.rate_limit.limit}}))
+            for topic in topics:
+                if topic:
+                    self._subscribe(client, topic)
+            self.clients.append(client)
+        try:
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                if message == 'ping':
+                    connection.send('pong')
+                    continue
+                request = json.loads(message)
+                if request.get('op') == 'subscribe':
+                    with self.lock:
+                        for topic in request.get('args', []):
+                            self._subscribe(client, topic)
+                else:
+                    connection.send(json.dumps({'status': 400, 'error': 'Unknown or unsupported operation',
+                                                'request': request}))
+        finally:
+            with self.lock:
+                self.clients.remove(client)
+            handler.close_connection = True
+
+    def _subscribe(self, client, topic):
+        table, _, symbol = topic.partition(':')
+        request = {'op': 'subscribe', 'args': [topic]}
+        if table not in TABLE_KEYS or (symbol and symbol not in (self.symbol, VOLATILITY_INDEX['symbol'])):
+            client.connection.send(json.dumps({'success': False, 'error': 'Unknown table: %s' % topic,
+                                               'request': request}))
+            return
+        client.connection.send(json.dumps({'success': True, 'subscribe': topic, 'request': request}))
+        if symbol == VOLATILITY_INDEX['symbol']:
+            # Static index; sent once
+            data = [dict(VOLATILITY_INDEX, timestamp=get_timestamp())]
+        else:
+            data = self._get_image(table)
+            client.tables.add(table)
+        client.connection.send(json.dumps({'table': table, 'action': 'partial', 'keys': TABLE_KEYS[table],
+                                           'types': {}, 'foreignKeys': {}, 'attributes': {},
+                                           'filter': {'symbol': symbol} if symbol else {'account': ACCOUNT},
+                                           'data': data}))
+
+    def _get_image(self, table):
+        if table == 'instrument':
+            return [dict(self.instrument)]
+        if table == 'quote':
+            if self.quote is None:
+                return []
+            bid, bid_size, ask, ask_size = self.quote
+            return [{'timestamp': get_timestamp(), 'symbol': self.symbol, 'bidPrice': bid, 'bidSize': bid_size,
+                     'askPrice': ask, 'askSize': ask_size}]
+        if table == 'trade':
+            return list(self.trades)
+        if table in ORDER_BOOK_DEPTH:
+            rows = self._book_rows(ORDER_BOOK_DEPTH[table])
+            self.published_book[table] = rows
+            return list(rows.values())
+        if table == 'order':
+            return [dict(o) for o in self.engine.open_orders() if o['account'] == ACCOUNT]
+        if table == 'execution':
+            return list(self.executions)
+        if table == 'position':
+            self.position_published = True
+            return [self.account.position_row(self.mark_price)]
+        if table == 'margin':
+            return [self.account.margin_row(self.mark_price)]
+        return []
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'requests': {key: histogram.to_dict() for key, histogram in self.stats['requests'].items()},
+                'rateLimited': self.stats['rateLimited'],
+                'tickToOrder': self.stats['tickToOrder'].to_dict(),
+                'feedEvents': self.stats['feedEvents'],
+                'wsClients': len(self.clients),
+                'wsMessages': self.stats['wsMessages'],
+                'fills': self.stats['fills'],
+                'filledQty': self.stats['filledQty'],
+                'cancelAllAfterTriggered': self.stats['cancelAllAfterTriggered'],
+                'openOrders': len([o for o in self.engine.open_orders() if o['account'] == ACCOUNT]),
+                'position': self.account.position_row(self.mark_price),
+                'margin': self.account.margin_row(self.mark_price)
+            }
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    simulator = None
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body go out in separate writes; don't let Nagle hold the body back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/realtime' and is_upgrade_request(self.headers):
+            self.simulator.serve_websocket(self)
+        elif urlparse(self.path).path == '/sim/stats':
+            self._send_json(200, self.simulator.get_stats())
+        else:
+            self._handle_rest('GET')
+
+    def do_POST(self):
+        self._handle_rest('POST')
+
+    def do_PUT(self):
+        self._handle_rest('PUT')
+
+    def do_DELETE(self):
+        self._handle_rest('DELETE')
+
+    def _handle_rest(self, verb):
+        parsed = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf8')) if length else None
+        status, payload, headers = self.simulator.handle_rest(verb, parsed.path, query, body, self.headers.get('api-key'))
+        self._send_json(status, payload, headers)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(simulator, host='127.0.0.1', port=8088):
+    handler = type('BoundSimulatorRequestHandler', (SimulatorRequestHandler,), {'simulator': simulator})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start(simulator, host='127.0.0.1', port=8088):
+    """Serve the simulator and run its feed in background threads. Returns the server;
+       server.server_address has the port actually bound (port=0 picks a free one)."""
+    server = create_server(simulator, host, port)
+    for target in (server.serve_forever, simulator.run_feed):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local BitMEX simulator')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--symbol', type=str, default='XBTUSD')
+    parser.add_argument('--tick-size', type=float, default=0.5)
+    parser.add_argument('--price', type=float, default=10000.0, help='Start price of the random walk')
+    parser.add_argument('--interval', type=float, default=0.5, help='Seconds between random walk quotes')
+    parser.add_argument('--volatility', type=float, default=0.0005, help='Random walk step volatility')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--journal', type=str, default=None, help='Replay the quotes and trades of a ws journal instead')
+    parser.add_argument('--speed', type=float, default=1.0, help='Journal replay speed, 0 for as fast as possible')
+    parser.add_argument('--rate-limit', type=int, default=60, help='REST requests per minute')
+    parser.add_argument('--balance', type=float, default=1.0, help='Wallet balance in XBT')
+    parser.add_argument('--leverage', type=float, default=10)
+    parser.add_argument('--debug', action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.journal:
+        feed = JournalFeed(args.journal, args.symbol, args.speed)
+    else:
+        feed = RandomWalkFeed(args.price, args.tick_size, interval=args.interval, volatility=args.volatility,
+                              seed=args.seed)
+    simulator = SimulatedBitMEX(args.symbol, args.tick_size, feed, rate_limit=args.rate_limit,
+                                balance=args.balance, leverage=args.leverage)
+    server = start(simulator, args.host, args.port)
+    logger.info("BitMEX simulator listening; set BITMEX_BASE_URL to http://%s:%d%s" % (
+        server.server_address[0], server.server_address[1], API_PREFIX))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stopped.set()
+        server.shutdown()
+        print(json.dumps(simulator.get_stats(), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Market feeds driving the simulator: a seeded random walk, or the quotes and
+trades of a websocket journal captured from BitMEX (see ws/bitmex/ws_journal.py).
+
+A feed yields (delay, event) tuples, where event is one of
+    ('quote', bidPrice, bidSize, askPrice, askSize)
+    ('trade', side, size)
+and delay the time to wait before applying it.
+"""
+
+import json
+import math
+import random
+from market_maker.ws.bitmex.ws_journal import read_journal
+
+
+def round_to_tick(price, tick_size):
+    return round(round(price / tick_size) * tick_size, 8)
+
+
+class RandomWalkFeed(object):
+    """Log-normal random walk of the mid price with a spread of one or two ticks, and
+       market orders of random side and size arriving with probability trade_probability per step."""
+
+    def __init__(self, price, tick_size, interval=0.5, volatility=0.0005, trade_probability=0.3,
+                 quote_size=(1000, 20000), trade_size=(100, 5000), seed=None):
+        self.price = price
+        self.tick_size = tick_size
+        self.interval = interval
+        self.volatility = volatility
+        self.trade_probability = trade_probability
+        self.quote_size = quote_size
+        self.trade_size = trade_size
+        self.random = random.Random(seed)
+
+    def __iter__(self):
+        while True:
+            self.price *= math.exp(self.random.gauss(0, self.volatility))
+            half_spread = self.tick_size * self.random.choice((0.5, 1))
+            bid = round_to_tick(self.price - half_spread, self.tick_size)
+            ask = max(round_to_tick(self.price + half_spread, self.tick_size), bid + self.tick_size)
+            yield self.interval, ('quote', bid, self.random.randint(*self.quote_size),
+                                  ask, self.random.randint(*self.quote_size))
+            if self.random.random() < self.trade_probability:
+                side = self.random.choice(('Buy', 'Sell'))
+                yield 0, ('trade', side, self.random.randint(*self.trade_size))
+
+
+class JournalFeed(object):
+    """Replays the quote and trade rows of a captured journal, keeping the original
+       spacing divided by `speed` (0 replays as fast as possible)."""
+
+    def __init__(self, path, symbol, speed=1.0):
+        self.path = path
+        self.symbol = symbol
+        self.speed = speed
+
+    def __iter__(self):
+        previous = None
+        for received_at, raw in read_journal(self.path):
+            message = json.loads(raw)
+            table = message.get('table')
+            if table not in ('quote', 'trade') or message.get('action') not in ('partial', 'insert'):
+                continue
+            rows = [row for row in message['data'] if row.get('symbol') == self.symbol]
+            if not rows:
+                continue
+            delay = 0 if previous is None or not self.speed else max(received_at - previous, 0) / self.speed
+            previous = received_at
+            for row in rows:
+                if table == 'quote':
+                    if row.get('bidPrice') is None or row.get('askPrice') is None:
+                        continue
+                    event = ('quote', row['bidPrice'], row['bidSize'], row['askPrice'], row['askSize'])
+                else:
+                    event = ('trade', row['side'], row['size'])
+                yield delay, event
+                delay = 0
@@ -0,0 +1,208 @@
+"""
+Price-time priority matching engine for one symbol, working on BitMEX shaped
+order rows. Orders rest in FIFO queues per price level; an incoming or amended
+order trades against the best opposite levels first, oldest order first, at
+the resting order's price.
+"""
+
+import bisect
+import itertools
+import uuid
+from collections import deque
+
+POST_ONLY = 'ParticipateDoNotInitiate'
+
+
+class EngineError(Exception):
+    """A request the exchange rejects. Maps to an HTTP 400 with this message."""
+    pass
+
+
+class Fill(object):
+    def __init__(self, order, qty, price, is_maker):
+        self.order = order
+        self.qty = qty
+        self.price = price
+        self.is_maker = is_maker
+
+
+class BookSide(object):
+    def __init__(self, is_bid):
+        self.is_bid = is_bid
+        # Ascending; the best bid is the last price, the best ask the first
+        self.prices = []
+        self.levels = {}
+
+    def best_price(self):
+        if not self.prices:
+            return None
+        return self.prices[-1] if self.is_bid else self.prices[0]
+
+    def add(self, order):
+        price = order['price']
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = deque()
+            bisect.insort(self.prices, price)
+        level.append(order)
+
+    def remove(self, order):
+        price = order['price']
+        level = self.levels[price]
+        level.remove(order)
+        if not level:
+            self._drop_level(price)
+
+    def pop_front(self, price):
+        level = self.levels[price]
+        order = level.popleft()
+        if not level:
+            self._drop_level(price)
+        return order
+
+    def front(self, price):
+        return self.levels[price][0]
+
+    def depth(self, count):
+        """Aggregated (price, size) of the best `count` levels, best first."""
+        prices = reversed(self.prices) if self.is_bid else iter(self.prices)
+        return [(price, sum(o['leavesQty'] for o in self.levels[price]))
+                for price in itertools.islice(prices, count)]
+
+    def _drop_level(self, price):
+        del self.levels[price]
+        del self.prices[bisect.bisect_left(self.prices, price)]
+
+
+class MatchingEngine(object):
+    """Order book of one symbol. Every call returns the list of Fills it caused, taker and
+       maker side of each trade; the caller turns order changes and fills into table updates."""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+        self.orders = {}
+        # IDs of the terminated orders forget_terminated() dropped, so amending them
+        # still fails on their status like on BitMEX
+        self.forgotten = set()
+
+    def best_bid(self):
+        return self.bids.best_price()
+
+    def best_ask(self):
+        return self.asks.best_price()
+
+    def submit(self, order):
+        """Match a new limit order and rest the remainder. The row is completed in place."""
+        order.setdefault('orderID', str(uuid.uuid4()))
+        order['leavesQty'] = order['orderQty']
+        order['cumQty'] = 0
+        order['avgPx'] = None
+        order['ordStatus'] = 'New'
+        self.orders[order['orderID']] = order
+        if POST_ONLY in (order.get('execInst') or '') and self._crosses(order):
+            self._terminate(order, 'Canceled: Order had execInst of ParticipateDoNotInitiate')
+            return []
+        fills = self._match(order)
+        if order['leavesQty'] > 0:
+            self._side(order).add(order)
+        return fills
+
+    def amend(self, orderID, orderQty=None, price=None):
+        """Change the total quantity and/or price of a resting order.
+           Lowering the quantity keeps the queue position; anything else sends it to the back."""
+        order = self.orders.get(orderID)
+        if order is None:
+            raise EngineError('Invalid ordStatus' if orderID in self.forgotten else 'Invalid orderID')
+        if order['ordStatus'] not in ('New', 'PartiallyFilled'):
+            raise EngineError('Invalid ordStatus')
+        new_qty = order['orderQty'] if orderQty is None else orderQty
+        new_price = order['price'] if price is None else price
+        side = self._side(order)
+        if new_qty - order['cumQty'] <= 0:
+            side.remove(order)
+            if order['cumQty'] > 0:
+                # Nothing left to fill: the order is done at what it already traded
+                order['orderQty'] = order['cumQty']
+                order['leavesQty'] = 0
+                order['ordStatus'] = 'Filled'
+            else:
+                order['orderQty'] = new_qty
+                self._terminate(order, 'Canceled: Amended orderQty below cumQty')
+            return []
+        if new_price == order['price'] and new_qty <= order['orderQty']:
+            order['orderQty'] = new_qty
+            order['leavesQty'] = new_qty - order['cumQty']
+            return []
+
+        side.remove(order)
+        order['orderQty'] = new_qty
+        order['leavesQty'] = new_qty - order['cumQty']
+        order['price'] = new_price
+        if POST_ONLY in (order.get('execInst') or '') and self._crosses(order):
+            self._terminate(order, 'Canceled: Order had execInst of ParticipateDoNotInitiate')
+            return []
+        fills = self._match(order)
+        if order['leavesQty'] > 0:
+            side.add(order)
+        return fills
+
+    def cancel(self, orderID, text='Canceled: Canceled via API.'):
+        order = self.orders.get(orderID)
+        if order is None or order['ordStatus'] not in ('New', 'PartiallyFilled'):
+            return None
+        self._side(order).remove(order)
+        self._terminate(order, text)
+        return order
+
+    def open_orders(self):
+        return [o for o in self.orders.values() if o['ordStatus'] in ('New', 'PartiallyFilled')]
+
+    def forget_terminated(self, keep):
+        """Drop all but the last `keep` terminated orders. Only their IDs are kept."""
+        terminated = [k for k, o in self.orders.items() if o['ordStatus'] in ('Filled', 'Canceled')]
+        for orderID in terminated[:max(len(terminated) - keep, 0)]:
+            del self.orders[orderID]
+            self.forgotten.add(orderID)
+
+    def depth(self, count):
+        return self.bids.depth(count), self.asks.depth(count)
+
+    def _side(self, order):
+        return self.bids if order['side'] == 'Buy' else self.asks
+
+    def _opposite(self, order):
+        return self.asks if order['side'] == 'Buy' else self.bids
+
+    def _crosses(self, order):
+        best = self._opposite(order).best_price()
+        if best is None:
+            return False
+        return order['price'] >= best if order['side'] == 'Buy' else order['price'] <= best
+
+    def _match(self, taker):
+        fills = []
+        opposite = self._opposite(taker)
+        while taker['leavesQty'] > 0 and self._crosses(taker):
+            price = opposite.best_price()
+            maker = opposite.front(price)
+            qty = min(taker['leavesQty'], maker['leavesQty'])
+            for order, is_maker in ((maker, True), (taker, False)):
+                self._fill(order, qty, price)
+                fills.append(Fill(order, qty, price, is_maker))
+            if maker['leavesQty'] == 0:
+                opposite.pop_front(price)
+        return fills
+
+    def _fill(self, order, qty, price):
+        cost = (order['avgPx'] or 0) * order['cumQty'] + price * qty
+        order['cumQty'] += qty
+        order['leavesQty'] -= qty
+        order['avgPx'] = cost / order['cumQty']
+        order['ordStatus'] = 'Filled' if order['leavesQty'] == 0 else 'PartiallyFilled'
+
+    def _terminate(self, order, text):
+        order['leavesQty'] = 0
+        order['ordStatus'] = 'Canceled'
+        order['text'] = text
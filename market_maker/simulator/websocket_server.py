@@ -0,0 +1,129 @@
+"""
+Minimal server side of the websocket protocol (RFC 6455) on top of an
+http.server request handler: the upgrade handshake, and unfragmented text,
+ping/pong and close frames. Enough for the BitMEX /realtime stand-in.
+"""
+
+import base64
+import hashlib
+import struct
+import threading
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+def is_upgrade_request(headers):
+    return (headers.get('Upgrade', '').lower() == 'websocket' and
+            'upgrade' in headers.get('Connection', '').lower() and
+            headers.get('Sec-WebSocket-Key') is not None)
+
+
+def get_accept_key(key):
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def encode_frame(payload, opcode=OPCODE_TEXT):
+    """Encode a final, unmasked frame. Servers never mask."""
+    if isinstance(payload, str):
+        payload = payload.encode('utf8')
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _read_exactly(rfile, count):
+    data = rfile.read(count)
+    if data is None or len(data) < count:
+        raise EOFError("Websocket connection closed")
+    return data
+
+
+def read_frame(rfile):
+    """Read one frame from the client. Returns (fin, opcode, payload)."""
+    first, second = struct.unpack('!BB', _read_exactly(rfile, 2))
+    fin = bool(first & 0x80)
+    opcode = first & 0x0F
+    masked = bool(second & 0x80)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', _read_exactly(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', _read_exactly(rfile, 8))[0]
+    mask = _read_exactly(rfile, 4) if masked else None
+    payload = _read_exactly(rfile, length)
+    if mask is not None:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return fin, opcode, payload
+
+
+class WebsocketConnection(object):
+    """A websocket accepted on an http.server request handler.
+
+    send() may be called from any thread. receive() is meant for the handler
+    thread; it answers pings and returns the next text message, or None once
+    the client closed the connection.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def accept(self):
+        key = self.handler.headers['Sec-WebSocket-Key']
+        self.handler.send_response(101, 'Switching Protocols')
+        self.handler.send_header('Upgrade', 'websocket')
+        self.handler.send_header('Connection', 'Upgrade')
+        self.handler.send_header('Sec-WebSocket-Accept', get_accept_key(key))
+        self.handler.end_headers()
+        self.handler.wfile.flush()
+
+    def send(self, message, opcode=OPCODE_TEXT):
+        frame = encode_frame(message, opcode)
+        with self._send_lock:
+            if self.closed:
+                return False
+            try:
+                self.handler.wfile.write(frame)
+                self.handler.wfile.flush()
+                return True
+            except (OSError, ValueError):
+                self.closed = True
+                return False
+
+    def receive(self):
+        fragments = []
+        while not self.closed:
+            try:
+                fin, opcode, payload = read_frame(self.handler.rfile)
+            except (EOFError, OSError, ValueError):
+                self.closed = True
+                break
+            if opcode == OPCODE_PING:
+                self.send(payload, OPCODE_PONG)
+            elif opcode == OPCODE_CLOSE:
+                self.send(payload[:2], OPCODE_CLOSE)
+                self.closed = True
+            elif opcode in (OPCODE_TEXT, OPCODE_BINARY, OPCODE_CONTINUATION):
+                fragments.append(payload)
+                if fin:
+                    return b''.join(fragments).decode('utf8')
+        return None
+
+    def close(self):
+        self.send(struct.pack('!H', 1000), OPCODE_CLOSE)
+        with self._send_lock:
+            self.closed = True
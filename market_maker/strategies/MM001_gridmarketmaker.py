@@ -1,5 +1,4 @@
 
-from time import sleep
 import sys
 import requests
 from datetime import datetime
@@ -11,6 +10,8 @@ from market_maker.utils.log import log_debug
 from market_maker.utils.log import log_info
 from market_maker.utils.log import log_error
 from common.exception import *
+from market_maker.strategies.order_matcher import match_orders
+from market_maker.utils.retry import RetriesExhaustedError
 import numpy as np
 
 
@@ -165,51 +166,39 @@ class MM001_GridMarketMakerStrategy(GenericStrategy):
     def converge_orders(self, buy_orders, sell_orders):
         """Converge the orders we currently have in the book with what we want to be in the book.
            This involves amending any open orders and creating new ones if any have filled completely.
-           We start from the closest orders outward."""
+           Existing orders are paired with desired ones by price, so a shifted grid only moves the
+           orders that have to move."""
 
         tickLog = self.exchange.get_instrument()['tickLog']
         to_amend = []
         to_create = []
-        to_cancel = []
-        buys_matched = 0
-        sells_matched = 0
         existing_orders = self.exchange.get_orders()
         quoting_side = settings.QUOTING_SIDE
 
-        # Check all existing orders and match them up with what we want to place.
+        def needs_amend(order, desired_order):
+            return desired_order['orderQty'] != order['leavesQty'] or (
+                # If price has changed, and the change is more than our RELIST_INTERVAL, amend.
+                desired_order['price'] != order['price'] and
+                abs((desired_order['price'] / order['price']) - 1) > settings.RELIST_INTERVAL)
+
+        # Match all existing orders up with what we want to place.
         # If there's an open one, we might be able to amend it to fit what we want.
-        for order in existing_orders:
-            try:
-                if order['side'] == 'Buy':
-                    desired_order = buy_orders[buys_matched]
-                    buys_matched += 1
-                else:
-                    desired_order = sell_orders[sells_matched]
-                    sells_matched += 1
-
-                # Found an existing order. Do we need to amend it?
-                if desired_order['orderQty'] != order['leavesQty'] or (
-                        # If price has changed, and the change is more than our RELIST_INTERVAL, amend.
-                        desired_order['price'] != order['price'] and
-                        abs((desired_order['price'] / order['price']) - 1) > settings.RELIST_INTERVAL):
-                    if self.is_order_placement_allowed(desired_order, quoting_side) is True:
-                        to_amend.append({'orderID': order['orderID'], 'orderQty': order['cumQty'] + desired_order['orderQty'],
-                                        'price': desired_order['price'], 'side': order['side']})
-            except IndexError:
-                # Will throw if there isn't a desired order to match. In that case, cancel it.
-                to_cancel.append(order)
-
-        while buys_matched < len(buy_orders):
-            buy_order = buy_orders[buys_matched]
-            if self.is_order_placement_allowed(buy_order, quoting_side):
-                to_create.append(buy_order)
-            buys_matched += 1
-
-        while sells_matched < len(sell_orders):
-            sell_order = sell_orders[sells_matched]
-            if self.is_order_placement_allowed(sell_order, quoting_side):
-                to_create.append(sell_order)
-            sells_matched += 1
+        match = match_orders(existing_orders, buy_orders, sell_orders, needs_amend)
+        for order, desired_order in match.to_amend:
+            if self.is_order_placement_allowed(desired_order, quoting_side) is True:
+                to_amend.append({'orderID': order['orderID'], 'orderQty': order['cumQty'] + desired_order['orderQty'],
+                                 'price': desired_order['price'], 'side': order['side']})
+
+        for desired_order in match.to_create:
+            if self.is_order_placement_allowed(desired_order, quoting_side):
+                to_create.append(desired_order)
+
+        # Existing orders without a desired order to match are cancelled
+        to_cancel = match.to_cancel
+
+        if match.saved_actions > 0:
+            self.logger.info("Order matching saved %d of %d actions (%d amends, %d creates, %d cancels)" % (
+                match.saved_actions, match.positional_actions, len(match.to_amend), len(match.to_create), len(to_cancel)))
 
         if len(to_amend) > 0:
             combined_msg = ""
@@ -222,22 +211,6 @@ class MM001_GridMarketMakerStrategy(GenericStrategy):
                 )
             log_info(self.logger, combined_msg, False)
 
-            # This can fail if an order has closed in the time we were processing.
-            # The API will send us `invalid ordStatus`, which means that the order's status (Filled/Canceled)
-            # made it not amendable.
-            # If that happens, we need to catch it and re-tick.
-            try:
-                self.exchange.amend_bulk_orders(to_amend)
-            except requests.exceptions.HTTPError as e:
-                errorObj = e.response.json()
-                if errorObj['error']['message'] == 'Invalid ordStatus':
-                    self.logger.warn("Amending failed. Waiting for order data to converge and retrying.")
-                    sleep(0.5)
-                    return self.place_orders()
-                else:
-                    log_error(self.logger, "Unknown error on amend: %s. Restarting" % errorObj, True)
-                    raise ForceRestartException("NerdSupervisor will be restarted")
-
         if len(to_create) > 0:
             combined_msg = "Creating %d orders:\n" % (len(to_create))
             for order in reversed(to_create):
@@ -246,15 +219,33 @@ class MM001_GridMarketMakerStrategy(GenericStrategy):
 
             self.print_status(True)
 
-            self.exchange.create_bulk_orders(to_create)
-
         # Could happen if we exceed a delta limit
         if len(to_cancel) > 0:
             combined_msg = "Cancelling %d orders:\n" % (len(to_cancel))
             for order in reversed(to_cancel):
                 combined_msg += "%4s %d @ %.*f\n" % (order['side'], order['leavesQty'], tickLog, order['price'])
             log_info(self.logger, combined_msg, False)
-            self.exchange.cancel_bulk_orders(to_cancel)
+
+        # The three batches go out concurrently; cancels and amends first where a create would cross them.
+        # Their responses update our order table right away, so the next tick doesn't act on stale orders.
+        # The amend can fail if an order has closed in the time we were processing.
+        # The API will send us `invalid ordStatus`, which means that the order's status (Filled/Canceled)
+        # made it not amendable.
+        # If that happens, we fetch our open orders and re-tick against them.
+        try:
+            self.exchange.dispatch_order_actions(to_amend, to_create, to_cancel, existing_orders)
+        except requests.exceptions.HTTPError as e:
+            errorObj = e.response.json()
+            if errorObj['error']['message'] == 'Invalid ordStatus':
+                self.logger.warn("Amending failed. Reconciling our orders with the exchange before the next tick.")
+                try:
+                    self.exchange.reconcile_orders()
+                except RetriesExhaustedError as e:
+                    # Don't restart over it: the next failed amend asks for another reconcile
+                    self.logger.warning("Unable to reconcile our orders, leaving it to the next tick: %s" % e)
+            else:
+                log_error(self.logger, "Unknown error on amend: %s. Restarting" % errorObj, True)
+                raise ForceRestartException("NerdSupervisor will be restarted")
 
     def get_ticker(self):
         instrument = self.exchange.get_instrument()
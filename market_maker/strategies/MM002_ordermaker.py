@@ -218,9 +218,8 @@ class MM002_OrderMakerStrategy(GenericStrategy):
         is_orders_valid = self.validate_orders(existing_orders, instrument, running_qty, avgEntryPrice, ticker_last_price, quoting_side)
 
         if not is_orders_valid:
-            if len(to_cancel) > 0:
-                self.exchange.cancel_bulk_orders(to_cancel)
-            self.exchange.create_bulk_orders(to_create)
+            # Replaces all orders. The cancel goes first: it may free the margin the new orders need.
+            self.exchange.dispatch_order_actions([], to_create, to_cancel, existing_orders, sequential=True)
             self.print_status(True)
 
     ###
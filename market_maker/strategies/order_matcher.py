@@ -0,0 +1,106 @@
+"""Pairs existing and desired orders per side with the fewest amend/create/cancel actions."""
+
+
+class OrderMatch(object):
+    def __init__(self):
+        # (existing, desired) pairs that need an amend
+        self.to_amend = []
+        # (existing, desired) pairs that already fit and are left alone
+        self.kept = []
+        self.to_create = []
+        self.to_cancel = []
+        # Actions pairing by list position would have taken
+        self.positional_actions = 0
+
+    @property
+    def actions(self):
+        return len(self.to_amend) + len(self.to_create) + len(self.to_cancel)
+
+    @property
+    def saved_actions(self):
+        return self.positional_actions - self.actions
+
+
+def match_orders(existing_orders, buy_orders, sell_orders, needs_amend):
+    """Match existing orders with the desired buy and sell orders.
+
+       needs_amend(existing, desired) tells whether an existing order has to be amended to
+       become the desired one. Pairing is never worse than a cancel plus a create, so per side
+       min(existing, desired) pairs are made: first as many pairs as possible that need no
+       amend, then the remaining orders are paired by price proximity. Whatever is left over
+       is cancelled or created."""
+    match = OrderMatch()
+    for side, desired_orders in (('Buy', buy_orders), ('Sell', sell_orders)):
+        existing = [o for o in existing_orders if o['side'] == side]
+        match.positional_actions += _count_positional_actions(existing, desired_orders, needs_amend)
+        _match_side(match, existing, desired_orders, needs_amend)
+    return match
+
+
+def _count_positional_actions(existing, desired, needs_amend):
+    pairs = min(len(existing), len(desired))
+    amends = sum(1 for i in range(pairs) if needs_amend(existing[i], desired[i]))
+    return amends + abs(len(existing) - len(desired))
+
+
+def _match_side(match, existing, desired, needs_amend):
+    # Maximum matching over the pairs that need no amend (augmenting paths; a side has a few dozen orders at most)
+    fits = [[j for j, d in enumerate(desired) if not needs_amend(e, d)] for e in existing]
+    desired_owner = [None] * len(desired)
+
+    def augment(i, visited):
+        for j in fits[i]:
+            if j in visited:
+                continue
+            visited.add(j)
+            if desired_owner[j] is None or augment(desired_owner[j], visited):
+                desired_owner[j] = i
+                return True
+        return False
+
+    for i in range(len(existing)):
+        augment(i, set())
+
+    kept_existing = set()
+    for j, i in enumerate(desired_owner):
+        if i is not None:
+            match.kept.append((existing[i], desired[j]))
+            kept_existing.add(i)
+
+    free_existing = sorted((e for i, e in enumerate(existing) if i not in kept_existing), key=lambda o: o['price'])
+    free_desired = sorted((d for j, d in enumerate(desired) if desired_owner[j] is None), key=lambda o: o['price'])
+    if len(free_existing) <= len(free_desired):
+        pairs, unpaired = _pair_by_proximity(free_existing, free_desired)
+        match.to_amend += pairs
+        match.to_create += unpaired
+    else:
+        pairs, unpaired = _pair_by_proximity(free_desired, free_existing)
+        match.to_amend += [(e, d) for d, e in pairs]
+        match.to_cancel += unpaired
+
+
+def _pair_by_proximity(fewer, more):
+    """Pair every order of `fewer` with one of `more`, both sorted by price, keeping the price order
+       and minimizing the total price distance. Returns the pairs and the unpaired orders of `more`."""
+    n, m = len(fewer), len(more)
+    inf = float('inf')
+    # cost[i][j]: best total distance pairing the first i of `fewer` within the first j of `more`
+    cost = [[0.0] * (m + 1)] + [[inf] * (m + 1) for _ in range(n)]
+    for i in range(1, n + 1):
+        for j in range(i, m + 1):
+            paired = cost[i - 1][j - 1] + abs(fewer[i - 1]['price'] - more[j - 1]['price'])
+            cost[i][j] = min(cost[i][j - 1], paired)
+
+    pairs = []
+    paired_more = set()
+    i, j = n, m
+    while i > 0:
+        if j > i and cost[i][j] == cost[i][j - 1]:
+            j -= 1
+            continue
+        pairs.append((fewer[i - 1], more[j - 1]))
+        paired_more.add(j - 1)
+        i -= 1
+        j -= 1
+    pairs.reverse()
+    return pairs, [o for k, o in enumerate(more) if k not in paired_more]
@@ -0,0 +1,118 @@
+"""Client-side token bucket for the BitMEX REST rate limit."""
+import threading
+import time
+
+# Request priorities, highest first. Cancels take us out of the market, so they
+# may use the whole bucket; creates and amends leave some tokens for them.
+PRIORITY_CANCEL = 0
+PRIORITY_CREATE = 1
+PRIORITY_AMEND = 2
+
+VERB_PRIORITIES = {
+    'DELETE': PRIORITY_CANCEL,
+    'POST': PRIORITY_CREATE,
+    'GET': PRIORITY_CREATE,
+    'PUT': PRIORITY_AMEND
+}
+
+# Fraction of the limit that must stay in the bucket after a request of each priority
+RESERVE_FRACTIONS = {
+    PRIORITY_CANCEL: 0.0,
+    PRIORITY_CREATE: 0.1,
+    PRIORITY_AMEND: 0.25
+}
+
+# BitMEX default: 60 requests per minute, refilled continuously.
+# The actual limit is read from the response headers.
+DEFAULT_LIMIT = 60
+DEFAULT_PERIOD = 60
+
+
+class RateLimiter(object):
+    """Token bucket mirroring the server side BitMEX rate limit.
+
+    Every request takes a token in acquire() before it is sent and reports the
+    X-RateLimit-* response headers in release(), which resync the bucket with the
+    server's count. A request waits while the bucket would drop below the reserve
+    of its priority, or while a higher priority request is waiting.
+    """
+
+    def __init__(self, limit=DEFAULT_LIMIT, period=DEFAULT_PERIOD):
+        self.limit = limit
+        self.period = period
+        self.tokens = float(limit)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._updated = time.time()
+        self._waiting = [0] * len(RESERVE_FRACTIONS)
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def priority_for_verb(verb):
+        return VERB_PRIORITIES.get(verb, PRIORITY_CREATE)
+
+    def acquire(self, priority):
+        """Take a token, waiting as long as needed. Returns the time waited in seconds."""
+        started = time.time()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    self._refill(now)
+                    wait = self._get_wait_time(priority, now)
+                    if wait is None:
+                        break
+                    self._condition.wait(wait)
+                self.tokens -= 1
+                self.in_flight += 1
+            finally:
+                self._waiting[priority] -= 1
+                # Lower priority requests may have been waiting on this one
+                self._condition.notify_all()
+        return time.time() - started
+
+    def release(self, headers=None):
+        """Report the end of a request, with its response headers if there was a response."""
+        with self._condition:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if headers is not None and 'X-RateLimit-Remaining' in headers:
+                self._refill(time.time())
+                if 'X-RateLimit-Limit' in headers:
+                    self.limit = int(headers['X-RateLimit-Limit'])
+                # Requests still in flight may not be counted by the server yet
+                self.tokens = max(float(int(headers['X-RateLimit-Remaining']) - self.in_flight), 0.0)
+            self._condition.notify_all()
+
+    def on_rate_limited(self, reset):
+        """The server rejected a request with 429: hold everything until the reset epoch."""
+        with self._condition:
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, float(reset))
+
+    def get_stats(self):
+        with self._condition:
+            self._refill(time.time())
+            return {
+                'limit': self.limit,
+                'tokens': self.tokens,
+                'inFlight': self.in_flight,
+                'blockedUntil': self.blocked_until,
+                'waiting': list(self._waiting)
+            }
+
+    def _refill(self, now):
+        self.tokens = min(float(self.limit), self.tokens + (now - self._updated) * self.limit / self.period)
+        self._updated = now
+
+    def _get_wait_time(self, priority, now):
+        """None if a request of this priority can go now, otherwise how long to wait before checking again."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if any(self._waiting[higher] for higher in range(priority)):
+            # Woken up by notify_all once they get their token
+            return self.period / self.limit
+        missing = 1 + self.limit * RESERVE_FRACTIONS[priority] - self.tokens
+        if missing <= 0:
+            return None
+        return missing * self.period / self.limit
@@ -1,5 +1,23 @@
+import calendar
+import time
+from functools import lru_cache
 from market_maker.utils.bitmex import constants
 
 
 def XBt_to_XBT(XBt):
     return float(XBt) / constants.XBt_TO_XBT
+
+
+@lru_cache(maxsize=128)
+def _iso_seconds_to_epoch(iso_seconds):
+    return calendar.timegm(time.strptime(iso_seconds, "%Y-%m-%dT%H:%M:%S"))
+
+
+def timestamp_to_epoch(timestamp):
+    """Convert a BitMEX ISO timestamp ('2020-01-01T00:00:00.123Z') to epoch seconds.
+       The whole-second part is cached since bursts of rows share it."""
+    if not timestamp:
+        return None
+    seconds = _iso_seconds_to_epoch(timestamp[:19])
+    fraction = timestamp[19:].rstrip('Z')
+    return seconds + float(fraction) if fraction else float(seconds)
@@ -0,0 +1,51 @@
+"""Heartbeat keeping an exchange-side dead man's switch armed."""
+import threading
+
+from market_maker.utils.log import log_error, log_info
+
+
+class DeadMansSwitch(object):
+    """Every `interval` seconds calls arm(timeout), asking the exchange to cancel all our orders
+       `timeout` seconds from now. While the robot runs each heartbeat pushes that moment back;
+       if the process dies or loses connectivity the heartbeats stop and the exchange cancels
+       the orders we left behind. stop() disarms it with arm(0)."""
+
+    def __init__(self, arm, timeout, logger, interval=None):
+        self.arm = arm
+        self.timeout = timeout
+        # Several heartbeats fit in one timeout, so a single failed one doesn't trigger it
+        self.interval = interval if interval is not None else timeout / 4.0
+        self.logger = logger
+        self.stopped = threading.Event()
+        self.thread = None
+        self.failures = 0
+
+    def start(self):
+        self.beat()
+        self.thread = threading.Thread(target=self.__run, name='dead-mans-switch')
+        self.thread.daemon = True
+        self.thread.start()
+        log_info(self.logger, "Dead man's switch armed: orders are cancelled {} seconds after the last heartbeat.".format(self.timeout), False)
+
+    def stop(self, disarm=True):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if disarm:
+            try:
+                self.arm(0)
+            except Exception as e:
+                log_error(self.logger, "Unable to disarm the dead man's switch: {}".format(e), False)
+
+    def beat(self):
+        try:
+            self.arm(self.timeout)
+            self.failures = 0
+        except Exception as e:
+            self.failures += 1
+            log_error(self.logger, "Dead man's switch heartbeat failed ({} in a row): {}".format(self.failures, e),
+                      self.failures * self.interval >= self.timeout / 2.0)
+
+    def __run(self):
+        while not self.stopped.wait(self.interval):
+            self.beat()
@@ -0,0 +1,110 @@
+import json
+import time
+
+# orjson is an optional dependency: when it is installed it is used for the hot websocket paths
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RawFloat(float):
+    """A float that keeps the exact text it was parsed from in .raw"""
+    __slots__ = ('raw',)
+
+    def __new__(cls, raw):
+        value = float.__new__(cls, raw)
+        value.raw = raw
+        return value
+
+
+def raw_number_type(parse_float):
+    """Subclass of the parse_float type whose values keep their source text in .raw"""
+    if parse_float in (None, float):
+        return RawFloat
+
+    def __new__(cls, raw):
+        value = parse_float.__new__(cls, raw)
+        value.raw = raw
+        return value
+
+    return type('Raw' + parse_float.__name__, (parse_float,), {'__slots__': ('raw',), '__new__': __new__})
+
+
+class ParseStats(object):
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'totalTime': self.total_time,
+            'avgTime': self.total_time / self.count if self.count else 0,
+            'maxTime': self.max_time
+        }
+
+
+class JsonDecoder(object):
+    """Decodes websocket frames with the fastest available JSON backend and times every call.
+
+       A custom parse_float (e.g. Decimal) is only supported by the stdlib decoder, so it
+       forces the fallback. The time of the last parse can be charged to a table/channel
+       with attribute() once the caller knows what the message was.
+
+       loads_raw() decodes in one pass with floats that also keep their exact text, for
+       messages which need both (e.g. order book checksums). It always uses the stdlib
+       decoder, and parse_float must then be a type such as float or Decimal."""
+
+    def __init__(self, parse_float=None):
+        if orjson is not None and parse_float in (None, float):
+            self.backend = 'orjson'
+            self._loads = orjson.loads
+        elif parse_float in (None, float):
+            self.backend = 'json'
+            self._loads = json.loads
+        else:
+            self.backend = 'json'
+            self._loads = lambda raw: json.loads(raw, parse_float=parse_float)
+        self._raw_decoder = None
+        self._parse_float = parse_float
+        self.last_parse_time = 0.0
+        self.total = ParseStats()
+        self.by_key = {}
+
+    def loads(self, raw):
+        started = time.perf_counter()
+        result = self._loads(raw)
+        self.last_parse_time = time.perf_counter() - started
+        self.total.add(self.last_parse_time)
+        return result
+
+    def loads_raw(self, raw):
+        if self._raw_decoder is None:
+            self._raw_decoder = json.JSONDecoder(parse_float=raw_number_type(self._parse_float))
+        started = time.perf_counter()
+        result = self._raw_decoder.decode(raw)
+        self.last_parse_time = time.perf_counter() - started
+        self.total.add(self.last_parse_time)
+        return result
+
+    def attribute(self, key):
+        """Charge the last parse time to a table or channel."""
+        stats = self.by_key.get(key)
+        if stats is None:
+            stats = self.by_key[key] = ParseStats()
+        stats.add(self.last_parse_time)
+
+    def get_stats(self):
+        return {
+            'backend': self.backend,
+            'total': self.total.to_dict(),
+            'byKey': {key: stats.to_dict() for key, stats in self.by_key.items()}
+        }
@@ -0,0 +1,131 @@
+import math
+import time
+
+
+class Histogram(object):
+    """Log-scale histogram of durations in seconds.
+
+       Values are counted in BUCKETS_PER_OCTAVE buckets per power of two between MIN_VALUE
+       and MAX_VALUE, so percentiles are accurate to within ~9% at a fixed memory cost.
+       Values outside the range land in the first/last bucket; min and max stay exact."""
+
+    BUCKETS_PER_OCTAVE = 8
+    MIN_VALUE = 1e-6
+    MAX_VALUE = 1e3
+
+    def __init__(self):
+        octaves = math.log2(Histogram.MAX_VALUE / Histogram.MIN_VALUE)
+        self.buckets = [0] * (int(math.ceil(octaves * Histogram.BUCKETS_PER_OCTAVE)) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value <= Histogram.MIN_VALUE:
+            index = 0
+        else:
+            index = int(math.log2(value / Histogram.MIN_VALUE) * Histogram.BUCKETS_PER_OCTAVE) + 1
+            if index >= len(self.buckets):
+                index = len(self.buckets) - 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, clamped to the observed range."""
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                bound = Histogram.MIN_VALUE * 2 ** (index / Histogram.BUCKETS_PER_OCTAVE)
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9)
+        }
+
+
+class RateMeter(object):
+    """Event counter with the rate over the last `window` seconds, kept in one-second slots."""
+
+    def __init__(self, window=10):
+        self.window = window
+        self.count = 0
+        self._slots = [0] * window
+        self._slot_seconds = [None] * window
+
+    def add(self, now):
+        second = int(now)
+        index = second % self.window
+        if self._slot_seconds[index] != second:
+            self._slot_seconds[index] = second
+            self._slots[index] = 0
+        self._slots[index] += 1
+        self.count += 1
+
+    def rate(self, now=None):
+        second = int(time.time() if now is None else now)
+        recent = sum(count for count, slot_second in zip(self._slots, self._slot_seconds)
+                     if slot_second is not None and second - self.window < slot_second <= second)
+        return recent / float(self.window)
+
+
+class ChannelStats(object):
+    def __init__(self, window):
+        self.messages = RateMeter(window)
+        self.handler_time = Histogram()
+        self.lag = Histogram()
+
+    def to_dict(self, now):
+        return {
+            'messages': self.messages.count,
+            'messagesPerSecond': self.messages.rate(now),
+            'handlerTime': self.handler_time.to_dict(),
+            'lag': self.lag.to_dict()
+        }
+
+
+class LatencyStats(object):
+    """Per table/channel websocket statistics: message rate, handler time and the lag between
+       the exchange timestamp of a message and its local receive time.
+
+       Written by the websocket thread only; get_stats() may be called from any thread and
+       returns plain dicts. Lag includes the clock offset to the exchange, so it is the
+       trend and the spread that matter rather than the absolute value."""
+
+    def __init__(self, window=10):
+        self.window = window
+        self.channels = {}
+
+    def record(self, key, received_at, handler_time, exchange_time=None):
+        stats = self.channels.get(key)
+        if stats is None:
+            stats = self.channels[key] = ChannelStats(self.window)
+        stats.messages.add(received_at)
+        stats.handler_time.add(handler_time)
+        if exchange_time is not None:
+            stats.lag.add(received_at - exchange_time)
+
+    def get_stats(self):
+        now = time.time()
+        return {key: stats.to_dict(now) for key, stats in list(self.channels.items())}
+
+    def reset(self):
+        self.channels = {}
@@ -0,0 +1,106 @@
+"""Per-endpoint REST request statistics, shared by the exchange clients."""
+import threading
+import time
+import requests
+from market_maker.utils.latency_stats import Histogram
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        # HTTP status (or 'timeout' / 'connection') -> count, for everything but 2xx
+        self.errors = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = Histogram()
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': dict(self.errors),
+            'bytesSent': self.bytes_sent,
+            'bytesReceived': self.bytes_received,
+            'latency': self.latency.to_dict()
+        }
+
+
+class RestStats(object):
+    """Latency histograms, error and retry counts and bytes transferred per 'VERB path', plus the
+       rate limit headroom last reported by the exchange. record*() may be called from any
+       thread; get_stats() returns plain dicts."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.rate_limit = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, verb, path, status, elapsed, bytes_sent=0, bytes_received=0, headers=None):
+        """Record one request attempt. status is the HTTP status code, or a string such as
+           'timeout' when no response came back."""
+        with self._lock:
+            stats = self._get(verb, path)
+            stats.requests += 1
+            stats.latency.add(elapsed)
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            if not (isinstance(status, int) and 200 <= status < 300):
+                stats.errors[status] = stats.errors.get(status, 0) + 1
+            if headers is not None and 'X-RateLimit-Remaining' in headers:
+                self.rate_limit = {
+                    'limit': int(headers.get('X-RateLimit-Limit', 0)),
+                    'remaining': int(headers['X-RateLimit-Remaining']),
+                    'reset': int(headers.get('X-RateLimit-Reset', 0)),
+                    'timestamp': time.time()
+                }
+
+    def record_retry(self, verb, path):
+        with self._lock:
+            self._get(verb, path).retries += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'since': self.started,
+                'endpoints': {key: stats.to_dict() for key, stats in self.endpoints.items()},
+                'rateLimit': dict(self.rate_limit)
+            }
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.started = time.time()
+
+    def _get(self, verb, path):
+        key = "%s %s" % (verb, path)
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints[key] = EndpointStats()
+        return stats
+
+
+def send_and_record(stats, sender, verb, path, url, **kwargs):
+    """Send a request with sender.request() (the requests module or a Session) and record
+       it in stats under 'verb path'. Returns the response; exceptions propagate."""
+    response = None
+    status = 'error'
+    started = time.time()
+    try:
+        response = sender.request(verb, url, **kwargs)
+        status = response.status_code
+        return response
+    except requests.exceptions.Timeout:
+        status = 'timeout'
+        raise
+    except requests.exceptions.ConnectionError:
+        status = 'connection'
+        raise
+    finally:
+        elapsed = time.time() - started
+        if response is not None:
+            stats.record(verb, path, status, elapsed, len(response.request.body or ''), len(response.content),
+                         response.headers)
+        else:
+            stats.record(verb, path, status, elapsed)
@@ -0,0 +1,85 @@
+"""Retry loop with jittered exponential backoff, attempt limits and deadlines."""
+import random
+import time
+
+
+class RetryableError(Exception):
+    """Raised by an attempt that may succeed when tried again.
+       retry_after is the minimum delay before the next attempt, e.g. from a rate limit reset."""
+
+    def __init__(self, message, retry_after=None):
+        super(RetryableError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class RetriesExhaustedError(Exception):
+    def __init__(self, message, last_error=None):
+        super(RetriesExhaustedError, self).__init__(message)
+        self.last_error = last_error
+
+
+class RetryPolicy(object):
+    """How often and how long to retry.
+
+       The delay before attempt n+1 is drawn uniformly between 0 and
+       min(max_delay, base_delay * 2 ** (n - 1)) ("full jitter"), so clients
+       that failed together don't retry together. No attempt is started once
+       the deadline (seconds since the first attempt) would be passed."""
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=30.0, deadline=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def get_delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def single_attempt(self):
+        return RetryPolicy(1, self.base_delay, self.max_delay, self.deadline)
+
+    def __repr__(self):
+        return "RetryPolicy(max_attempts={}, base_delay={}, max_delay={}, deadline={})".format(
+            self.max_attempts, self.base_delay, self.max_delay, self.deadline)
+
+
+class RetryPolicies(object):
+    """Policies by (verb, path), then path, then verb, then the default."""
+
+    def __init__(self, default):
+        self.default = default
+        self.policies = {}
+
+    def set(self, policy, verb=None, path=None):
+        self.policies[(verb, path)] = policy
+
+    def get(self, verb, path):
+        for key in ((verb, path), (None, path), (verb, None)):
+            if key in self.policies:
+                return self.policies[key]
+        return self.default
+
+
+def call_with_retry(attempt_fn, policy, logger=None, description=''):
+    """Call attempt_fn until it returns, retrying on RetryableError as the policy allows.
+       Any other exception propagates right away."""
+    started = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return attempt_fn()
+        except RetryableError as e:
+            if attempt >= policy.max_attempts:
+                raise RetriesExhaustedError("Max retry amount of {} on {} hit, raising. Last error: {}".format(
+                    policy.max_attempts - 1, description, e), e)
+            delay = policy.get_delay(attempt)
+            if e.retry_after is not None:
+                delay = max(delay, e.retry_after)
+            if policy.deadline is not None and time.time() - started + delay > policy.deadline:
+                raise RetriesExhaustedError("Retry deadline of {}s on {} hit, raising. Last error: {}".format(
+                    policy.deadline, description, e), e)
+            if logger is not None:
+                logger.warning("%s (attempt %d/%d). Retrying %s in %.2f seconds." % (
+                    e, attempt, policy.max_attempts, description, delay))
+            time.sleep(delay)
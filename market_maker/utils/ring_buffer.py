@@ -0,0 +1,64 @@
+import numpy as np
+
+
+class RingBuffer(object):
+    """Fixed-capacity columnar buffer of float rows with O(1) append.
+
+       Every value is written twice, at slot i and i + capacity, so the last N rows are
+       always one contiguous slice of the backing array. This lets views() hand out
+       chronologically ordered numpy views without copying, even after wrap-around."""
+
+    def __init__(self, columns, capacity):
+        if capacity <= 0:
+            raise ValueError("RingBuffer capacity must be positive")
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self._data = {column: np.full(2 * capacity, np.nan) for column in self.columns}
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    @property
+    def total_count(self):
+        """Number of rows appended since creation, including the overwritten ones."""
+        return self._count
+
+    def append(self, row):
+        """Append a row given as a mapping of column -> value. Missing/None values are stored as NaN."""
+        index = self._next
+        mirror = index + self.capacity
+        for column in self.columns:
+            value = row.get(column)
+            value = np.nan if value is None else value
+            data = self._data[column]
+            data[index] = value
+            data[mirror] = value
+        self._next = index + 1 if index + 1 < self.capacity else 0
+        self._count += 1
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def view(self, column, n=None):
+        """Read-only view of the last n values of a column, oldest first.
+           The view shares memory with the buffer: copy it if it must outlive the next append."""
+        size = len(self)
+        n = size if n is None else min(n, size)
+        end = self._next + self.capacity
+        result = self._data[column][end - n:end]
+        result.flags.writeable = False
+        return result
+
+    def views(self, n=None):
+        """Read-only views of the last n rows of every column."""
+        return {column: self.view(column, n) for column in self.columns}
+
+    def last(self):
+        """Return the newest row as a dict, or None when the buffer is empty."""
+        if self._count == 0:
+            return None
+        index = self._next - 1 if self._next > 0 else self.capacity - 1
+        return {column: self._data[column][index] for column in self.columns}
@@ -0,0 +1,41 @@
+import threading
+import time
+
+
+class WakeupSignal(object):
+    """Condition shared by the websocket threads (producers) and the robot loop (consumer).
+
+       Producers call notify() with the name of whatever changed. The loop blocks in wait(),
+       which returns as soon as something was notified or the timeout expires, so the
+       timeout only acts as a fallback polling interval."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._reasons = set()
+
+    def notify(self, reason):
+        with self._condition:
+            self._reasons.add(reason)
+            self._condition.notify_all()
+
+    def wait(self, timeout, debounce=0):
+        """Block until notified or until `timeout` seconds have passed.
+           After the first notification keep collecting for `debounce` seconds so that a
+           burst of updates results in a single wakeup. Returns the set of notified reasons,
+           which is empty if the wait timed out."""
+        with self._condition:
+            if not self._reasons:
+                self._condition.wait(timeout)
+            if self._reasons and debounce > 0:
+                end = time.monotonic() + debounce
+                remaining = debounce
+                while remaining > 0:
+                    self._condition.wait(remaining)
+                    remaining = end - time.monotonic()
+            reasons = self._reasons
+            self._reasons = set()
+        return reasons
+
+
+# Shared by all connectors of the robot process
+wakeup = WakeupSignal()
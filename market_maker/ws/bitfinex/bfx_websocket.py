@@ -3,6 +3,7 @@ Module used to house the bitfine websocket client
 """
 
 import json
+import time
 
 from .generic_websocket import GenericWebsocket, AuthError
 from .subscription_manager import SubscriptionManager
@@ -12,6 +13,17 @@ from .position_manager import PositionManager
 from market_maker.utils.bitfinex.auth import generate_auth_payload
 from market_maker.models.bitfinex import Order, Trade, OrderBook
 from .wsdata_storage import WsData_Storage
+from market_maker.utils.wakeup import wakeup
+from market_maker.utils.json_decoder import JsonDecoder
+from market_maker.utils.latency_stats import LatencyStats
+
+
+# Events which wake up the robot loop immediately
+WAKEUP_EVENTS = {
+    'ticker_snapshot', 'new_ticker',
+    'order_snapshot', 'order_new', 'order_update', 'order_closed',
+    'position_snapshot', 'position_new', 'position_update', 'position_closed'
+}
 
 
 class Flags:
@@ -34,6 +46,19 @@ class Flags:
     }
 
 
+def _peek_chan_id(message):
+    # Data frames start with their channel id, e.g. '[17082,[7254.7,3,3.3]]'
+    if not message.startswith('['):
+        return None
+    end = message.find(',', 1, 16)
+    if end < 0:
+        return None
+    try:
+        return int(message[1:end])
+    except ValueError:
+        return None
+
+
 def _parse_candle(cData, symbol, tf):
     return {
         'mts': cData[0],
@@ -69,6 +94,18 @@ def _parse_trade_snapshot_item(tData, symbol):
     }
 
 
+def _get_exchange_time(msg):
+    # With the TIMESTAMP flag every data message ends with its ms timestamp
+    if len(msg) > 2 and type(msg[-1]) is int and msg[-1] > 10 ** 12:
+        return msg[-1] / 1000.0
+    # Trade events carry the trade mts otherwise: [ID, MTS, ...] on the public
+    # trades channel, [ID, SYMBOL, MTS, ...] on the account channel
+    if len(msg) > 2 and msg[1] in ('te', 'tu') and type(msg[2]) is list:
+        mts = msg[2][2] if msg[0] == 0 else msg[2][1]
+        return mts / 1000.0
+    return None
+
+
 def _parse_trade(tData, symbol):
     return {
         'mts': tData[1],
@@ -150,7 +187,7 @@ class BfxWebsocket(GenericWebsocket):
 
     def __init__(self, symbol, API_KEY=None, API_SECRET=None, host=None,
                  manageOrderBooks=False, dead_man_switch=False, ws_capacity=25, logLevel='INFO', parse_float=float,
-                 *args, **kwargs):
+                 checksum_interval=1, *args, **kwargs):
         self.symbol = symbol
         self.API_KEY = API_KEY
         self.API_SECRET = API_SECRET
@@ -158,10 +195,15 @@ class BfxWebsocket(GenericWebsocket):
         self.dead_man_switch = dead_man_switch
         self.pendingOrders = {}
         self.orderBooks = {}
+        # Verify every Nth checksum frame of a book; 1 verifies all of them
+        self.checksum_interval = max(1, checksum_interval)
+        self.checksumFrames = {}
         self.ws_capacity = ws_capacity
         # How should we store float values? could also be bfxapi.decimal
         # which is slower but has higher precision.
         self.parse_float = parse_float
+        self.decoder = JsonDecoder(parse_float)
+        self.latency = LatencyStats()
         super(BfxWebsocket, self).__init__(host, logLevel=logLevel, *args, **kwargs)
         self.subscriptionManager = SubscriptionManager(self, logLevel=logLevel)
         self.orderManager = OrderManager(self, logLevel=logLevel)
@@ -201,6 +243,11 @@ class BfxWebsocket(GenericWebsocket):
             'conf': self._system_conf_handler
         }
 
+    def _emit(self, event, *args, **kwargs):
+        if event in WAKEUP_EVENTS:
+            wakeup.notify(event)
+        super(BfxWebsocket, self)._emit(event, *args, **kwargs)
+
     async def _ws_system_handler(self, socketId, msg):
         eType = msg.get('event')
         if eType in self._WS_SYSTEM_HANDLERS:
@@ -209,7 +256,7 @@ class BfxWebsocket(GenericWebsocket):
             self.logger.warn(
                 "Unknown websocket event (socketId={}): '{}' {}".format(socketId, eType, msg))
 
-    async def _ws_data_handler(self, socketId, data, raw_message_str):
+    async def _ws_data_handler(self, socketId, data):
         dataEvent = data[1]
         chan_id = data[0]
 
@@ -223,7 +270,7 @@ class BfxWebsocket(GenericWebsocket):
             if subscription.channel_name == 'ticker':
                 await self._ticker_handler(data)
             if subscription.channel_name == 'book':
-                await self._order_book_handler(data, raw_message_str)
+                await self._order_book_handler(data)
             if subscription.channel_name == 'trades':
                 await self._trade_handler(data)
             if subscription.channel_name == 'status':
@@ -293,10 +340,10 @@ class BfxWebsocket(GenericWebsocket):
         # [0,"wu",["exchange","USD",89134.66933283,0]]
         uw = self.wallets._update_from_event(data)
         self._emit('wallet_update', uw)
-        self.logger.debug("Wallet update: {}".format(uw))
+        self.logger.debug("Wallet update: %s", uw)
 
     async def _heart_beat_handler(self, data):
-        self.logger.debug("Heartbeat - {}".format(self.host))
+        self.logger.debug("Heartbeat - %s", self.host)
 
     async def _margin_info_update_handler(self, data):
         self._emit('margin_info_update', data)
@@ -311,7 +358,7 @@ class BfxWebsocket(GenericWebsocket):
             calc = _parse_margin_info_base_calc(calc_name, data_arr[2])
             self.wsdata.put_margin_info(calc_name, calc)
 
-        self.logger.debug("Margin info update: {}".format(data))
+        self.logger.debug("Margin info update: %s", data)
 
     async def _funding_info_update_handler(self, data):
         self._emit('funding_info_update', data)
@@ -331,7 +378,7 @@ class BfxWebsocket(GenericWebsocket):
                 "Notification SUCCESS: {}".format(notificationText))
 
     async def _balance_update_handler(self, data):
-        self.logger.debug('Balance update: {}'.format(data[2]))
+        self.logger.debug('Balance update: %s', data[2])
         self._emit('balance_update', data[2])
 
     async def _order_closed_handler(self, data):
@@ -442,15 +489,19 @@ class BfxWebsocket(GenericWebsocket):
                 data[1], subscription.symbol)
             self.wsdata.put_ticker(self.symbol, ticker)
             self._emit('new_ticker', ticker)
-        self.logger.debug("_ticker_handler(): New ticker for the {} symbol: {}".format(self.symbol, self.wsdata.get_ticker(self.symbol)))
+        self.logger.debug("_ticker_handler(): New ticker for the %s symbol: %s", self.symbol, self.wsdata.get_ticker(self.symbol))
         await self.enable_calculations(self.symbol)
 
-    async def _order_book_handler(self, data, orig_raw_message):
+    async def _order_book_handler(self, data):
         obInfo = data[1]
         chan_id = data[0]
         subscription = self.subscriptionManager.get(data[0])
         symbol = subscription.symbol
         if data[1] == "cs":
+            frames = self.checksumFrames.get(symbol, 0)
+            self.checksumFrames[symbol] = frames + 1
+            if frames % self.checksum_interval != 0:
+                return
             dChecksum = data[2] & 0xffffffff  # force to signed int
             checksum = self.orderBooks[symbol].checksum()
             # force checksums to signed integers
@@ -470,27 +521,66 @@ class BfxWebsocket(GenericWebsocket):
         isSnapshot = type(obInfo[0]) is list
         if isSnapshot:
             self.orderBooks[symbol] = OrderBook()
-            self.orderBooks[symbol].update_from_snapshot(obInfo, orig_raw_message)
+            # verify the first checksum of the new book
+            self.checksumFrames[symbol] = 0
+            self.orderBooks[symbol].update_from_snapshot(obInfo)
             self._emit('order_book_snapshot', {
                        'symbol': symbol, 'data': obInfo})
         else:
-            self.orderBooks[symbol].update_with(obInfo, orig_raw_message)
+            self.orderBooks[symbol].update_with(obInfo)
             self._emit('order_book_update', {'symbol': symbol, 'data': obInfo})
 
     async def on_message(self, socketId, message):
+        received_at = time.time()
         self.logger.debug(message)
         # convert float values to decimal
-        msg = json.loads(message, parse_float=self.parse_float)
+        if self._is_book_channel(_peek_chan_id(message)):
+            # book checksums need the prices and amounts exactly as they were sent
+            msg = self.decoder.loads_raw(message)
+        else:
+            msg = self.decoder.loads(message)
+        started = time.perf_counter()
         self._emit('all', msg)
         if type(msg) is dict:
             # System messages are received as json
+            channel = 'system'
+            self.decoder.attribute(channel)
             await self._ws_system_handler(socketId, msg)
+            self.latency.record(channel, received_at, time.perf_counter() - started)
         elif type(msg) is list:
             # All data messages are received as a list
-            await self._ws_data_handler(socketId, msg, message)
+            channel = self._get_channel_name(msg)
+            self.decoder.attribute(channel)
+            await self._ws_data_handler(socketId, msg)
+            self.latency.record(channel, received_at, time.perf_counter() - started, _get_exchange_time(msg))
         else:
             self.logger.warn('Unknown (socketId={}) websocket response: {}'.format(socketId, msg))
 
+    def _is_book_channel(self, chan_id):
+        subscription = self.subscriptionManager.subscriptions_chanid.get(chan_id)
+        return subscription is not None and subscription.channel_name == 'book'
+
+    def _get_channel_name(self, msg):
+        if msg[0] == 0:
+            return 'account'
+        if self.subscriptionManager.is_subscribed(msg[0]):
+            return self.subscriptionManager.get(msg[0]).channel_name
+        return 'unknown'
+
+    def get_parse_stats(self):
+        """
+        Return the JSON backend in use and the parse time per channel
+        """
+        return self.decoder.get_stats()
+
+    def get_stats(self):
+        """
+        Return the message rate, handler time and exchange-to-receive lag
+        histograms per channel, plus the JSON parse times and event dispatch latency
+        """
+        return {'channels': self.latency.get_stats(), 'parse': self.decoder.get_stats(),
+                'events': self.events.get_stats()}
+
     async def _ws_authenticate_socket(self, socketId):
         socket = self.sockets[socketId]
         socket.set_authenticated()
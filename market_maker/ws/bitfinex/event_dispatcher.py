@@ -0,0 +1,178 @@
+"""
+Module used to dispatch the websocket events to their listeners
+"""
+
+import asyncio
+import logging
+import time
+
+from market_maker.utils.latency_stats import Histogram
+
+# Async listeners which may be running at once; the ones emitted beyond that are dropped
+DEFAULT_MAX_PENDING = 1000
+
+
+class EventStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        # Async listeners not run because max_pending of them were running already
+        self.dropped = 0
+        # Time spent in emit(), i.e. running the sync listeners inline
+        self.handler_time = Histogram()
+        # Time from emit() until an async listener starts to run
+        self.queue_delay = Histogram()
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'dropped': self.dropped,
+            'handlerTime': self.handler_time.to_dict(),
+            'queueDelay': self.queue_delay.to_dict()
+        }
+
+
+class EventDispatcher:
+    """
+    Event emitter with the on/once/emit interface of pyee, without a thread of its own.
+
+    emit() calls the listeners inline, on the thread and event loop of the socket that
+    received the message. A listener which returns a coroutine (an async def) is started
+    as a task of that loop instead, so a slow listener doesn't hold up the events
+    emitted after it and nothing polls while there are no events. At most max_pending
+    of them run at once: the backlog of a listener which can't keep up is bounded by
+    dropping the coroutines emitted beyond it, counted in the overflows and the event's
+    dropped count. There is no queue; the tasks themselves are the backlog.
+
+    Exceptions of sync listeners propagate to emit(). Those of async listeners are
+    logged, counted in the event's errors and emitted as 'error' events if anything
+    listens to 'error'. They never reach the loop's exception handler, which restarts
+    the robot.
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING):
+        self.max_pending = max_pending
+        self.logger = logging.getLogger('root')
+        self._listeners = {}
+        self._pending = set()
+        self._loop = None
+        self.stats = {}
+        self.overflows = 0
+
+    def on(self, event, f=None):
+        """
+        Add a listener to the event. Without f, returns a decorator
+        """
+        if f is None:
+            def _on(f):
+                self.on(event, f)
+                return f
+            return _on
+        # emit() may be iterating over the current list on another thread
+        self._listeners[event] = self._listeners.get(event, []) + [f]
+        return f
+
+    def once(self, event, f=None):
+        """
+        Add a listener which is removed after the first time the event fires
+        """
+        if f is None:
+            def _once(f):
+                self.once(event, f)
+                return f
+            return _once
+
+        def g(*args, **kwargs):
+            self.remove_listener(event, g)
+            return f(*args, **kwargs)
+        g.listener = f
+        return self.on(event, g)
+
+    def remove_listener(self, event, f):
+        self._listeners[event] = [g for g in self._listeners.get(event, [])
+                                  if g is not f and getattr(g, 'listener', None) is not f]
+
+    def remove_all_listeners(self, event=None):
+        if event is None:
+            self._listeners = {}
+        else:
+            self._listeners.pop(event, None)
+
+    def listeners(self, event):
+        return list(self._listeners.get(event, []))
+
+    def emit(self, event, *args, **kwargs):
+        """
+        Call the listeners of the event. Returns whether there were any
+        """
+        listeners = self._listeners.get(event)
+        if not listeners:
+            if event == 'error':
+                raise args[0] if args and isinstance(args[0], Exception) else Exception(
+                    "Uncaught, unspecified 'error' event.")
+            return False
+        stats = self.stats.get(event)
+        if stats is None:
+            stats = self.stats[event] = EventStats()
+        stats.count += 1
+        started = time.perf_counter()
+        try:
+            for f in listeners:
+                result = f(*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    self._enqueue(event, result, started)
+        finally:
+            stats.handler_time.add(time.perf_counter() - started)
+        return True
+
+    def get_stats(self):
+        """
+        Return the dispatch statistics per event
+        """
+        return {
+            'events': {event: stats.to_dict() for event, stats in list(self.stats.items())},
+            'pending': len(self._pending),
+            'overflows': self.overflows
+        }
+
+    def _enqueue(self, event, coro, emitted_at):
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or not loop.is_running():
+            # emitted outside of a socket's loop: run it on the last loop we dispatched on
+            if self._loop is None:
+                self.logger.error("No event loop to run the '{}' listener {} on.".format(event, coro))
+                coro.close()
+                return
+            self._loop.call_soon_threadsafe(self._put, self._loop, event, coro, emitted_at)
+            return
+        self._put(loop, event, coro, emitted_at)
+
+    def _put(self, loop, event, coro, emitted_at):
+        self._loop = loop
+        if len(self._pending) >= self.max_pending:
+            self.overflows += 1
+            self.stats[event].dropped += 1
+            self.logger.warning("{} event listeners still running, dropping the '{}' listener.".format(
+                len(self._pending), event))
+            coro.close()
+            return
+        task = loop.create_task(self._run_listener(event, coro, emitted_at))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _run_listener(self, event, coro, emitted_at):
+        stats = self.stats[event]
+        stats.queue_delay.add(time.perf_counter() - emitted_at)
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats.errors += 1
+            self.logger.exception("Exception in a '{}' event listener: {}".format(event, e))
+            if self._listeners.get('error'):
+                self.emit('error', e)
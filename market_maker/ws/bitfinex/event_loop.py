@@ -0,0 +1,68 @@
+"""
+Module used to run the websockets on one shared asyncio loop
+"""
+
+import asyncio
+import threading
+
+
+class EventLoopThread:
+    """
+    An asyncio loop running forever on a thread of its own. The sockets of every
+    websocket using it run as tasks on this loop, so many sockets, channels or symbols
+    cost one thread instead of one each.
+
+    submit() and call_soon() may be called from any thread. Waiting on the future
+    submit() returns from the loop's own thread would block the loop, so coroutines
+    already running on it should await instead.
+
+    The thread is a daemon, so it doesn't keep the process alive once the robot exits.
+    """
+
+    def __init__(self, name='bfx-websockets', exception_handler=None):
+        self.name = name
+        self.loop = asyncio.new_event_loop()
+        if exception_handler is not None:
+            self.loop.set_exception_handler(exception_handler)
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def submit(self, coro):
+        """
+        Schedule the coroutine on the loop. Returns a concurrent.futures.Future
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call_soon(self, callback, *args):
+        """
+        Call the function on the loop's thread
+        """
+        self.start()
+        return self.loop.call_soon_threadsafe(callback, *args)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+
+def get_shared_event_loop(exception_handler=None):
+    """
+    The loop used by all websockets which aren't given one of their own. The exception
+    handler is set once, by the call which creates the loop
+    """
+    global _shared_loop
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = EventLoopThread(exception_handler=exception_handler)
+        return _shared_loop
@@ -6,14 +6,13 @@ import asyncio
 import websockets
 import socket
 import json
-import time
 import logging
-from threading import Thread
 from market_maker.utils.log import log_error
 import os
 from market_maker.settings import settings
 
-from pyee import EventEmitter
+from .event_dispatcher import EventDispatcher
+from .event_loop import get_shared_event_loop
 
 # websocket exceptions
 from websockets.exceptions import ConnectionClosed
@@ -53,21 +52,24 @@ class Socket():
     def set_websocket(self, ws):
         self.ws = ws
 
-def _start_event_worker():
-    async def event_sleep_process():
-        """
-        sleeping process for event emitter to schedule on
-        """
-        while True:
-            await asyncio.sleep(0.01)
-    def start_loop(loop):
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(event_sleep_process())
-    event_loop = asyncio.new_event_loop()
-    worker = Thread(target=start_loop, args=(event_loop,))
-    worker.start()
-    ee = EventEmitter(scheduler=asyncio.ensure_future, loop=event_loop)
-    return ee
+def handle_loop_exception(loop, context):
+    """
+    Exception handler of the websockets' event loop: restarts the robot
+    """
+    logger = logging.getLogger('root')
+    # context["message"] will always be there; but context["exception"] may not
+    msg = context.get("message")
+    logger.info("handle_exception(): Exception occurred: {}, Message={}".format(context.get("exception"), msg))
+
+    if msg == "Fatal error on SSL transport":
+        log_error(logger, "Bitfinex Websocket exception occurred: {}. The NerdMarketMakerRobot will be restarted.".format(msg), True)
+        os._exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
+    if msg == "Fatal read error on socket transport":
+        log_error(logger, "Bitfinex Websocket exception occurred: {}. The NerdMarketMakerRobot will be restarted.".format(msg), False)
+        os._exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
+    else:
+        log_error(logger, "Unexpected Bitfinex Websocket exception occurred: {}. The NerdMarketMakerRobot will be restarted.".format(msg), True)
+        os._exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
 
 class GenericWebsocket:
     """
@@ -75,7 +77,7 @@ class GenericWebsocket:
     Inlcudes an event emitter and a standard websocket client.
     """
 
-    def __init__(self, host, logLevel='INFO', max_retries=5, create_event_emitter=None):
+    def __init__(self, host, logLevel='INFO', max_retries=5, create_event_emitter=None, event_loop=None):
         self.host = host
         self.logger = logging.getLogger('root')
         # overide 'error' event to stop it raising an exception
@@ -83,35 +85,14 @@ class GenericWebsocket:
         self.max_retries = max_retries
         self.attempt_retry = True
         self.sockets = {}
-        # start seperate process for the even emitter
-        create_ee = create_event_emitter or _start_event_worker
+        # all sockets run as tasks of one loop, by default shared with the other websockets.
+        # Its exception handler is set once, by whoever creates the loop
+        self.event_loop = event_loop or get_shared_event_loop(handle_loop_exception)
+        # listeners run on the loop of the socket which emitted the event
+        create_ee = create_event_emitter or EventDispatcher
         self.events = create_ee()
         #self.events.on('error', self.on_error)
 
-    def set_exception_handling(self, loop):
-        # May want to catch other signals too
-        #signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
-        #for ss in signals:
-        #    loop.add_signal_handler(
-        #        ss, lambda s=ss: asyncio.create_task(self.shutdown(loop, signal=s)))
-        # comment out the line below to see how unhandled exceptions behave
-        loop.set_exception_handler(self.handle_exception)
-
-    def handle_exception(self, loop, context):
-        # context["message"] will always be there; but context["exception"] may not
-        msg = context.get("message")
-        self.logger.info("handle_exception(): Exception occurred: {}, Message={}".format(context["exception"], msg))
-
-        if msg == "Fatal error on SSL transport":
-            log_error(self.logger, "Bitfinex Websocket exception occurred: {}. The NerdMarketMakerRobot will be restarted.".format(msg), True)
-            os._exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
-        if msg == "Fatal read error on socket transport":
-            log_error(self.logger, "Bitfinex Websocket exception occurred: {}. The NerdMarketMakerRobot will be restarted.".format(msg), False)
-            os._exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
-        else:
-            log_error(self.logger, "Unexpected Bitfinex Websocket exception occurred: {}. The NerdMarketMakerRobot will be restarted.".format(msg), True)
-            os._exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
-
     def run(self):
         """
         Start the websocket connection. This functions spawns the initial socket
@@ -119,34 +100,39 @@ class GenericWebsocket:
         """
         self._start_new_socket()
 
+    def submit(self, coro):
+        """
+        Run a coroutine, e.g. subscribe() or submit_order(), on the websocket's loop.
+        Can be called from any thread; returns a concurrent.futures.Future
+        """
+        return self.event_loop.submit(coro)
+
     def _start_new_socket(self, socketId=None):
         if not socketId:
             socketId = len(self.sockets)
+        s = Socket(socketId)
+        self.sockets[socketId] = s
 
-        def start_loop(loop):
+        async def run_socket():
             try:
-                self.set_exception_handling(worker_loop)
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(self._run_socket())
+                await self._run_socket(s)
             except Exception as e:
                 log_error(self.logger, "Unexpected exception, the NerdMarketMakerRobot will be restarted. Exception: {}".format(e), True)
                 os._exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
 
-        worker_loop = asyncio.new_event_loop()
-        worker = Thread(target=start_loop, args=(worker_loop,))
-        worker.start()
+        self.event_loop.submit(run_socket())
         return socketId
 
-    def _wait_for_socket(self, socket_id):
+    async def _wait_for_socket(self, socket_id):
         """
-        Block until the given socket connection is open
+        Wait until the given socket connection is open
         """
         while True:
             socket = self.sockets.get(socket_id, False)
             if socket:
                 if socket.isConnected and socket.ws:
                     return
-            time.sleep(0.01)
+            await asyncio.sleep(0.01)
 
     async def _connect(self, socket):
         async with websockets.connect(self.host) as websocket:
@@ -173,11 +159,9 @@ class GenericWebsocket:
                 return True
         return False
 
-    async def _run_socket(self):
+    async def _run_socket(self, s):
         retries = 0
-        sId =  len(self.sockets)
-        s = Socket(sId)
-        self.sockets[sId] = s
+        sId = s.id
         while retries < self.max_retries and self.attempt_retry:
             try:
                 await self._connect(s)
@@ -27,7 +27,7 @@ class OrderManager:
         for raw_order in raw_rest_data:
             order = Order.from_raw_order_api_v1(raw_order)
             self.open_orders[order["orderID"]] = order
-        self.logger.debug("open_orders: {}".format(self.get_open_orders()))
+        self.logger.debug("open_orders: %s", self.get_open_orders())
 
     async def build_from_order_snapshot(self, raw_ws_data):
         '''
@@ -39,35 +39,35 @@ class OrderManager:
             order = Order.from_raw_order_api_v2(raw_order)
             self.open_orders[order["orderID"]] = order
         self.bfxapi._emit('order_snapshot', self.get_open_orders())
-        self.logger.debug("open_orders: {}".format(self.get_open_orders()))
+        self.logger.debug("open_orders: %s", self.get_open_orders())
 
     async def confirm_order_new(self, raw_ws_data):
-        self.logger.debug("confirm_order_new(): raw_ws_data={}".format(raw_ws_data))
+        self.logger.debug("confirm_order_new(): raw_ws_data=%s", raw_ws_data)
         order = Order.from_raw_order_api_v2(raw_ws_data[2])
         self.open_orders[order["orderID"]] = order
         self.bfxapi._emit('order_confirmed', order)
         self.logger.info("Order new: {}".format(order))
-        self.logger.debug("open_orders: {}".format(self.get_open_orders()))
+        self.logger.debug("open_orders: %s", self.get_open_orders())
         self.bfxapi._emit('order_new', order)
 
     async def confirm_order_update(self, raw_ws_data):
-        self.logger.debug("confirm_order_update(): raw_ws_data={}".format(raw_ws_data))
+        self.logger.debug("confirm_order_update(): raw_ws_data=%s", raw_ws_data)
         order = Order.from_raw_order_api_v2(raw_ws_data[2])
         orderId = order["orderID"]
         self.open_orders[orderId] = order
-        self.logger.debug("Order update: {}".format(order))
-        self.logger.debug("open_orders: {}".format(self.get_open_orders()))
+        self.logger.debug("Order update: %s", order)
+        self.logger.debug("open_orders: %s", self.get_open_orders())
         self.bfxapi._emit('order_update', order)
 
     async def confirm_order_closed(self, raw_ws_data):
-        self.logger.debug("confirm_order_closed(): raw_ws_data={}".format(raw_ws_data))
+        self.logger.debug("confirm_order_closed(): raw_ws_data=%s", raw_ws_data)
         order = Order.from_raw_order_api_v2(raw_ws_data[2])
         orderId = order["orderID"]
         if orderId in self.open_orders:
             del self.open_orders[orderId]
             self.bfxapi._emit('order_confirmed', order)
             self.logger.info("Order closed: {}".format(order))
-            self.logger.debug("open_orders: {}".format(self.get_open_orders()))
+            self.logger.debug("open_orders: %s", self.get_open_orders())
             self.bfxapi._emit('order_closed', order)
 
     def get_current_position(self):
@@ -29,7 +29,7 @@ class PositionManager:
         return self.closed_positions
 
     async def build_from_position_snapshot(self, raw_ws_data):
-        self.logger.debug("build_from_position_snapshot(): raw_ws_data={}".format(raw_ws_data))
+        self.logger.debug("build_from_position_snapshot(): raw_ws_data=%s", raw_ws_data)
         psData = raw_ws_data[2]
         self.open_positions = {}
         for raw_position in psData:
@@ -39,23 +39,23 @@ class PositionManager:
         self.bfxapi._emit('position_snapshot', self.get_open_positions())
 
     async def confirm_position_new(self, raw_ws_data):
-        self.logger.debug("confirm_position_new(): raw_ws_data={}".format(raw_ws_data))
+        self.logger.debug("confirm_position_new(): raw_ws_data=%s", raw_ws_data)
         position = Position.from_raw_position(raw_ws_data[2])
         self.open_positions[position["symbol"]] = position
         self.logger.info("Position new: {}".format(position))
         self.bfxapi._emit('position_new', position)
 
     async def confirm_position_update(self, raw_ws_data):
-        self.logger.debug("confirm_position_update(): raw_ws_data={}".format(raw_ws_data))
+        self.logger.debug("confirm_position_update(): raw_ws_data=%s", raw_ws_data)
         position = Position.from_raw_position(raw_ws_data[2])
         symbol = position["symbol"]
         self.process_position_execution(self.open_positions[symbol], position)
         self.open_positions[symbol] = position
-        self.logger.debug("Position update: {}".format(position))
+        self.logger.debug("Position update: %s", position)
         self.bfxapi._emit('position_update', position)
 
     async def confirm_position_closed(self, raw_ws_data):
-        self.logger.debug("confirm_position_closed(): raw_ws_data={}".format(raw_ws_data))
+        self.logger.debug("confirm_position_closed(): raw_ws_data=%s", raw_ws_data)
         position = Position.from_raw_position(raw_ws_data[2])
         symbol = position["symbol"]
         self.logger.info("Position closed: {}".format(symbol))
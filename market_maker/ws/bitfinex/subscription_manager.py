@@ -43,7 +43,7 @@ class SubscriptionManager:
         """
         if self.bfxapi.get_total_available_capcity() < 2:
             sId = self.bfxapi._start_new_socket()
-            self.bfxapi._wait_for_socket(sId)
+            await self.bfxapi._wait_for_socket(sId)
             soc = self.bfxapi.sockets[sId]
             socket = self.bfxapi.sockets[sId]
         else:
@@ -0,0 +1,70 @@
+"""
+Journal of raw websocket frames. Frames are appended to a gzip compressed text
+file, one "<receive epoch>\t<raw frame>" line per frame, and can be fed back
+through a message handler for network-free benchmarks and regression runs.
+"""
+
+import gzip
+import threading
+import time
+
+
+class WsJournalWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'at', encoding='utf8')
+
+    def write(self, message, received_at=None):
+        if received_at is None:
+            received_at = time.time()
+        # JSON frames never contain a raw newline inside a string, so this only touches whitespace
+        if '\n' in message:
+            message = message.replace('\n', ' ')
+        with self._lock:
+            if self._file is not None:
+                self._file.write("%.6f\t%s\n" % (received_at, message))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_journal(path):
+    """Yield (received_at, raw_frame) tuples from a journal file."""
+    with gzip.open(path, 'rt', encoding='utf8') as journal:
+        for line in journal:
+            received_at, message = line.rstrip('\n').split('\t', 1)
+            yield float(received_at), message
+
+
+def replay_journal(path, on_message, realtime=False, speed=1.0):
+    """Feed every frame of a journal to on_message.
+       With realtime=True the recorded inter-frame gaps are reproduced (divided by `speed`),
+       otherwise frames are pushed as fast as the handler takes them.
+       Returns a dict with the number of frames, wall time and handler time."""
+    frames = 0
+    handler_time = 0.0
+    first_received_at = None
+    started = time.time()
+    for received_at, message in read_journal(path):
+        if realtime:
+            if first_received_at is None:
+                first_received_at = received_at
+            delay = (received_at - first_received_at) / speed - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+        handler_started = time.perf_counter()
+        on_message(message)
+        handler_time += time.perf_counter() - handler_started
+        frames += 1
+    elapsed = time.time() - started
+    return {
+        'frames': frames,
+        'elapsed': elapsed,
+        'handlerTime': handler_time,
+        'framesPerSecond': frames / handler_time if handler_time else 0
+    }
@@ -0,0 +1,19 @@
+"""
+Immutable snapshots of the websocket state the strategy reads. The websocket
+thread never mutates a published snapshot: it builds a new one and swaps the
+reference, so a reader holding a snapshot sees orders, positions, margin and
+instrument from the same point in the stream without taking a lock.
+"""
+
+from collections import namedtuple
+
+
+# version:    increases by one on every publish
+# tables:     frozenset of the tables received so far
+# orders:     tuple of order rows, as stored by the websocket
+# positions:  tuple of position rows, unrealisedPnl in XBT and avgEntryPrice defaulted to 0
+# margin:     first margin row, walletBalance and marginBalance in XBT
+# instrument: copy of the robot symbol's instrument, with tickLog
+WsSnapshot = namedtuple('WsSnapshot', ['version', 'tables', 'orders', 'positions', 'margin', 'instrument'])
+
+EMPTY_SNAPSHOT = WsSnapshot(0, frozenset(), (), (), None, None)
@@ -1,23 +1,32 @@
 import sys
+import time
+import itertools
+import collections
 import websocket
 import threading
 import traceback
 import ssl
 from time import sleep
-import json
 import decimal
 import logging
-from market_maker.utils.bitmex.utils import XBt_to_XBT
+from market_maker.utils.bitmex.utils import XBt_to_XBT, timestamp_to_epoch
 from market_maker.utils.log import log_error, log_info
 from market_maker.settings import settings
 from market_maker.auth.bitmex.APIKeyAuth import generate_expires, generate_signature
 from market_maker.utils.log import setup_robot_custom_logger
 from market_maker.utils.mm_math import toNearest
+from market_maker.utils.ring_buffer import RingBuffer
+from market_maker.utils.wakeup import wakeup
+from market_maker.utils.json_decoder import JsonDecoder
+from market_maker.utils.latency_stats import LatencyStats
 from future.utils import iteritems
 from future.standard_library import hooks
 with hooks():  # Python 2/3 compat
     from urllib.parse import urlparse, urlunparse
 from market_maker.exchange import ExchangeInfo
+from market_maker.models.bitmex import OrderBookL2, ORDER_BOOK_TABLES
+from market_maker.ws.bitmex.ws_journal import WsJournalWriter, replay_journal
+from market_maker.ws.bitmex.ws_snapshot import EMPTY_SNAPSHOT
 from market_maker.utils import mm_math
 from market_maker.db.db_manager import DatabaseManager
 
@@ -39,27 +48,74 @@ class BitMEXWebsocket():
     # Don't grow a table larger than this amount. Helps cap memory usage.
     MAX_TABLE_LEN = 200
 
+    # Changes to these tables wake up the robot loop immediately. Quotes only do when the best
+    # bid or ask price moved, not on every size change.
+    WAKEUP_TABLES = ['quote', 'order', 'execution', 'position']
+
+    # Account tables published to the strategy through immutable snapshots.
+    # Their rows are replaced on update, never mutated in place.
+    SNAPSHOT_TABLES = ['order', 'position', 'margin']
+
+    # Closed orders remembered so that late, older messages about them don't reopen them
+    MAX_CLOSED_ORDERS = 1000
+
+    # Backoff between reconnection attempts after the connection drops, in seconds
+    RECONNECT_MIN_DELAY = 1
+    RECONNECT_MAX_DELAY = 30
+
+    # Insert-only market data tables are kept in fixed-capacity ring buffers of these columns.
+    # Timestamps are stored as epoch seconds.
+    RING_BUFFER_LEN = 4096
+    RING_BUFFER_COLUMNS = {
+        'trade': ('timestamp', 'price', 'size'),
+        'quote': ('timestamp', 'bidPrice', 'bidSize', 'askPrice', 'askSize')
+    }
+
     def __init__(self):
         self.logger = logging.getLogger('root')
+        self.ws = None
+        self.journal = None
+        self.decoder = JsonDecoder()
+        self.latency = LatencyStats()
+        # Set while every subscribed table has received its partial on the current connection
+        self.synced = threading.Event()
+        self.pending_partials = set()
+        self.reconnect_count = 0
+        # Guards the order table, which REST responses update as well as the websocket thread
+        self.orderLock = threading.RLock()
+        # Serializes the snapshot swaps of the websocket thread and the REST callers
+        self.snapshotLock = threading.Lock()
         self.__reset()
 
     def __del__(self):
         self.exit()
 
-    def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True):
-        '''Connect to the websocket and initialize data stores.'''
+    def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True, orderBookTable=None, captureFile=None):
+        '''Connect to the websocket and initialize data stores.
+           orderBookTable can be 'orderBookL2' or 'orderBookL2_25' to also maintain a local L2 book.
+           If captureFile is set, every raw frame received is appended to that journal (see replay()).'''
 
         self.logger.debug("Connecting WebSocket.")
         self.symbol = symbol
         self.shouldAuth = shouldAuth
+        if orderBookTable and orderBookTable not in ORDER_BOOK_TABLES:
+            raise ValueError("Unsupported order book table: %s" % orderBookTable)
+        self.orderBookTable = orderBookTable
+        if captureFile:
+            self.logger.info("Capturing raw websocket frames to %s" % captureFile)
+            self.journal = WsJournalWriter(captureFile)
 
         # We can subscribe right in the connection querystring, so let's build that.
         # Subscribe to all pertinent endpoints
         subscriptions = [sub + ':' + symbol for sub in ["quote", "trade", "instrument"]]
         subscriptions += ["instrument:.BVOL24H"]
+        if self.orderBookTable:
+            subscriptions += [self.orderBookTable + ':' + symbol]
         if self.shouldAuth:
             subscriptions += [sub + ':' + symbol for sub in ["order", "execution"]]
             subscriptions += ["margin", "position"]
+        # A new connection pushes a partial for every table again; that is how we resync after a drop
+        self.subscribed_tables = {sub.split(':')[0] for sub in subscriptions}
 
         # Get WS URL and connect.
         urlParts = list(urlparse(endpoint))
@@ -80,67 +136,84 @@ class BitMEXWebsocket():
     # Data methods
     #
     def get_instrument(self, symbol):
-        instruments = self.data['instrument']
-        matchingInstruments = [i for i in instruments if i['symbol'] == symbol]
-        if len(matchingInstruments) == 0:
+        # Derived values are cached per symbol until the next instrument message for it
+        version = self.instrument_versions.get(symbol, 0)
+        cached = self.instrument_cache.get(symbol)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        # Instruments are keyed on the symbol, so this is a direct lookup
+        instrument = self.data['instrument'].get((symbol,))
+        if instrument is None:
             raise Exception("Unable to find instrument or index with symbol: " + symbol)
-        instrument = matchingInstruments[0]
         # Turn the 'tickSize' into 'tickLog' for use in rounding
         # http://stackoverflow.com/a/6190291/832202
         instrument['tickLog'] = mm_math.get_decimal_digits_number(instrument['tickSize'])
+        self.instrument_cache[symbol] = (version, instrument)
         return instrument
 
     def get_ticker(self, symbol):
-        '''Return a ticker object. Generated from instrument.'''
-
-        instrument = self.get_instrument(symbol)
-
-        # If this is an index, we have to get the data from the last trade.
-        if instrument['symbol'][0] == '.':
-            ticker = {}
-            ticker['mid'] = ticker['buy'] = ticker['sell'] = ticker['last'] = instrument['markPrice']
-        # Normal instrument
-        else:
-            bid = instrument['bidPrice'] or instrument['lastPrice']
-            ask = instrument['askPrice'] or instrument['lastPrice']
-            ticker = {
-                "last": instrument['lastPrice'],
-                "buy": bid,
-                "sell": ask,
-                "mid": (bid + ask) / 2
-            }
-
-        # The instrument has a tickSize. Use it to round values.
-        return {k: toNearest(float(v or 0), instrument['tickSize']) for k, v in iteritems(ticker)}
-
-    def funds(self):
-        margin_dict = self.data['margin'][0]
-        margin_dict_copy = margin_dict.copy()
-        margin_dict_copy["walletBalance"] = XBt_to_XBT(margin_dict["walletBalance"])
-        margin_dict_copy["marginBalance"] = XBt_to_XBT(margin_dict["marginBalance"])
-        return margin_dict_copy
+        '''Return a ticker object. Generated from instrument.
+           The returned dict is cached until the instrument changes; don't mutate it.'''
+
+        version = self.instrument_versions.get(symbol, 0)
+        cached = self.ticker_cache.get(symbol)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        ticker = instrumentToTicker(self.get_instrument(symbol))
+        self.ticker_cache[symbol] = (version, ticker)
+        return ticker
+
+    def get_order_book(self, symbol):
+        '''Return the local L2 book of a symbol, or None if the book is not subscribed.'''
+        return self.order_books.get(symbol)
+
+    def recent_trades(self, n=None):
+        '''Read-only numpy views of timestamp/price/size over the last n trades, oldest first.'''
+        return self.data['trade'].views(n)
+
+    def recent_quotes(self, n=None):
+        '''Read-only numpy views of timestamp/bid/ask prices and sizes over the last n quotes, oldest first.'''
+        return self.data['quote'].views(n)
+
+    def get_parse_stats(self):
+        '''Return the JSON backend in use and the parse time per table.'''
+        return self.decoder.get_stats()
+
+    def get_stats(self):
+        '''Per table message rate, handler time and exchange-to-receive lag histograms,
+           plus the JSON parse times.'''
+        return {'tables': self.latency.get_stats(), 'parse': self.decoder.get_stats()}
+
+    def get_snapshot(self):
+        '''Return the latest published WsSnapshot. It is never modified afterwards, so it can be
+           read from any thread without locking. Don't mutate the rows it holds.'''
+        return self.snapshot
+
+    # The account accessors below read the given snapshot, or the latest one.
+    def funds(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot
+        return snapshot.margin
 
     def current_qty(self):
         return self.position(self.symbol)['currentQty']
 
-    def open_orders(self, clOrdIDPrefix):
-        orders = self.data['order']
+    def open_orders(self, clOrdIDPrefix, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot
         # Filter to only open orders (leavesQty > 0) and those that we actually placed
-        return [o for o in orders if str(o['clOrdID']).startswith(clOrdIDPrefix) and o['leavesQty'] > 0]
-
-    def position(self, symbol):
-        positions = self.data['position']
-        pos = [p for p in positions if p['symbol'] == symbol]
-        if len(pos) == 0:
-            # No position found; stub it
-            return {'avgCostPrice': 0, 'avgEntryPrice': 0, 'currentQty': 0, 'symbol': symbol, 'unrealisedPnl': 0}
-
-        pos_dict = pos[0]
-        pos_dict_copy = pos_dict.copy()
-        pos_dict_copy["unrealisedPnl"] = XBt_to_XBT(pos_dict["unrealisedPnl"])
-        if not pos_dict_copy["avgEntryPrice"]:
-            pos_dict_copy["avgEntryPrice"] = 0
-        return pos_dict_copy
+        return [o for o in snapshot.orders if str(o['clOrdID']).startswith(clOrdIDPrefix) and o['leavesQty'] > 0]
+
+    def position(self, symbol, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot
+        for pos in snapshot.positions:
+            if pos['symbol'] == symbol:
+                return pos
+        # No position found; stub it
+        return {'avgCostPrice': 0, 'avgEntryPrice': 0, 'currentQty': 0, 'symbol': symbol, 'unrealisedPnl': 0}
 
     #
     # Lifecycle methods
@@ -152,7 +225,63 @@ class BitMEXWebsocket():
 
     def exit(self):
         self.exited = True
-        self.ws.close()
+        self.synced.clear()
+        if self.ws is not None:
+            self.ws.close()
+        if self.journal is not None:
+            self.journal.close()
+
+    def is_connected(self):
+        '''True when the socket is up and all tables have been resynced since the last (re)connect.'''
+        return not self.exited and self.synced.is_set()
+
+    def wait_for_reconnect(self, timeout):
+        '''Block until the connection is back and resynced. Returns False on timeout or if we exited.'''
+        return self.synced.wait(timeout) and not self.exited
+
+    def apply_order_responses(self, orders):
+        '''Apply the order rows returned by REST calls (create, amend, cancel) to the order table
+           right away instead of waiting for the websocket to echo them. Whichever of the two
+           carries the newer timestamp wins; the older one is ignored when it arrives.'''
+        orders = [o for o in orders or [] if isinstance(o, dict) and o.get('orderID') and 'ordStatus' in o]
+        if not orders:
+            return
+        with self.orderLock:
+            rows = self.data.get('order')
+            if not isinstance(rows, dict):
+                return  # No image yet; the partial will carry these
+            keys = self.keys['order']
+            for order in self.__newer_order_states('order', orders):
+                itemKey = getItemKey(keys, order)
+                item = rows.get(itemKey)
+                if item is not None and order['ordStatus'] != 'Canceled':
+                    self.__log_execution(item, order['cumQty'])
+                item = rows[itemKey] = dict(item or {}, **order)
+                if item['leavesQty'] <= 0:
+                    self.__close_order(rows, itemKey, item)
+            self.__publish_snapshot('order')
+
+    def reconcile_orders(self, openOrders, clOrdIDPrefix):
+        '''Bring the order table in line with our open orders as just fetched over REST: apply
+           them, and close the orders of ours the exchange no longer has open.'''
+        with self.orderLock:
+            rows = self.data.get('order')
+            if not isinstance(rows, dict):
+                return
+            openOrderIDs = set(o['orderID'] for o in openOrders)
+            for itemKey, item in list(rows.items()):
+                if str(item['clOrdID']).startswith(clOrdIDPrefix) and item['orderID'] not in openOrderIDs:
+                    self.logger.info("Order %s is no longer open on the exchange, removing it." % item['orderID'])
+                    self.__close_order(rows, itemKey, item)
+            self.__publish_snapshot('order')
+            self.apply_order_responses(openOrders)
+        wakeup.notify('order')
+
+    def replay(self, journalFile, symbol, realtime=False, speed=1.0):
+        '''Feed a captured journal through the message handler without connecting.
+           Returns the replay statistics of ws_journal.replay_journal.'''
+        self.symbol = symbol
+        return replay_journal(journalFile, self.__on_message, realtime=realtime, speed=speed)
 
     #
     # Private methods
@@ -162,18 +291,11 @@ class BitMEXWebsocket():
         '''Connect to the websocket in a thread.'''
         self.logger.debug("Starting thread")
 
-        ssl_defaults = ssl.get_default_verify_paths()
-        sslopt_ca_certs = {'ca_certs': ssl_defaults.cafile}
-        self.ws = websocket.WebSocketApp(wsURL,
-                                         on_message=self.__on_message,
-                                         on_close=self.__on_close,
-                                         on_open=self.__on_open,
-                                         on_error=self.__on_error,
-                                         header=self.__get_auth()
-                                         )
+        self.__start_resync()
+        self.ws = self.__create_app(wsURL)
 
         setup_robot_custom_logger('websocket', log_level=settings.LOG_LEVEL)
-        self.wst = threading.Thread(target=lambda: self.ws.run_forever(sslopt=sslopt_ca_certs))
+        self.wst = threading.Thread(target=self.__run, args=(wsURL,))
         self.wst.daemon = True
         self.wst.start()
         self.logger.info("Started thread")
@@ -189,6 +311,60 @@ class BitMEXWebsocket():
             self.exit()
             sys.exit(settings.FORCE_RESTART_EXIT_STATUS_CODE)
 
+    def __create_app(self, wsURL):
+        return websocket.WebSocketApp(wsURL,
+                                      on_message=self.__on_message,
+                                      on_close=self.__on_close,
+                                      on_open=self.__on_open,
+                                      on_error=self.__on_error,
+                                      header=self.__get_auth()
+                                      )
+
+    def __run(self, wsURL):
+        '''Websocket thread: run the connection and reconnect with backoff whenever it drops,
+           until exit() is called.'''
+        ssl_defaults = ssl.get_default_verify_paths()
+        sslopt_ca_certs = {'ca_certs': ssl_defaults.cafile}
+        delay = BitMEXWebsocket.RECONNECT_MIN_DELAY
+        while True:
+            connected_at = time.time()
+            self.ws.run_forever(sslopt=sslopt_ca_certs)
+            if self.exited:
+                break
+
+            self.synced.clear()
+            # A connection that stayed up for a while starts the backoff over
+            if time.time() - connected_at > BitMEXWebsocket.RECONNECT_MAX_DELAY:
+                delay = BitMEXWebsocket.RECONNECT_MIN_DELAY
+            log_error(self.logger, "Websocket connection lost, reconnecting in {} seconds.".format(delay), True)
+            sleep(delay)
+            delay = min(delay * 2, BitMEXWebsocket.RECONNECT_MAX_DELAY)
+            if self.exited:
+                break
+
+            self.reconnect_count += 1
+            self.__start_resync()
+            try:
+                # New auth headers: the signature expires
+                self.ws = self.__create_app(wsURL)
+            except Exception:
+                log_error(self.logger, traceback.format_exc(), True)
+
+    def __start_resync(self):
+        '''Expect a partial of every subscribed table before the data is trusted again.
+           Until then the previous images are kept and replaced table by table.'''
+        self.pending_partials = set(self.subscribed_tables)
+        self.synced.clear()
+
+    def __on_partial(self, table):
+        if table in self.pending_partials:
+            self.pending_partials.discard(table)
+            if not self.pending_partials:
+                if self.reconnect_count:
+                    log_info(self.logger, "Websocket reconnected, all tables resynced.", True)
+                self.synced.set()
+                wakeup.notify('reconnect')
+
     def __get_auth(self):
         '''Return auth headers. Will use API Keys if present in settings.'''
 
@@ -208,13 +384,16 @@ class BitMEXWebsocket():
     def __wait_for_account(self):
         '''On subscribe, this data will come down. Wait for it.'''
         # Wait for the keys to show up from the ws
-        while not {'margin', 'position', 'order'} <= set(self.data):
+        while not {'margin', 'position', 'order'} <= self.snapshot.tables:
             sleep(0.1)
 
     def __wait_for_symbol(self, symbol):
         '''On subscribe, this data will come down. Wait for it.'''
-        while not {'instrument', 'trade', 'quote'} <= set(self.data):
+        while not {'instrument', 'trade', 'quote'} <= set(self.data) or self.snapshot.instrument is None:
             sleep(0.1)
+        if self.orderBookTable:
+            while symbol not in self.order_books:
+                sleep(0.1)
 
     def get_order_position_status(self, position_qty, order_side, order_price, order_size):
         self.logger.info("get_order_position_status(): position_qty={}, order_side={}, order_price={}, order_size={}".format(position_qty, order_side, order_price, order_size))
@@ -228,12 +407,27 @@ class BitMEXWebsocket():
 
     def __on_message(self, message):
         '''Handler for parsing WS messages.'''
-        message = json.loads(message)
-        self.logger.debug(json.dumps(message))
+        receivedAt = time.time()
+        if self.journal is not None:
+            self.journal.write(message, receivedAt)
+        self.logger.debug(message)
+        message = self.decoder.loads(message)
 
         table = message['table'] if 'table' in message else None
         action = message['action'] if 'action' in message else None
+        self.decoder.attribute(table or 'system')
+        exchangeTime = None
+        started = time.perf_counter()
+        # REST responses update the order table too; see apply_order_responses()
+        isOrderTable = table == 'order'
+        wake = table in BitMEXWebsocket.WAKEUP_TABLES
+        if isOrderTable:
+            self.orderLock.acquire()
         try:
+            # Rows carry the exchange timestamp; the last one is the most recent
+            if action and message.get('data'):
+                exchangeTime = timestamp_to_epoch(message['data'][-1].get('timestamp'))
+
             if 'subscribe' in message:
                 if message['success']:
                     self.logger.debug("Subscribed to %s." % message['subscribe'])
@@ -245,11 +439,12 @@ class BitMEXWebsocket():
                     log_error(self.logger, message['error'], True)
                 if message['status'] == 401:
                     log_error(self.logger, "API Key incorrect, please check and restart.", True)
+            elif action and table in ORDER_BOOK_TABLES:
+                self.__on_order_book(action, message['data'])
+            elif action and table in BitMEXWebsocket.RING_BUFFER_COLUMNS:
+                wake = self.__on_ring_buffer_table(table, action, message['data']) and wake
             elif action:
 
-                if table not in self.data:
-                    self.data[table] = []
-
                 if table not in self.keys:
                     self.keys[table] = []
 
@@ -259,91 +454,303 @@ class BitMEXWebsocket():
                 # 'update'  - update row
                 # 'delete'  - delete row
                 if action == 'partial':
-                    self.logger.debug("%s: partial" % table)
-                    self.data[table] += message['data']
+                    self.logger.debug("%s: partial", table)
                     # Keys are communicated on partials to let you know how to uniquely identify
-                    # an item. We use it for updates.
+                    # an item. We use it to index the table for updates.
                     self.keys[table] = message['keys']
+                    # A partial is a full image of its subscription; drop whatever we held of it
+                    # before a reconnect. Other subscriptions to the table (instrument:.BVOL24H) stay.
+                    self.__drop_rows(table, message.get('filter'))
+                    self.__ensure_table(table)
+                    self.__store_rows(table, self.__newer_order_states(table, message['data']))
                 elif action == 'insert':
-                    self.logger.debug('%s: inserting %s' % (table, message['data']))
-                    self.data[table] += message['data']
+                    self.logger.debug('%s: inserting %s', table, message['data'])
+                    self.__ensure_table(table)
+                    self.__store_rows(table, self.__newer_order_states(table, message['data']))
 
                     # Limit the max length of the table to avoid excessive memory usage.
                     # Don't trim orders because we'll lose valuable state if we do.
-                    if table not in ['order', 'orderBookL2'] and len(self.data[table]) > BitMEXWebsocket.MAX_TABLE_LEN:
-                        self.data[table] = self.data[table][(BitMEXWebsocket.MAX_TABLE_LEN // 2):]
+                    if table != 'order' and len(self.data[table]) > BitMEXWebsocket.MAX_TABLE_LEN:
+                        self.__trim_table(table, BitMEXWebsocket.MAX_TABLE_LEN // 2)
 
                 elif action == 'update':
-                    self.logger.debug('%s: updating %s' % (table, message['data']))
+                    self.logger.debug('%s: updating %s', table, message['data'])
+                    rows = self.data.get(table)
+                    if not isinstance(rows, dict):
+                        return  # No keyed image to update yet. Could happen before push
+
                     # Locate the item in the collection and update it.
+                    keys = self.keys[table]
                     for updateData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], updateData)
+                        itemKey = getItemKey(keys, updateData)
+                        item = rows.get(itemKey)
                         if not item:
                             continue  # No item found to update. Could happen before push
 
-                        # Log executions
                         if table == 'order':
+                            # A REST response may have brought a newer state already
+                            if updateData.get('timestamp') and updateData['timestamp'] < item.get('timestamp', ''):
+                                continue
+                            # Log executions
                             is_canceled = 'ordStatus' in updateData and updateData['ordStatus'] == 'Canceled'
                             if 'cumQty' in updateData and not is_canceled:
-                                position = self.position(self.symbol)
-                                curr_position = position['currentQty']
-                                order_size = updateData['cumQty'] - item['cumQty']
-                                order_side = item['side']
-                                symbol = item['symbol']
-                                order_price = item['price']
-                                order_position_status = self.get_order_position_status(curr_position, order_side, order_price, order_size)
-                                unrealisedPnl = position['unrealisedPnl']
-                                if order_position_status == ORDER_POSITION_STATUS_INCREASE:
-                                    log_info(self.logger, "Execution (position increase): {} {} contracts of {} at {}".format(order_side, order_size, symbol, order_price), True)
-                                elif order_position_status == ORDER_POSITION_STATUS_PARTIAL_CLOSE:
-                                    log_info(self.logger, "Execution (position partial close): {} {} contracts of {} at {}".format(order_side, order_size, symbol, order_price), True)
-                                elif order_position_status == ORDER_POSITION_STATUS_FULL_CLOSE:
-                                    log_info(self.logger, "Execution (position fully closed): {} {} contracts of {} at {}\nRealized PnL: {:.8f}".format(order_side, order_size, symbol, order_price, unrealisedPnl), True)
-
-                        # Update this item.
+                                self.__log_execution(item, updateData['cumQty'])
+
+                        # Update this item. Rows of snapshot tables are copied first, since
+                        # published snapshots may still reference the old one.
+                        if table in BitMEXWebsocket.SNAPSHOT_TABLES:
+                            item = rows[itemKey] = dict(item)
                         item.update(updateData)
 
                         # Remove canceled / filled orders
                         if table == 'order' and item['leavesQty'] <= 0:
-                            self.data[table].remove(item)
+                            self.__close_order(rows, itemKey, item)
 
                 elif action == 'delete':
-                    self.logger.debug('%s: deleting %s' % (table, message['data']))
+                    self.logger.debug('%s: deleting %s', table, message['data'])
+                    rows = self.data.get(table)
+                    if not isinstance(rows, dict):
+                        return
                     # Locate the item in the collection and remove it.
+                    keys = self.keys[table]
                     for deleteData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], deleteData)
-                        self.data[table].remove(item)
+                        rows.pop(getItemKey(keys, deleteData), None)
                 else:
                     raise Exception("Unknown action: %s" % action)
+
+                if table == 'instrument':
+                    self.__bump_instrument_versions(message['data'])
+                    if any(row.get('symbol') == self.symbol for row in message['data']):
+                        self.__publish_snapshot(table)
+                elif table in BitMEXWebsocket.SNAPSHOT_TABLES:
+                    self.__publish_snapshot(table)
+
+            if action == 'partial':
+                self.__on_partial(table)
+            if wake:
+                wakeup.notify(table)
         except:
             log_error(self.logger, traceback.format_exc(), True)
+        finally:
+            if isOrderTable:
+                self.orderLock.release()
+            self.latency.record(table or 'system', receivedAt, time.perf_counter() - started, exchangeTime)
+
+    def __on_order_book(self, action, rows):
+        '''Apply an orderBookL2 message to the local book instead of storing the raw rows.'''
+        if not rows:
+            return
+        symbol = rows[0]['symbol']
+        book = self.order_books.get(symbol)
+        if book is None:
+            if action != 'partial':
+                return  # Incremental data before the image. Could happen before push
+            book = self.order_books[symbol] = OrderBookL2(symbol)
+        book.apply(action, rows)
+
+    def __on_ring_buffer_table(self, table, action, rows):
+        '''Append trade/quote rows to the table's ring buffer. These tables only receive inserts.
+           Returns whether the best bid or ask price moved, for quotes.'''
+        buffer = self.data.get(table)
+        if buffer is None:
+            buffer = self.data[table] = RingBuffer(BitMEXWebsocket.RING_BUFFER_COLUMNS[table], BitMEXWebsocket.RING_BUFFER_LEN)
+        if action not in ('partial', 'insert'):
+            return False
+        previous = buffer.last()
+        # After a reconnect the partial repeats rows we already have; only append newer ones
+        last = previous if action == 'partial' else None
+        for row in rows:
+            row['timestamp'] = timestamp_to_epoch(row.get('timestamp'))
+            if last is not None and not row['timestamp'] > last['timestamp']:
+                continue
+            buffer.append(row)
+        if table != 'quote':
+            return False
+        latest = buffer.last()
+        return latest is not None and (previous is None or latest['bidPrice'] != previous['bidPrice'] or
+                                       latest['askPrice'] != previous['askPrice'])
+
+    def __newer_order_states(self, table, rows):
+        '''Drop order rows older than what we hold for the order, or than the state that closed it.'''
+        if table != 'order':
+            return rows
+        current = self.data.get('order')
+        keys = self.keys['order']
+        result = []
+        for row in rows:
+            timestamp = row.get('timestamp') or ''
+            closedAt = self.closedOrders.get(row.get('orderID'))
+            if closedAt is not None and timestamp <= closedAt:
+                continue
+            item = current.get(getItemKey(keys, row)) if isinstance(current, dict) else None
+            if item is not None and timestamp < item.get('timestamp', ''):
+                continue
+            result.append(row)
+        return result
+
+    def __close_order(self, rows, itemKey, item):
+        del rows[itemKey]
+        self.closedOrders[item['orderID']] = item.get('timestamp') or ''
+        while len(self.closedOrders) > BitMEXWebsocket.MAX_CLOSED_ORDERS:
+            self.closedOrders.popitem(last=False)
+
+    def __log_execution(self, item, cumQty):
+        order_size = cumQty - item['cumQty']
+        if order_size <= 0:
+            return
+        position = self.position(self.symbol)
+        curr_position = position['currentQty']
+        order_side = item['side']
+        symbol = item['symbol']
+        order_price = item['price']
+        order_position_status = self.get_order_position_status(curr_position, order_side, order_price, order_size)
+        unrealisedPnl = position['unrealisedPnl']
+        if order_position_status == ORDER_POSITION_STATUS_INCREASE:
+            log_info(self.logger, "Execution (position increase): {} {} contracts of {} at {}".format(order_side, order_size, symbol, order_price), True)
+        elif order_position_status == ORDER_POSITION_STATUS_PARTIAL_CLOSE:
+            log_info(self.logger, "Execution (position partial close): {} {} contracts of {} at {}".format(order_side, order_size, symbol, order_price), True)
+        elif order_position_status == ORDER_POSITION_STATUS_FULL_CLOSE:
+            log_info(self.logger, "Execution (position fully closed): {} {} contracts of {} at {}\nRealized PnL: {:.8f}".format(order_side, order_size, symbol, order_price, unrealisedPnl), True)
+
+    def __bump_instrument_versions(self, rows):
+        '''Invalidate the cached instrument/ticker of every symbol touched by an instrument message.'''
+        for row in rows:
+            symbol = row.get('symbol')
+            self.instrument_versions[symbol] = self.instrument_versions.get(symbol, 0) + 1
+
+    def __publish_snapshot(self, table):
+        '''Swap in a new snapshot with the given table refreshed. Values are converted here, once
+           per change, so readers can use them as is.'''
+        with self.snapshotLock:
+            snapshot = self.snapshot
+            if table == 'instrument':
+                # The ticker is derived from this copy by the reader, only when it is needed
+                changes = {'instrument': dict(self.get_instrument(self.symbol))}
+            else:
+                rows = self.data.get(table)
+                if not isinstance(rows, dict):
+                    return
+                if table == 'order':
+                    changes = {'orders': tuple(rows.values())}
+                elif table == 'position':
+                    changes = {'positions': tuple(self.__convert_position(pos) for pos in rows.values())}
+                else:
+                    margin = next(iter(rows.values()), None)
+                    changes = {'margin': self.__convert_margin(margin) if margin is not None else None}
+            self.snapshot = snapshot._replace(version=snapshot.version + 1, tables=snapshot.tables | {table},
+                                              **changes)
+
+    def __convert_position(self, pos):
+        pos = dict(pos)
+        pos["unrealisedPnl"] = XBt_to_XBT(pos["unrealisedPnl"])
+        if not pos["avgEntryPrice"]:
+            pos["avgEntryPrice"] = 0
+        return pos
+
+    def __convert_margin(self, margin):
+        margin = dict(margin)
+        margin["walletBalance"] = XBt_to_XBT(margin["walletBalance"])
+        margin["marginBalance"] = XBt_to_XBT(margin["marginBalance"])
+        return margin
+
+    def __ensure_table(self, table):
+        '''Create the store for a table: a dict indexed on the key tuple, or a list for keyless tables.'''
+        keys = self.keys[table]
+        rows = self.data.get(table)
+        if rows is None:
+            self.data[table] = {} if keys else []
+        elif keys and isinstance(rows, list):
+            # Keys came with a partial after some rows had already been inserted
+            self.data[table] = {getItemKey(keys, row): row for row in rows}
+
+    def __store_rows(self, table, newRows):
+        rows = self.data[table]
+        if isinstance(rows, list):
+            rows += newRows
+            return
+        keys = self.keys[table]
+        for row in newRows:
+            rows[getItemKey(keys, row)] = row
+
+    def __drop_rows(self, table, filter):
+        '''Remove the rows matching a partial's filter, or the whole table without one.'''
+        rows = self.data.get(table)
+        if not filter or rows is None:
+            self.data.pop(table, None)
+            return
+        matches = lambda row: all(row.get(field) == value for field, value in filter.items())
+        if isinstance(rows, list):
+            rows[:] = [row for row in rows if not matches(row)]
+        else:
+            for itemKey in [k for k, row in rows.items() if matches(row)]:
+                del rows[itemKey]
+
+    def __trim_table(self, table, count):
+        '''Drop the oldest `count` rows of a table.'''
+        rows = self.data[table]
+        if isinstance(rows, list):
+            del rows[:count]
+        else:
+            for itemKey in list(itertools.islice(rows, count)):
+                del rows[itemKey]
 
     def __on_open(self):
         self.logger.debug("Websocket Opened.")
 
     def __on_close(self):
+        # The websocket thread reconnects unless we are exiting
         self.logger.info('Websocket Closed')
-        self.exit()
+        self.synced.clear()
 
     def __on_error(self, error):
-        if not self.exited:
+        if self.exited:
+            return
+        if not self.synced.is_set() and not self.reconnect_count:
+            # Still on the initial connect; __connect gives up on this
             self.error(error)
+        else:
+            log_error(self.logger, "Websocket error: {}".format(error), True)
 
     def __reset(self):
         self.data = {}
         self.keys = {}
+        self.order_books = {}
+        self.orderBookTable = None
+        self.instrument_versions = {}
+        self.instrument_cache = {}
+        self.ticker_cache = {}
+        with self.snapshotLock:
+            self.snapshot = EMPTY_SNAPSHOT
+        # orderID -> timestamp of the state that closed it
+        self.closedOrders = collections.OrderedDict()
         self.exited = False
         self._error = None
 
 
-def findItemByKeys(keys, table, matchData):
-    for item in table:
-        matched = True
-        for key in keys:
-            if item[key] != matchData[key]:
-                matched = False
-        if matched:
-            return item
+def instrumentToTicker(instrument):
+    '''Build a ticker object from an instrument row.'''
+    # If this is an index, we have to get the data from the last trade.
+    if instrument['symbol'][0] == '.':
+        ticker = {}
+        ticker['mid'] = ticker['buy'] = ticker['sell'] = ticker['last'] = instrument['markPrice']
+    # Normal instrument
+    else:
+        bid = instrument['bidPrice'] or instrument['lastPrice']
+        ask = instrument['askPrice'] or instrument['lastPrice']
+        ticker = {
+            "last": instrument['lastPrice'],
+            "buy": bid,
+            "sell": ask,
+            "mid": (bid + ask) / 2
+        }
+
+    # The instrument has a tickSize. Use it to round values.
+    return {k: toNearest(float(v or 0), instrument['tickSize']) for k, v in iteritems(ticker)}
+
+
+def getItemKey(keys, item):
+    '''Build the index key of a table row from its key fields.'''
+    return tuple(item[key] for key in keys)
 
 if __name__ == "__main__":
     # create console handler and set level to debug
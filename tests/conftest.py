@@ -0,0 +1,138 @@
+"""
+Shared test setup. The robot loads its settings from the database when
+market_maker.settings is imported, so the tests install an in-memory settings
+module instead and never need a database or command line arguments.
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from market_maker.utils.bitmex.dotdict import dotdict
+
+TEST_SETTINGS = {
+    'ENV': 'test',
+    'EXCHANGE': 'bitmex',
+    'ROBOTID': 'TEST',
+    'INSTANCEID': 'TEST',
+    'SYMBOL': 'XBTUSD',
+    'LOG_LEVEL': 'INFO',
+    'LOG_FILENAME': 'test.log',
+    'LOG_TO_TELEGRAM': False,
+    'TIMEOUT': 7,
+    'LOOP_INTERVAL': 5,
+    'FORCE_RESTART_EXIT_STATUS_CODE': 1,
+    'FORCE_STOP_EXIT_STATUS_CODE': 0,
+    'APIKEY': 'test-key',
+    'SECRET': 'test-secret'
+}
+
+settings = dotdict(TEST_SETTINGS)
+_settings_module = types.ModuleType('market_maker.settings')
+_settings_module.settings = settings
+sys.modules['market_maker.settings'] = _settings_module
+
+# The database package isn't needed by the code under test, only imported by it
+if importlib.util.find_spec('market_maker.db') is None:
+    _db_module = types.ModuleType('market_maker.db')
+    _db_module.__path__ = []
+    _db_manager_module = types.ModuleType('market_maker.db.db_manager')
+    _db_manager_module.DatabaseManager = None
+    sys.modules['market_maker.db'] = _db_module
+    sys.modules['market_maker.db.db_manager'] = _db_manager_module
+
+from market_maker.utils import log
+log.LOG_TO_CONSOLE = True
+
+
+@pytest.fixture
+def bitmex_simulator():
+    """A SimulatedBitMEX served on a free local port, with the settings pointing at it."""
+    from market_maker.simulator.bitmex_simulator import SimulatedBitMEX, start, API_PREFIX
+    from market_maker.simulator.market_feed import RandomWalkFeed
+
+    feed = RandomWalkFeed(10000, 0.5, interval=0.05, seed=1)
+    simulator = SimulatedBitMEX('XBTUSD', 0.5, feed, rate_limit=600)
+    server = start(simulator, port=0)
+    settings.BITMEX_BASE_URL = 'http://127.0.0.1:%d%s' % (server.server_address[1], API_PREFIX)
+    # Let the feed publish a first quote
+    deadline = time.time() + 5
+    while simulator.quote is None and time.time() < deadline:
+        time.sleep(0.01)
+    yield simulator
+    simulator.stopped.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def bitmex_client(bitmex_simulator):
+    from market_maker.bitmex import BitMEX
+
+    client = BitMEX(symbol='XBTUSD', orderIDPrefix='mm_test_')
+    yield client
+    client.exit()
+
+
+class HTTPStub(object):
+    """Local HTTP server answering with the queued responses in order, then 200 with `default`."""
+
+    def __init__(self, default=None):
+        self.default = default if default is not None else []
+        self.responses = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                stub.requests.append((self.command, self.path, self.rfile.read(length).decode('utf8')))
+                status, body, headers, delay = stub.responses.pop(0) if stub.responses else (200, stub.default, {}, 0)
+                time.sleep(delay)
+                data = json.dumps(body).encode('utf8')
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, str(value))
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up waiting
+                    pass
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_request
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def respond(self, status, body=None, headers=None, delay=0):
+        self.responses.append((status, body if body is not None else {}, headers or {}, delay))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def http_stub():
+    stub = HTTPStub()
+    yield stub
+    stub.close()
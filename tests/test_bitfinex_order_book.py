@@ -0,0 +1,65 @@
+"""
+Bitfinex order book checksums
+"""
+
+import random
+import zlib
+
+from market_maker.models.bitfinex.order_book import OrderBook, CHECKSUM_DEPTH
+from market_maker.utils.json_decoder import JsonDecoder
+
+
+def text(value):
+    return getattr(value, 'raw', None) or str(value)
+
+
+def fresh_checksum(book):
+    """The checksum as the exchange computes it, from the exact text of the top levels."""
+    data = []
+    for index in range(CHECKSUM_DEPTH):
+        for side in (book.get_bids(), book.get_asks()):
+            if index < len(side):
+                # The amount is the last field of trading and funding levels alike
+                data += [text(side[index][0]), text(side[index][-1])]
+    return zlib.crc32(':'.join(data).encode('utf8')) & 0xffffffff
+
+
+def test_checksum_uses_the_numbers_as_sent():
+    decoder = JsonDecoder()
+    book = OrderBook()
+    book.update_from_snapshot(decoder.loads_raw('[[9000.10, 2, 1.50], [9001.0, 1, -0.250]]'))
+    assert book.checksum() == zlib.crc32(b'9000.10:1.50:9001.0:-0.250') & 0xffffffff
+
+
+def test_update_below_the_checksum_depth_keeps_the_cached_checksum():
+    book = OrderBook()
+    book.update_from_snapshot([[float(9000 - i), 1, 1.0] for i in range(CHECKSUM_DEPTH + 5)])
+    checksum = book.checksum()
+    book.update_with([float(9000 - CHECKSUM_DEPTH - 1), 3, 2.0])
+    assert book._checksum == checksum
+    book.update_with([9000.0, 0, 1.0])
+    assert book._checksum is None
+    assert book.checksum() == fresh_checksum(book)
+
+
+def test_cached_checksum_matches_a_fresh_one_after_random_updates():
+    rng = random.Random(5)
+    decoder = JsonDecoder()
+    for funding in (False, True):
+        book = OrderBook()
+        snapshot = [[9000 - i * 0.5, 1, 1.5] for i in range(40)] + [[9001 + i * 0.5, 1, -1.5] for i in range(40)]
+        if funding:
+            snapshot = [[price / 1e6, 30, count, -amount] for price, count, amount in snapshot]
+        book.update_from_snapshot(decoder.loads_raw(repr(snapshot)))
+        for _ in range(3000):
+            bid = rng.random() < 0.5
+            price = 9000 - rng.randint(0, 60) * 0.5 if bid else 9001 + rng.randint(0, 60) * 0.5
+            count = rng.choice([0, 0, 1, 2])
+            amount = rng.choice(['1.5', '0.10', '2'])
+            amount = amount if bid else '-' + amount
+            if funding:
+                frame = '[%r, 30, %d, %s]' % (price / 1e6, count, amount[1:] if amount[0] == '-' else '-' + amount)
+            else:
+                frame = '[%r, %d, %s]' % (price, count, amount)
+            book.update_with(decoder.loads_raw(frame))
+            assert book.checksum() == fresh_checksum(book)
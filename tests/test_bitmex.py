@@ -0,0 +1,78 @@
+"""
+BitMEX connector against the local simulator
+"""
+
+
+def place_orders(client):
+    client.refresh_snapshot()
+    ticker = client.ticker_data()
+    return client.create_bulk_orders([
+        {'price': ticker['buy'] - 100, 'orderQty': 100, 'side': 'Buy'},
+        {'price': ticker['sell'] + 100, 'orderQty': 100, 'side': 'Sell'}
+    ])
+
+
+def test_open_orders_after_cancel_all_in_the_same_tick(bitmex_client):
+    place_orders(bitmex_client)
+    bitmex_client.refresh_snapshot()
+    assert len(bitmex_client.open_orders()) == 2
+
+    bitmex_client.cancel_all_orders()
+
+    # No refresh_snapshot() in between: the pinned snapshot must not hold the cancelled orders
+    assert bitmex_client.open_orders() == []
+
+
+def test_open_orders_after_cancel_and_create_in_the_same_tick(bitmex_client):
+    created = place_orders(bitmex_client)
+    bitmex_client.refresh_snapshot()
+
+    bitmex_client.cancel_orders([created[0]])
+    assert [o['orderID'] for o in bitmex_client.open_orders()] == [created[1]['orderID']]
+
+    more = place_orders(bitmex_client)
+    assert {o['orderID'] for o in bitmex_client.open_orders()} == {created[1]['orderID']} | {o['orderID'] for o in more}
+
+
+def test_only_exit_disarms_the_dead_mans_switch(bitmex_simulator):
+    from market_maker.bitmex import BitMEX
+
+    client = BitMEX(symbol='XBTUSD', orderIDPrefix='mm_test_', cancelAllAfter=60)
+    armed = []
+    client.dead_mans_switch.arm = armed.append
+    client.__del__()
+    assert armed == []
+
+    client = BitMEX(symbol='XBTUSD', orderIDPrefix='mm_test_', cancelAllAfter=60)
+    client.dead_mans_switch.arm = armed.append
+    client.exit()
+    assert armed == [0]
+
+
+def test_orders_sent_from_other_threads_dont_repin_the_snapshot(bitmex_client):
+    from market_maker.order_dispatcher import OrderActionDispatcher
+
+    bitmex_client.refresh_snapshot()
+    snapshot = bitmex_client.snapshot
+    ticker = bitmex_client.ticker_data()
+    OrderActionDispatcher(bitmex_client).dispatch([], [{'price': ticker['buy'] - 100, 'orderQty': 100, 'side': 'Buy'}], [])
+    assert bitmex_client.snapshot is snapshot
+
+    # dispatch_order_actions re-pins on the calling thread once the batches are done
+    bitmex_client.refresh_snapshot()
+    assert len(bitmex_client.open_orders()) == 1
+
+
+def test_cancel_all_orders_leaves_other_robots_orders(bitmex_client):
+    from market_maker.bitmex import BitMEX
+
+    other = BitMEX(symbol='XBTUSD', orderIDPrefix='mm_other_')
+    try:
+        place_orders(other)
+        place_orders(bitmex_client)
+        bitmex_client.cancel_all_orders()
+        assert bitmex_client.http_open_orders() == []
+        assert len(other.http_open_orders()) == 2
+    finally:
+        other.cancel_all_orders()
+        other.exit()
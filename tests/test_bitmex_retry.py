@@ -0,0 +1,89 @@
+"""
+BitMEX REST retries against a local HTTP stub
+"""
+
+import json
+import time
+
+import pytest
+
+from market_maker.utils.retry import RetriesExhaustedError
+
+
+@pytest.fixture
+def stubbed_client(bitmex_client, http_stub):
+    """The BitMEX client with its REST requests sent to the stub instead of the simulator."""
+    bitmex_client.base_url = http_stub.url
+    return bitmex_client
+
+
+def order(clOrdID=None):
+    posted = {'symbol': 'XBTUSD', 'side': 'Buy', 'orderQty': 100, 'price': 9000.0}
+    if clOrdID:
+        posted['clOrdID'] = clOrdID
+    return posted
+
+
+def test_503_is_retried(stubbed_client, http_stub):
+    http_stub.respond(503)
+    http_stub.default = [{'symbol': 'XBTUSD'}]
+
+    assert stubbed_client._curl_bitmex('instrument', verb='GET') == [{'symbol': 'XBTUSD'}]
+    assert len(http_stub.requests) == 2
+    assert stubbed_client.get_rest_stats()['endpoints']['GET instrument']['retries'] == 1
+
+
+def test_429_waits_for_the_rate_limit_reset(stubbed_client, http_stub):
+    http_stub.respond(429, {'error': {'message': 'Rate limit exceeded'}},
+                      {'X-RateLimit-Reset': int(time.time()) + 2, 'X-RateLimit-Remaining': 0, 'X-RateLimit-Limit': 60})
+    http_stub.default = []
+
+    # A cancel, so the limiter doesn't keep holding it for its reserve after the reset
+    started = time.time()
+    assert stubbed_client._curl_bitmex('order/all', postdict={'symbol': 'XBTUSD'}, verb='DELETE') == []
+    assert time.time() - started >= 1
+    assert len(http_stub.requests) == 2
+
+
+def test_create_without_clordid_is_not_resent_after_a_timeout(stubbed_client, http_stub):
+    http_stub.respond(200, [order()], delay=1)
+
+    with pytest.raises(RetriesExhaustedError):
+        stubbed_client._curl_bitmex('order/bulk', postdict={'orders': [order()]}, verb='POST', timeout=0.2)
+    time.sleep(0.3)
+    assert len(http_stub.requests) == 1
+
+
+def test_create_resent_after_a_timeout_recovers_from_a_duplicate_clordid(stubbed_client, http_stub):
+    created = dict(order('mm_test_1'), orderID='1', ordStatus='New')
+    http_stub.respond(200, [created], delay=1)
+    http_stub.respond(400, {'error': {'message': 'Duplicate clOrdID', 'name': 'HTTPError'}})
+    http_stub.respond(200, [created])
+
+    result = stubbed_client._curl_bitmex('order/bulk', postdict={'orders': [order('mm_test_1')]}, verb='POST',
+                                         timeout=0.2)
+    assert result == [created]
+    assert [(verb, path.split('?')[0]) for verb, path, body in http_stub.requests] == [
+        ('POST', '/order/bulk'), ('POST', '/order/bulk'), ('GET', '/order')]
+    assert json.loads(http_stub.requests[1][2]) == {'orders': [order('mm_test_1')]}
+
+
+def test_duplicate_clordid_of_a_different_order_is_an_error(stubbed_client, http_stub):
+    http_stub.respond(400, {'error': {'message': 'Duplicate clOrdID', 'name': 'HTTPError'}})
+    http_stub.respond(200, [dict(order('mm_test_1'), price=9500.0, orderID='1')])
+
+    with pytest.raises(Exception, match='did not match POST'):
+        stubbed_client._curl_bitmex('order/bulk', postdict={'orders': [order('mm_test_1')]}, verb='POST')
+
+
+def test_create_rate_limited_past_its_deadline_is_left_to_the_next_tick(stubbed_client, http_stub):
+    from market_maker.order_dispatcher import OrderActionDispatcher
+
+    http_stub.respond(429, {'error': {'message': 'Rate limit exceeded'}},
+                      {'X-RateLimit-Reset': int(time.time()) + 30, 'X-RateLimit-Remaining': 0, 'X-RateLimit-Limit': 60})
+
+    batches = OrderActionDispatcher(stubbed_client).dispatch([], [order()], [])
+    assert isinstance(batches[0].error, RetriesExhaustedError)
+    assert len(http_stub.requests) == 1
+    # Whatever the next tick sends waits for the reset
+    assert stubbed_client.rate_limiter.blocked_until >= time.time() + 20
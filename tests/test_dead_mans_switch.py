@@ -0,0 +1,40 @@
+"""
+DeadMansSwitch heartbeats
+"""
+
+import logging
+import time
+
+from market_maker.utils.dead_mans_switch import DeadMansSwitch
+
+
+def test_heartbeats_rearm_until_stopped():
+    armed = []
+    switch = DeadMansSwitch(armed.append, 60, logging.getLogger('root'), interval=0.01)
+    switch.start()
+    time.sleep(0.1)
+    switch.stop()
+    count = len(armed)
+    time.sleep(0.05)
+    assert len(armed) == count
+    assert armed[-1] == 0
+    assert set(armed[:-1]) == {60} and count > 2
+
+
+def test_stop_without_disarming():
+    armed = []
+    switch = DeadMansSwitch(armed.append, 60, logging.getLogger('root'), interval=10)
+    switch.start()
+    switch.stop(disarm=False)
+    switch.stop()
+    assert armed == [60]
+
+
+def test_failed_heartbeats_are_counted():
+    def arm(timeout):
+        raise IOError('down')
+
+    switch = DeadMansSwitch(arm, 60, logging.getLogger('root'), interval=10)
+    switch.beat()
+    switch.beat()
+    assert switch.failures == 2
@@ -0,0 +1,95 @@
+"""
+EventDispatcher listeners on an asyncio loop
+"""
+
+import asyncio
+
+from market_maker.ws.bitfinex.event_dispatcher import EventDispatcher
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_slow_listener_does_not_hold_up_later_events():
+    events = EventDispatcher()
+    done = []
+
+    @events.on('book')
+    async def on_book(name, delay):
+        await asyncio.sleep(delay)
+        done.append(name)
+
+    async def main():
+        events.emit('book', 'slow', 0.2)
+        events.emit('book', 'fast', 0)
+        await asyncio.sleep(0.05)
+        assert done == ['fast']
+        await asyncio.sleep(0.3)
+
+    run(main())
+    assert done == ['fast', 'slow']
+    stats = events.get_stats()
+    assert stats['events']['book']['count'] == 2
+    assert stats['events']['book']['queueDelay']['count'] == 2
+    assert stats['pending'] == 0
+
+
+def test_listener_exception_is_logged_and_counted(caplog):
+    events = EventDispatcher()
+    handled = []
+
+    @events.on('order')
+    async def on_order():
+        raise ValueError('boom')
+
+    async def main():
+        asyncio.get_event_loop().set_exception_handler(lambda loop, context: handled.append(context))
+        events.emit('order')
+        await asyncio.sleep(0.01)
+
+    run(main())
+    assert handled == []
+    assert events.get_stats()['events']['order']['errors'] == 1
+    assert 'boom' in caplog.text
+
+
+def test_listener_exception_is_emitted_as_error_event():
+    events = EventDispatcher()
+    errors = []
+    events.on('error', errors.append)
+
+    @events.on('order')
+    async def on_order():
+        raise ValueError('boom')
+
+    async def main():
+        events.emit('order')
+        await asyncio.sleep(0.01)
+
+    run(main())
+    assert [str(e) for e in errors] == ['boom']
+
+
+def test_listeners_beyond_max_pending_are_dropped():
+    events = EventDispatcher(max_pending=2)
+    done = []
+
+    @events.on('trade')
+    async def on_trade(i):
+        await asyncio.sleep(0.01)
+        done.append(i)
+
+    async def main():
+        for i in range(5):
+            events.emit('trade', i)
+        await asyncio.sleep(0.05)
+
+    run(main())
+    assert sorted(done) == [0, 1]
+    assert events.overflows == 3
+    assert events.get_stats()['events']['trade']['dropped'] == 3
@@ -0,0 +1,28 @@
+"""
+Shared websocket event loop
+"""
+
+from market_maker.ws.bitfinex.event_loop import EventLoopThread, get_shared_event_loop
+from market_maker.ws.bitfinex.generic_websocket import GenericWebsocket, handle_loop_exception
+
+
+def test_websockets_share_the_loop_and_its_exception_handler():
+    own_loop = EventLoopThread(exception_handler=lambda loop, context: None)
+    own_handler = own_loop.loop.get_exception_handler()
+    first = GenericWebsocket('ws://127.0.0.1')
+    GenericWebsocket('ws://127.0.0.1', event_loop=own_loop)
+    second = GenericWebsocket('ws://127.0.0.1')
+    assert first.event_loop is second.event_loop is get_shared_event_loop()
+    assert first.event_loop.loop.get_exception_handler() is handle_loop_exception
+    assert own_loop.loop.get_exception_handler() is own_handler
+
+
+def test_loop_thread_is_a_daemon():
+    event_loop = EventLoopThread()
+    assert event_loop.submit(_answer()).result(timeout=5) == 42
+    assert event_loop.thread.daemon
+    event_loop.call_soon(event_loop.loop.stop)
+
+
+async def _answer():
+    return 42
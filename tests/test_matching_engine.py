@@ -0,0 +1,78 @@
+"""
+MatchingEngine price-time priority and amends
+"""
+
+import pytest
+
+from market_maker.simulator.matching_engine import MatchingEngine, EngineError, POST_ONLY
+
+
+def order(orderID, side, qty, price, execInst=None):
+    return {'orderID': orderID, 'side': side, 'orderQty': qty, 'price': price, 'execInst': execInst}
+
+
+@pytest.fixture
+def engine():
+    return MatchingEngine('XBTUSD')
+
+
+def test_fills_best_price_then_oldest_order_at_the_resting_price(engine):
+    engine.submit(order('a1', 'Sell', 100, 101))
+    engine.submit(order('a2', 'Sell', 100, 100))
+    engine.submit(order('a3', 'Sell', 100, 100))
+    fills = engine.submit(order('b1', 'Buy', 150, 101))
+    assert [(f.order['orderID'], f.qty, f.price) for f in fills if f.is_maker] == [('a2', 100, 100), ('a3', 50, 100)]
+    assert engine.orders['b1']['ordStatus'] == 'Filled'
+    assert engine.orders['b1']['avgPx'] == 100
+    assert engine.orders['a3']['ordStatus'] == 'PartiallyFilled'
+    assert engine.depth(2) == ([], [(100, 50), (101, 100)])
+
+
+def test_post_only_order_that_would_cross_is_canceled(engine):
+    engine.submit(order('a1', 'Sell', 100, 100))
+    assert engine.submit(order('b1', 'Buy', 100, 100, POST_ONLY)) == []
+    assert engine.orders['b1']['ordStatus'] == 'Canceled'
+    assert engine.best_bid() is None
+
+
+def test_lowering_the_quantity_keeps_the_queue_position(engine):
+    engine.submit(order('b1', 'Buy', 100, 100))
+    engine.submit(order('b2', 'Buy', 100, 100))
+    engine.amend('b1', orderQty=50)
+    fills = engine.submit(order('a1', 'Sell', 50, 100))
+    assert [f.order['orderID'] for f in fills if f.is_maker] == ['b1']
+
+
+def test_amend_that_crosses_trades(engine):
+    engine.submit(order('a1', 'Sell', 100, 101))
+    engine.submit(order('b1', 'Buy', 100, 100))
+    fills = engine.amend('b1', price=101)
+    assert [(f.order['orderID'], f.qty) for f in fills] == [('a1', 100), ('b1', 100)]
+    assert engine.orders['b1']['ordStatus'] == 'Filled'
+
+
+def test_amend_down_to_the_filled_quantity_fills_the_order(engine):
+    engine.submit(order('b1', 'Buy', 100, 100))
+    engine.submit(order('a1', 'Sell', 40, 100))
+    engine.amend('b1', orderQty=40)
+    b1 = engine.orders['b1']
+    assert (b1['ordStatus'], b1['orderQty'], b1['cumQty'], b1['leavesQty']) == ('Filled', 40, 40, 0)
+    assert engine.best_bid() is None
+
+
+def test_amend_to_zero_cancels_an_unfilled_order(engine):
+    engine.submit(order('b1', 'Buy', 100, 100))
+    engine.amend('b1', orderQty=0)
+    assert engine.orders['b1']['ordStatus'] == 'Canceled'
+    assert engine.open_orders() == []
+
+
+def test_amend_of_a_forgotten_order_fails_on_its_status(engine):
+    engine.submit(order('b1', 'Buy', 100, 100))
+    engine.cancel('b1')
+    engine.forget_terminated(0)
+    assert 'b1' not in engine.orders
+    with pytest.raises(EngineError, match='Invalid ordStatus'):
+        engine.amend('b1', orderQty=50)
+    with pytest.raises(EngineError, match='Invalid orderID'):
+        engine.amend('unknown', orderQty=50)
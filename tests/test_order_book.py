@@ -0,0 +1,104 @@
+"""
+BitMEX L2 order book against a plain dict of levels
+"""
+
+import random
+
+import pytest
+
+from market_maker.models.bitmex.order_book import OrderBookL2
+
+
+def level(id, side, price=None, size=None):
+    row = {'symbol': 'XBTUSD', 'id': id, 'side': side}
+    if price is not None:
+        row['price'] = price
+    if size is not None:
+        row['size'] = size
+    return row
+
+
+def expected_side(levels, side):
+    rows = sorted(((price, size) for s, price, size in levels.values() if s == side), reverse=side == 'Buy')
+    return [price for price, size in rows], [size for price, size in rows]
+
+
+def test_partial_then_incremental_updates():
+    book = OrderBookL2('XBTUSD')
+    book.apply('partial', [level(1, 'Sell', 101.0, 10), level(2, 'Buy', 99.0, 20), level(3, 'Buy', 100.0, 30)])
+    assert book.best_bid() == (100.0, 30)
+    assert book.best_ask() == (101.0, 10)
+
+    book.apply('insert', [level(4, 'Sell', 100.5, 5)])
+    book.apply('update', [level(3, 'Buy', size=35)])
+    book.apply('delete', [level(2, 'Buy')])
+    depth = book.depth(5)
+    assert list(depth['bidPrices']) == [100.0] and list(depth['bidSizes']) == [35]
+    assert list(depth['askPrices']) == [100.5, 101.0] and list(depth['askSizes']) == [5, 10]
+
+
+def test_incremental_updates_before_the_partial_are_ignored():
+    book = OrderBookL2('XBTUSD')
+    book.apply('insert', [level(1, 'Buy', 100.0, 10)])
+    assert book.best_bid() is None
+    assert not book.is_initialized
+
+
+def test_top_levels_are_copies():
+    book = OrderBookL2('XBTUSD')
+    book.apply('partial', [level(1, 'Buy', 100.0, 10)])
+    prices, sizes = book.top_bids(1)
+    # A lower bid shifts the existing level along the arrays; what we read must not move with it
+    book.apply('insert', [level(2, 'Buy', 99.5, 20)])
+    assert list(prices) == [100.0] and list(sizes) == [10]
+
+
+def test_insert_of_a_known_id_at_another_price_moves_the_level():
+    book = OrderBookL2('XBTUSD')
+    book.apply('partial', [level(1, 'Buy', 100.0, 10), level(2, 'Sell', 101.0, 10)])
+    book.apply('insert', [level(1, 'Buy', 99.5, 15)])
+    assert list(book.depth(5)['bidPrices']) == [99.5]
+    book.apply('delete', [level(1, 'Buy')])
+    assert book.best_bid() is None
+
+
+def test_random_updates_match_a_dict_of_levels():
+    rng = random.Random(7)
+    book = OrderBookL2('XBTUSD')
+    levels = {}
+    partial = []
+    for id in range(50):
+        side = 'Buy' if id % 2 else 'Sell'
+        price = (9000.0 - id) if side == 'Buy' else (9001.0 + id)
+        levels[id] = (side, price, rng.randint(1, 1000))
+        partial.append(level(id, side, price, levels[id][2]))
+    book.apply('partial', partial)
+
+    next_id = 50
+    for _ in range(2000):
+        # More inserts than deletes, so the sides outgrow their initial capacity
+        action = rng.choice(['insert', 'insert', 'update', 'delete'])
+        if action == 'insert' or not levels:
+            side = rng.choice(['Buy', 'Sell'])
+            price = 9000.0 - rng.randint(0, 300) * 0.5 if side == 'Buy' else 9001.0 + rng.randint(0, 300) * 0.5
+            if price in {p for s, p, size in levels.values()}:
+                continue
+            levels[next_id] = (side, price, rng.randint(1, 1000))
+            book.apply('insert', [level(next_id, side, price, levels[next_id][2])])
+            next_id += 1
+        elif action == 'update':
+            id = rng.choice(list(levels))
+            side, price, size = levels[id]
+            levels[id] = (side, price, rng.randint(1, 1000))
+            book.apply('update', [level(id, side, size=levels[id][2])])
+        else:
+            id = rng.choice(list(levels))
+            side = levels.pop(id)[0]
+            book.apply('delete', [level(id, side)])
+
+    assert len(book.bids) > 64 and len(book.asks) > 64
+    for side, top in (('Buy', book.top_bids), ('Sell', book.top_asks)):
+        prices, sizes = expected_side(levels, side)
+        book_prices, book_sizes = top(len(prices) + 10)
+        assert list(book_prices) == prices
+        assert list(book_sizes) == sizes
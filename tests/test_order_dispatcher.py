@@ -0,0 +1,99 @@
+"""
+OrderActionDispatcher ordering and failure handling
+"""
+
+import threading
+import time
+
+import pytest
+
+from market_maker.order_dispatcher import OrderActionDispatcher, ACTION_AMEND, ACTION_CANCEL, ACTION_CREATE
+from market_maker.utils.retry import RetriesExhaustedError
+
+
+class RecordingExchange(object):
+    """Records when each batch started and finished; every call takes `delay` seconds."""
+
+    def __init__(self, delay=0.05, fail=(), error=ValueError):
+        self.delay = delay
+        self.fail = fail
+        self.error = error
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _call(self, action, orders):
+        started = time.time()
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls[action] = (started, time.time())
+        if action in self.fail:
+            raise self.error("%s failed" % action)
+        return orders
+
+    def cancel_orders(self, orders):
+        return self._call(ACTION_CANCEL, orders)
+
+    def amend_bulk_orders(self, orders):
+        return self._call(ACTION_AMEND, orders)
+
+    def create_bulk_orders(self, orders):
+        return self._call(ACTION_CREATE, orders)
+
+
+def order(side, price, orderID=None):
+    return {'orderID': orderID, 'side': side, 'price': price, 'orderQty': 100}
+
+
+@pytest.fixture
+def exchange():
+    return RecordingExchange()
+
+
+def test_batches_that_dont_cross_go_out_together(exchange):
+    dispatcher = OrderActionDispatcher(exchange)
+    dispatcher.dispatch([], [order('Buy', 100)], [order('Sell', 110, 'a')])
+    cancel, create = exchange.calls[ACTION_CANCEL], exchange.calls[ACTION_CREATE]
+    assert create[0] < cancel[1] and cancel[0] < create[1]
+
+
+def test_create_crossing_a_cancelled_order_waits_for_the_cancel(exchange):
+    dispatcher = OrderActionDispatcher(exchange)
+    dispatcher.dispatch([], [order('Buy', 110)], [order('Sell', 105, 'a')])
+    assert exchange.calls[ACTION_CREATE][0] >= exchange.calls[ACTION_CANCEL][1]
+
+
+def test_sequential_creates_wait_for_the_cancels(exchange):
+    dispatcher = OrderActionDispatcher(exchange)
+    dispatcher.dispatch([], [order('Buy', 100)], [order('Sell', 110, 'a')], sequential=True)
+    assert exchange.calls[ACTION_CREATE][0] >= exchange.calls[ACTION_CANCEL][1]
+
+
+def test_failed_cancel_skips_the_creates_depending_on_it():
+    exchange = RecordingExchange(fail=(ACTION_CANCEL,))
+    dispatcher = OrderActionDispatcher(exchange)
+    with pytest.raises(ValueError):
+        dispatcher.dispatch([], [order('Buy', 100)], [order('Sell', 110, 'a')], sequential=True)
+    assert ACTION_CREATE not in exchange.calls
+
+
+def test_creates_and_amends_out_of_retries_are_left_to_the_next_tick():
+    exchange = RecordingExchange(fail=(ACTION_AMEND, ACTION_CREATE), error=RetriesExhaustedError)
+    dispatcher = OrderActionDispatcher(exchange)
+    batches = dispatcher.dispatch([order('Buy', 99, 'b')], [order('Buy', 100)], [order('Sell', 110, 'a')])
+    failed = {b.action: b.error for b in batches}
+    assert isinstance(failed[ACTION_AMEND], RetriesExhaustedError)
+    assert isinstance(failed[ACTION_CREATE], RetriesExhaustedError)
+    assert failed[ACTION_CANCEL] is None
+
+
+def test_latency_stats_from_concurrent_batches():
+    dispatcher = OrderActionDispatcher(RecordingExchange(delay=0), max_workers=8)
+    threads = [threading.Thread(target=dispatcher.dispatch, args=([], [order('Buy', 100)], [order('Sell', 110, 'a')]))
+               for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = dispatcher.get_stats()
+    assert stats[ACTION_CANCEL]['count'] == 20
+    assert stats[ACTION_CREATE]['count'] == 20
@@ -0,0 +1,72 @@
+"""
+Matching existing orders with the desired grid
+"""
+
+import itertools
+import random
+
+from market_maker.strategies.order_matcher import match_orders
+
+
+def needs_amend(existing, desired):
+    return existing['price'] != desired['price'] or existing['orderQty'] != desired['orderQty']
+
+
+def order(side, price, qty=100, orderID=None):
+    return {'side': side, 'price': price, 'orderQty': qty, 'orderID': orderID}
+
+
+def prices(pairs):
+    return [(e['price'], d['price']) for e, d in pairs]
+
+
+def test_grid_shifted_by_one_level_moves_a_single_order():
+    existing = [order('Buy', p, orderID=str(p)) for p in (100, 99, 98)]
+    desired = [order('Buy', p) for p in (101, 100, 99)]
+    match = match_orders(existing, desired, [], needs_amend)
+    assert prices(match.kept) == [(100, 100), (99, 99)]
+    assert prices(match.to_amend) == [(98, 101)]
+    assert match.to_create == [] and match.to_cancel == []
+    assert (match.actions, match.positional_actions, match.saved_actions) == (1, 3, 2)
+
+
+def test_leftover_orders_farthest_from_the_desired_prices_are_cancelled():
+    existing = [order('Sell', p, orderID=str(p)) for p in (110, 111, 120)]
+    desired = [order('Sell', 111, qty=50)]
+    match = match_orders(existing, [], desired, needs_amend)
+    assert prices(match.to_amend) == [(111, 111)]
+    assert sorted(o['price'] for o in match.to_cancel) == [110, 120]
+
+
+def test_sides_are_matched_separately():
+    existing = [order('Buy', 100, orderID='b'), order('Sell', 101, orderID='s')]
+    match = match_orders(existing, [order('Buy', 101)], [order('Sell', 100)], needs_amend)
+    assert [(e['side'], d['side']) for e, d in match.to_amend] == [('Buy', 'Buy'), ('Sell', 'Sell')]
+
+
+def fewest_actions(existing, desired):
+    """Brute force over every way of pairing the orders."""
+    best = len(existing) + len(desired)
+    for pairs in range(min(len(existing), len(desired)) + 1):
+        for chosen in itertools.permutations(range(len(existing)), pairs):
+            for targets in itertools.combinations(range(len(desired)), pairs):
+                amends = sum(1 for i, j in zip(chosen, targets) if needs_amend(existing[i], desired[j]))
+                best = min(best, amends + len(existing) + len(desired) - 2 * pairs)
+    return best
+
+
+def test_random_grids_take_the_fewest_actions():
+    rng = random.Random(3)
+    for _ in range(300):
+        existing = [order('Buy', rng.randint(95, 100), rng.choice([50, 100]), orderID=str(i))
+                    for i in range(rng.randint(0, 4))]
+        desired = [order('Buy', rng.randint(95, 100), rng.choice([50, 100])) for _ in range(rng.randint(0, 4))]
+        match = match_orders(existing, desired, [], needs_amend)
+
+        assert all(not needs_amend(e, d) for e, d in match.kept)
+        used_existing = [e for e, d in match.kept + match.to_amend] + match.to_cancel
+        used_desired = [d for e, d in match.kept + match.to_amend] + match.to_create
+        assert sorted(map(id, used_existing)) == sorted(map(id, existing))
+        assert sorted(map(id, used_desired)) == sorted(map(id, desired))
+        assert match.actions == fewest_actions(existing, desired)
+        assert match.actions <= match.positional_actions
@@ -0,0 +1,40 @@
+"""
+Bitfinex AsyncClient against a local HTTP stub
+"""
+
+import asyncio
+
+import pytest
+
+from market_maker.rest.bitfinex.restv2_async import AsyncClient
+from market_maker.ws.bitfinex.event_loop import EventLoopThread
+
+
+@pytest.fixture
+def event_loop_thread():
+    event_loop = EventLoopThread()
+    yield event_loop
+    event_loop.call_soon(event_loop.loop.stop)
+
+
+def test_requests_run_on_the_clients_loop_without_a_requests_session(http_stub, event_loop_thread):
+    http_stub.default = [1]
+    client = AsyncClient(event_loop=event_loop_thread)
+    client.base_url = http_stub.url
+    assert client.session is None
+
+    assert client.submit(client.platform_status()).result(timeout=5) == [1]
+    assert client.aiohttp_session is not None
+    assert http_stub.requests == [('GET', '/v2/platform/status', '')]
+    client.submit(client.close()).result(timeout=5)
+
+
+def test_requests_from_another_loop_are_refused(event_loop_thread):
+    client = AsyncClient(event_loop=event_loop_thread)
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(RuntimeError):
+            loop.run_until_complete(client.platform_status())
+    finally:
+        loop.close()
+    client.submit(client.close()).result(timeout=5)
@@ -0,0 +1,120 @@
+"""
+BitMEXWebsocket tables fed from a journal, without connecting
+"""
+
+import json
+
+from market_maker.ws.bitmex.ws_journal import WsJournalWriter
+from market_maker.utils.wakeup import wakeup
+from market_maker.ws.bitmex.ws_thread import BitMEXWebsocket
+
+
+def instrument(symbol, bid, ask, tickSize=0.5):
+    return {'symbol': symbol, 'bidPrice': bid, 'askPrice': ask, 'lastPrice': bid, 'tickSize': tickSize,
+            'timestamp': '2026-10-17T00:00:00.000Z'}
+
+
+def quote(second, bid, ask, bidSize=100, askSize=100):
+    return {'symbol': 'XBTUSD', 'timestamp': '2026-10-17T00:00:%02d.000Z' % second,
+            'bidPrice': bid, 'bidSize': bidSize, 'askPrice': ask, 'askSize': askSize}
+
+
+def replay(tmp_path, ws, *messages):
+    path = str(tmp_path / ('journal-%d.gz' % len(list(tmp_path.iterdir()))))
+    journal = WsJournalWriter(path)
+    for message in messages:
+        journal.write(json.dumps(message))
+    journal.close()
+    ws.replay(path, 'XBTUSD')
+
+
+def test_ticker_is_cached_until_its_instrument_changes(tmp_path):
+    ws = BitMEXWebsocket()
+    replay(tmp_path, ws, {'table': 'instrument', 'action': 'partial', 'keys': ['symbol'],
+                          'data': [instrument('XBTUSD', 9000.0, 9001.0), instrument('ETHUSD', 200.0, 200.05, 0.05)]})
+    ticker = ws.get_ticker('XBTUSD')
+    assert ticker == {'last': 9000.0, 'buy': 9000.0, 'sell': 9001.0, 'mid': 9000.5}
+    assert ws.get_ticker('XBTUSD') is ticker
+    assert ws.get_instrument('XBTUSD')['tickLog'] == 1
+
+    # Another symbol's update leaves the cached ticker alone
+    replay(tmp_path, ws, {'table': 'instrument', 'action': 'update',
+                          'data': [{'symbol': 'ETHUSD', 'bidPrice': 201.0}]})
+    assert ws.get_ticker('XBTUSD') is ticker
+    assert ws.get_ticker('ETHUSD')['buy'] == 201.0
+
+    replay(tmp_path, ws, {'table': 'instrument', 'action': 'update',
+                          'data': [{'symbol': 'XBTUSD', 'bidPrice': 9000.5, 'askPrice': 9002.0}]})
+    assert ws.get_ticker('XBTUSD') == {'last': 9000.0, 'buy': 9000.5, 'sell': 9002.0, 'mid': 9001.0}
+
+
+def test_quotes_wake_the_robot_only_when_the_top_of_book_price_moves(tmp_path):
+    ws = BitMEXWebsocket()
+    wakeup.wait(0)
+    replay(tmp_path, ws, {'table': 'quote', 'action': 'partial', 'data': [quote(0, 9000.0, 9000.5)]})
+    assert wakeup.wait(0) == {'quote'}
+
+    # Only the sizes changed
+    replay(tmp_path, ws, {'table': 'quote', 'action': 'insert', 'data': [quote(1, 9000.0, 9000.5, 250, 50)]})
+    assert wakeup.wait(0) == set()
+
+    replay(tmp_path, ws, {'table': 'quote', 'action': 'insert', 'data': [quote(2, 9000.0, 9001.0)]})
+    assert wakeup.wait(0) == {'quote'}
+
+    # A reconnect's partial repeating the rows we already have moves nothing
+    replay(tmp_path, ws, {'table': 'quote', 'action': 'partial', 'data': [quote(2, 9000.0, 9001.0)]})
+    assert wakeup.wait(0) == set()
+
+
+def test_rest_order_rows_survive_concurrent_websocket_publishes(tmp_path):
+    import threading
+    import time
+
+    ws = BitMEXWebsocket()
+    replay(tmp_path, ws,
+           {'table': 'order', 'action': 'partial', 'keys': ['orderID'], 'data': []},
+           {'table': 'margin', 'action': 'partial', 'keys': ['account'],
+            'data': [{'account': 1, 'walletBalance': 100000000, 'marginBalance': 100000000}]})
+
+    # Widen the window between reading the current snapshot and swapping in the next one
+    convert_margin = ws._BitMEXWebsocket__convert_margin
+
+    def slow_convert_margin(margin):
+        time.sleep(0.001)
+        return convert_margin(margin)
+    ws._BitMEXWebsocket__convert_margin = slow_convert_margin
+
+    # A snapshot swapped in from a stale copy would drop orders another thread had published
+    shrunk = []
+    done = threading.Event()
+
+    def watch():
+        seen = 0
+        while not done.is_set():
+            count = len(ws.get_snapshot().orders)
+            if count < seen:
+                shrunk.append((seen, count))
+            seen = max(seen, count)
+
+    def create_orders(thread):
+        for i in range(100):
+            ws.apply_order_responses([{'orderID': '%d-%d' % (thread, i), 'clOrdID': 'mm_test_', 'ordStatus': 'New',
+                                       'leavesQty': 100, 'cumQty': 0, 'side': 'Buy', 'price': 9000.0,
+                                       'timestamp': '2026-10-17T00:00:00.000Z'}])
+            time.sleep(0.0005)
+
+    threads = [threading.Thread(target=create_orders, args=(thread,)) for thread in range(3)]
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    for thread in threads:
+        thread.start()
+    replay(tmp_path, ws, *[{'table': 'margin', 'action': 'update',
+                            'data': [{'account': 1, 'walletBalance': 100000000 + i, 'marginBalance': 100000000}]}
+                           for i in range(200)])
+    for thread in threads:
+        thread.join()
+    done.set()
+    watcher.join()
+
+    assert shrunk == []
+    assert len(ws.get_snapshot().orders) == 300